@@ -0,0 +1,236 @@
+#-------------------------------------------------------------------------------
+# Name:        FFRMS_Raster_QC_Cache.py
+# Purpose:     File fingerprints, a size-bounded LRU cache of derived datasets and
+#              a local staging cache of the rasters for the FFRMS raster QC tool.
+#              Standard library only, so it can be imported by the ArcGIS tool as
+#              well as by the NumPy engine.
+# Author:      Rachel Fan, GISP
+#              rachel.fan@stantec.com
+# Version:     1.5
+# Updated:     10/17/2026
+# Created:     10/17/2026
+# Copyright:   (c) rfan2023
+
+#-------------------------------------------------------------------------------
+
+import os
+import json
+import time
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+INDEX_NAME = "cache_index.json"
+FINGERPRINTS_NAME = "fingerprints.json"
+HASH_CHUNK = 8 * 1024 * 1024   #bytes read per hashing step
+STAGING_INDEX_NAME = "staging_index.json"
+STAGING_BYTES = 50 * 1024**3   #default size limit of the local staging cache
+STAGE_WORKERS = 4   #rasters copied to the staging cache at the same time
+SIDECAR_SUFFIXES = ('.aux.xml', '.ovr', '.vat.dbf', '.qctiles.json')   #files next to a raster staged with it
+
+_hashes = {}   #fingerprints of files copied by this process (see copyHashed), by absolute path
+_in_use = set()   #keys of the cachedConversion outputs handed out by this process, never evicted by it
+
+
+def loadIndex(cacheFolder, name=INDEX_NAME):
+    """Read a JSON index of the cache folder, or return an empty one."""
+    path = os.path.join(cacheFolder, name)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        print("Cache index " + path + " is unreadable and will be rebuilt.")
+        return {}
+
+def saveIndex(cacheFolder, index, name=INDEX_NAME):
+    """Write a JSON index of the cache folder, replacing the old one in one step."""
+    path = os.path.join(cacheFolder, name)
+    with open(path + ".tmp", "w") as index_file:
+        json.dump(index, index_file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def folderSize(path):
+    """Total size in bytes of the files under path (or of path itself if it is a file)."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def fileFingerprint(path, cacheFolder):
+    """Content fingerprint (BLAKE2b of the file bytes) of path.
+
+    The hash is remembered in cacheFolder by path, size and modification time, so an unchanged
+    file is only read once.
+    """
+    stat = os.stat(path)
+    copied = _hashes.get(os.path.abspath(path))
+    if copied and copied["size"] == stat.st_size and copied["mtime"] == stat.st_mtime:
+        return copied["hash"]
+    fingerprints = loadIndex(cacheFolder, FINGERPRINTS_NAME)
+    known = fingerprints.get(os.path.abspath(path))
+    if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+        return known["hash"]
+
+    fingerprint = fileHash(path)
+    fingerprints[os.path.abspath(path)] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": fingerprint}
+    saveIndex(cacheFolder, fingerprints, FINGERPRINTS_NAME)
+    return fingerprint
+
+def fileHash(path):
+    """BLAKE2b hash of the bytes of path, as used by fileFingerprint."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def copyHashed(source, target):
+    """Copy source to target, keeping its modification time, and hash the bytes on the way (one read of source).
+
+    Returns the fingerprint of the copy, which fileFingerprint then uses without reading it again.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        for chunk in iter(lambda: src.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+            dst.write(chunk)
+    shutil.copystat(source, target)
+    stat = os.stat(target)
+    _hashes[os.path.abspath(target)] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": digest.hexdigest()}
+    return digest.hexdigest()
+
+def evictLRU(cacheFolder, index, maxBytes, keep=()):
+    """Delete the least recently used entries until the cache holds at most maxBytes.
+
+    Entries listed in keep are never evicted. Returns the number of evicted entries.
+    """
+    total = sum(entry["size"] for entry in index.values())
+    evicted = 0
+    for key, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+        if total <= maxBytes:
+            break
+        if key in keep:
+            continue
+        shutil.rmtree(os.path.join(cacheFolder, key), ignore_errors=True)
+        total -= entry["size"]
+        del index[key]
+        evicted += 1
+    return evicted
+
+def rasterSidecars(path):
+    """Files next to a raster that belong to it: its world file and the SIDECAR_SUFFIXES files."""
+    folder, name = os.path.split(path)
+    names = [name + suffix for suffix in SIDECAR_SUFFIXES] + [os.path.splitext(name)[0] + '.tfw']
+    return [os.path.join(folder, sidecar) for sidecar in names if os.path.isfile(os.path.join(folder, sidecar))]
+
+def stageRasters(rasters, stagingFolder, maxBytes=STAGING_BYTES, workers=STAGE_WORKERS, verify=False):
+    """Local copies of rasters on a network share, kept in stagingFolder (e.g. on a local SSD) between runs.
+
+    rasters maps keys to paths (None for a missing raster). The rasters not staged yet, or changed since
+    (size or modification time), are copied with their sidecars, workers at a time, and hashed while
+    copied. A staged copy is reused while its raster is unchanged; with verify, the copy is also hashed
+    again and recopied if it no longer matches. Entries are evicted least recently used first to keep the
+    cache within maxBytes; a raster that does not fit is read from the share. Returns the same mapping
+    with the paths of the local copies.
+    """
+    if not os.path.exists(stagingFolder):
+        os.makedirs(stagingFolder)
+    index = loadIndex(stagingFolder, STAGING_INDEX_NAME)
+    staged, to_copy = {}, []
+    for path in dict.fromkeys(path for path in rasters.values() if path):
+        key = hashlib.blake2b(os.path.abspath(path).encode(), digest_size=16).hexdigest()
+        local = os.path.join(stagingFolder, key, os.path.basename(path))
+        stat, entry = os.stat(path), index.get(key)
+        fresh = (entry is not None and entry["source_size"] == stat.st_size and entry["source_mtime"] == stat.st_mtime
+                 and os.path.exists(local) and os.path.getsize(local) == stat.st_size
+                 and os.path.getmtime(local) == stat.st_mtime)
+        if fresh and verify and fileHash(local) != entry["hash"]:
+            print("Staged copy of " + os.path.basename(path) + " does not match its checksum and is copied again.")
+            fresh = False
+        if fresh:
+            staged[path] = (key, local)
+            _hashes[os.path.abspath(local)] = {"size": stat.st_size, "mtime": os.stat(local).st_mtime, "hash": entry["hash"]}
+        else:
+            if index.pop(key, None) is not None:
+                shutil.rmtree(os.path.dirname(local), ignore_errors=True)
+            to_copy.append((path, key, local, stat))
+
+    # room for the copies: evict the entries of other rasters, then copy what fits, largest first
+    evictLRU(stagingFolder, index, maxBytes - sum(item[3].st_size for item in to_copy),
+             keep=[key for key, local in staged.values()])
+    room = maxBytes - sum(entry["size"] for entry in index.values())
+    fitting = []
+    for item in sorted(to_copy, key=lambda item: -item[3].st_size):
+        size = item[3].st_size + sum(os.path.getsize(sidecar) for sidecar in rasterSidecars(item[0]))
+        if size <= room:
+            fitting.append(item)
+            room -= size
+        else:
+            print(os.path.basename(item[0]) + " does not fit in the staging cache and is read from " + os.path.dirname(item[0]))
+
+    def stage(item):
+        path, key, local, stat = item
+        shutil.rmtree(os.path.dirname(local), ignore_errors=True)
+        os.makedirs(os.path.dirname(local))
+        fingerprint = copyHashed(path, local)
+        for sidecar in rasterSidecars(path):
+            shutil.copy2(sidecar, os.path.dirname(local))
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime) != (stat.st_size, stat.st_mtime):
+            raise OSError(os.path.basename(path) + " changed while it was copied")
+        return fingerprint
+
+    if fitting:
+        print("Staging " + str(len(fitting)) + " raster(s) to " + stagingFolder)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for item, future in [(item, executor.submit(stage, item)) for item in fitting]:
+            path, key, local, stat = item
+            try:
+                fingerprint = future.result()
+            except OSError as error:
+                print("Could not stage " + os.path.basename(path) + " (" + str(error) + "); it is read from the share.")
+                shutil.rmtree(os.path.dirname(local), ignore_errors=True)
+                continue
+            index[key] = {"source": os.path.abspath(path), "source_size": stat.st_size, "source_mtime": stat.st_mtime,
+                          "hash": fingerprint, "size": folderSize(os.path.dirname(local))}
+            staged[path] = (key, local)
+    for key, local in staged.values():
+        index[key]["last_used"] = time.time()
+    saveIndex(stagingFolder, index, STAGING_INDEX_NAME)
+    return {key: staged[path][1] if path in staged else path for key, path in rasters.items()}
+
+def cachedConversion(cacheFolder, sourcePath, params, convert, outName, maxBytes):
+    """Return the output of convert for sourcePath, producing it only if it is not cached yet.
+
+    The cache key is the content fingerprint of sourcePath plus the conversion params (any
+    JSON-serializable value). convert(out_path) must write the output dataset outName (e.g. a
+    shapefile and its side files) at out_path inside the entry folder. Entries are evicted least
+    recently used first once the cache is larger than maxBytes; the outputs already returned in this
+    run are kept, since the caller may still be using them.
+    """
+    if not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder)
+    fingerprint = fileFingerprint(sourcePath, cacheFolder)
+    key = hashlib.blake2b(json.dumps([fingerprint, params, outName]).encode(), digest_size=16).hexdigest()
+    entry_folder = os.path.join(cacheFolder, key)
+    out_path = os.path.join(entry_folder, outName)
+
+    index = loadIndex(cacheFolder)
+    if key in index and os.path.exists(out_path):
+        print("Using cached " + outName + " of " + os.path.basename(sourcePath))
+    else:
+        shutil.rmtree(entry_folder, ignore_errors=True)
+        os.makedirs(entry_folder)
+        convert(out_path)
+        index[key] = {"source": os.path.abspath(sourcePath), "params": params, "output": outName,
+                      "size": folderSize(entry_folder)}
+    index[key]["last_used"] = time.time()
+    _in_use.add(key)
+    evictLRU(cacheFolder, index, maxBytes, keep=_in_use)
+    saveIndex(cacheFolder, index)
+    return out_path
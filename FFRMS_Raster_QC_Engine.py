@@ -0,0 +1,1901 @@
+#-------------------------------------------------------------------------------
+# Name:        FFRMS_Raster_QC_Engine.py
+# Purpose:     NumPy comparison engine for the FFRMS raster QC tool. Reads the FVA
+#              GeoTIFFs in block windows, so the checks can run on machines
+#              without an ArcGIS / Spatial Analyst license.
+# Author:      Rachel Fan, GISP
+#              rachel.fan@stantec.com
+# Version:     1.5
+# Updated:     10/17/2026
+# Created:     10/17/2026
+# Copyright:   (c) rfan2023
+
+#-------------------------------------------------------------------------------
+
+import os
+import re
+import sys
+import csv
+import json
+import math
+import time
+import argparse
+import threading
+from datetime import timedelta
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import rasterio
+import fiona
+from affine import Affine
+from rasterio.crs import CRS
+from rasterio.features import shapes
+from rasterio.windows import Window, transform as window_transform
+from scipy import ndimage
+
+import FFRMS_Raster_QC_Cache as qccache
+import FFRMS_Raster_QC_Header as qcheader
+import FFRMS_Raster_QC_Masks as qcmasks
+import FFRMS_Raster_QC_Kernels as qckernels
+# the RemapRange tables and tolerance bands, shared with the ArcGIS tool
+from FFRMS_Raster_QC_Remap import CELL_REMAP, PCT02_REMAP, TOLERANCE, cellRemap, parseTolerances
+
+
+MASK_NODATA = 255   #NoData value of the uint8 reclassify arrays
+BLOCK_SIZE = 1024   #rows/columns read per block window
+
+TILE_INDEX_SIZE = 256   #rows/columns per tile of the valid-data tile index
+TILE_INDEX_SUFFIX = ".qctiles.json"   #sidecar next to the .tif
+PYRAMID_LEVELS = 4   #levels of the block min/max pyramid (tiles of 256, 512, 1024 and 2048 cells)
+PAIR_STATS_FILE = "pair_stats.json"   #per-tile difference stats of the pairs, in the temp folder
+HIST_BIN_WIDTH = 0.05   #width of the difference histogram bins of a pair
+
+MEMORY_FRACTION = 0.5   #share of the free RAM used as the budget when none is given
+GDAL_CACHE_MB = 64   #GDAL block cache (MB) of each process of a pass
+BASE_MEMORY = 320 * 2**20   #bytes of a pass besides its blocks: interpreter, libraries, GDAL cache, tile stats
+WORKER_MEMORY = 160 * 2**20   #bytes of a worker process besides its blocks
+EXPORT_CELL_BYTES = 12   #bytes per cell of the common grid of a pair export (extent mask, labels, polygonize)
+WORKER_BUFFERS = {}   #blockBuffers of a worker process, kept between its blocks
+READ_THREADS = 4   #reader threads of the block prefetch (see prefetchBlocks)
+PREFETCH_DEPTH = 2   #blocks read ahead of the block being evaluated
+MAP_READS = True   #read uncompressed GeoTIFFs in place through np.memmap instead of GDAL (see rasterMap)
+RASTER_MAPS = {}   #rasterMap of the rasters read by this process, by path
+WORKING_INDEX = "working_copies.json"   #sources of the uncompressed working copies, in their folder
+WORKING_CHUNK = 64 * 2**20   #bytes of a raster copied per step into its working copy
+
+LEVEL_PATTERN = r'\d+FVA'   #freeboard level key in the raster file names (00FVA, 01FVA, ...)
+PCT02_KEY = "0_2PCT"
+
+# arcpy Raster.pixelType codes for the numpy data types
+PIXEL_TYPES = {'uint8': 'U8', 'int8': 'S8', 'uint16': 'U16', 'int16': 'S16', 'uint32': 'U32',
+               'int32': 'S32', 'float32': 'F32', 'float64': 'F64'}
+
+
+def iterBlockWindows(width, height, blockSize=BLOCK_SIZE):
+    """Yield the block windows covering a width x height grid, row by row."""
+    for row in range(0, height, blockSize):
+        for col in range(0, width, blockSize):
+            yield Window(col, row, min(blockSize, width - col), min(blockSize, height - row))
+
+def levelNumber(level):
+    """Numeric part of a freeboard level key, e.g. 2 for 02FVA."""
+    match = re.search(r'\d+', level)
+    return int(match.group()) if match else 0
+
+def qcPairs(levels, with02=False, tolerances=(TOLERANCE,)):
+    """Checked pairs for an ordered stack of freeboard levels.
+
+    Each pair is a dict with the lower and higher keys, the QC CSV label, the extent shapefile, reclassify
+    mask and violation points names, the remap table, the stack index of the lower and higher rasters
+    and the value fields of the points shapefile (ValueDiff = second field - first field). Adjacent
+    levels are compared with cellRemap(tolerances[0]); the 0_2PCT raster is compared with the lowest level.
+    "tolerances" lists the pass bands checked for a pair, the first one being that of its remap table
+    (none for the 0_2PCT pair).
+    """
+    pairs = []
+    for index in range(len(levels) - 1):
+        lower, higher = levels[index], levels[index + 1]
+        pairs.append({"lower": lower, "higher": higher, "label": f"{higher} vs {lower}",
+                      "extent_name": f"diffFva{levelNumber(lower)}_{levelNumber(higher)}",
+                      "reclassify_name": f"reclassify{index + 1}",
+                      "points_name": f"cellDiff{levelNumber(higher)}_{levelNumber(lower)}_pts",
+                      "remap": cellRemap(tolerances[0]), "tolerances": list(tolerances),
+                      "lower_index": index, "higher_index": index + 1, "fields": [lower, higher]})
+    if with02:
+        # named and signed as extractCellValue02: fields 0_2PCT, 00FVA and ValueDiff = 00FVA - 0_2PCT
+        pairs.append({"lower": levels[0], "higher": PCT02_KEY, "label": f"02PCT vs {levels[0]}",
+                      "extent_name": f"diffFva{levelNumber(levels[0])}_02", "reclassify_name": "reclassify02",
+                      "points_name": "cellDiff_02_pts", "remap": PCT02_REMAP, "tolerances": [],
+                      "lower_index": 0, "higher_index": len(levels), "fields": [PCT02_KEY, levels[0]]})
+    return pairs
+
+def validMask(arr, nodata, out=None, work=None):
+    """Return a boolean array that is True where arr holds data: not the NoData value, and not NaN.
+
+    NaN is never data, whatever the NoData value. out (bool, shape of arr) is filled in place when given,
+    and work (the same) holds the NaN test of a float arr with a numeric NoData value; else they are allocated.
+    """
+    out = np.empty(arr.shape, dtype=bool) if out is None else out
+    if nodata is None:
+        out.fill(True)
+    elif np.isnan(nodata):
+        return np.logical_not(np.isnan(arr, out=out), out=out)
+    else:
+        np.not_equal(arr, nodata, out=out)
+    if arr.dtype.kind == 'f':
+        nan = np.isnan(arr) if work is None else np.isnan(arr, out=work)
+        np.greater(out, nan, out=out)   # out and not nan
+    return out
+
+def remapBounds(low, high, dtype):
+    """The [low, high] range of a RemapRange row as values of dtype, so differences of dtype are compared
+    without a cast to float64.
+
+    Float bounds are rounded inwards to the nearest values of dtype (low up, high down), so lo <= d <= hi
+    holds for a difference d of dtype exactly when low <= d <= high holds for the decimal bounds: a float32
+    difference of 0.95 (0.949999988) is <= 0.95 and flagged, the next float32 above it passes. Integer
+    bounds are rounded inwards to whole numbers.
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        lo, hi = dtype.type(low), dtype.type(high)
+        if float(lo) < low:
+            lo = np.nextafter(lo, dtype.type(np.inf))
+        if float(hi) > high:
+            hi = np.nextafter(hi, dtype.type(-np.inf))
+        return lo, hi
+    info = np.iinfo(dtype)
+    return dtype.type(min(max(math.ceil(low), info.min), info.max)), dtype.type(max(min(math.floor(high), info.max), info.min))
+
+def reclassifyArray(diff, valid, remap, out=None, work=None):
+    """Vectorized equivalent of arcpy.sa.Reclassify with a RemapRange table.
+
+    Cells outside the data (valid, see validMask), values not covered by any range and NaN differences are
+    set to MASK_NODATA; a value on the boundary of two ranges goes to the first (lower) one. The comparisons
+    are made in the dtype of diff with the bounds of remapBounds. out (uint8, shape of diff) is filled in
+    place when given, and work, a (2,) + diff.shape bool array, holds the range tests; else they are allocated.
+    """
+    out = np.empty(diff.shape, dtype=np.uint8) if out is None else out
+    hit, inside = np.empty((2,) + diff.shape, dtype=bool) if work is None else work
+    out.fill(MASK_NODATA)
+    # last range first, so a value in two ranges ends up with the first one
+    for low, high, new_value in reversed(remap):
+        low, high = remapBounds(low, high, diff.dtype)
+        np.greater_equal(diff, low, out=hit)
+        np.less_equal(diff, high, out=inside)
+        hit &= inside
+        hit &= valid
+        np.copyto(out, new_value, where=hit)
+    return out
+
+def checkSameGrid(ds_a, ds_b):
+    """Raise ValueError if two rasters cannot be compared cell by cell without resampling."""
+    res_a, res_b = ds_a.res, ds_b.res
+    if not (np.isclose(res_a[0], res_b[0]) and np.isclose(res_a[1], res_b[1])):
+        raise ValueError(f"Cell sizes differ ({ds_a.name}: {res_a}, {ds_b.name}: {res_b}). "
+                         "Use the ArcPy engine to compare rasters that need resampling.")
+
+def gridOffset(ds, ref_transform):
+    """(row, col) of the upper left cell of ds on the ref_transform grid, from the two geotransforms.
+
+    The rasters have the same cell size (see checkSameGrid), so the offset is a whole number of cells; a
+    grid that is not snapped to the reference grid (reported by the pre-flight check) goes to the nearest cell.
+    """
+    return (int(round((ds.transform.f - ref_transform.f) / ref_transform.e)),
+            int(round((ds.transform.c - ref_transform.c) / ref_transform.a)))
+
+def sourceWindow(ds, window, ref_transform):
+    """The window of ds cells covering a block window defined on the ref_transform grid (may reach outside ds)."""
+    if ds.transform == ref_transform:
+        return window
+    row, col = gridOffset(ds, ref_transform)
+    return Window(window.col_off - col, window.row_off - row, window.width, window.height)
+
+def overlapWindow(ds, srcWindow):
+    """The part of a window of ds cells (from sourceWindow) that lies inside ds, or None if there is none."""
+    r0, c0 = max(int(srcWindow.row_off), 0), max(int(srcWindow.col_off), 0)
+    r1 = min(int(srcWindow.row_off + srcWindow.height), ds.height)
+    c1 = min(int(srcWindow.col_off + srcWindow.width), ds.width)
+    if r1 <= r0 or c1 <= c0:
+        return None
+    return Window(c0, r0, c1 - c0, r1 - r0)
+
+def rasterMap(ds):
+    """The file of ds memory mapped for reading its cells in place, or None when GDAL has to decode them.
+
+    Only uncompressed GeoTIFFs in the byte order of the machine are mapped (see qcheader.dataLayout); LZW
+    and DEFLATE rasters are read with GDAL as before. Returns a dict with the layout, the file mapped as
+    bytes, and "image", a (height, width) view of all cells when the strips lie one after the other (as
+    in writeWorkingCopy), else None. Maps are kept for the process while the file is unchanged.
+    """
+    if not MAP_READS:
+        return None
+    try:
+        stat = os.stat(ds.name)
+    except OSError:
+        return None
+    key = os.path.abspath(ds.name)
+    known = RASTER_MAPS.get(key)
+    if known is None or known[:2] != (stat.st_size, stat.st_mtime):
+        layout = qcheader.dataLayout(ds.name)
+        mapped = None
+        if layout and np.dtype(layout["dtype"]).isnative and np.dtype(layout["dtype"]) == np.dtype(ds.dtypes[0]):
+            mapped = {"layout": layout, "file": np.memmap(ds.name, dtype=np.uint8, mode='r'), "image": None}
+            offsets = np.asarray(layout["offsets"], dtype=np.int64)
+            strip_bytes = layout["block"][0] * layout["block"][1] * np.dtype(layout["dtype"]).itemsize
+            if not layout["tiled"] and np.all(np.diff(offsets) == strip_bytes):
+                mapped["image"] = np.ndarray((layout["height"], layout["width"]), dtype=layout["dtype"],
+                                             buffer=mapped["file"], offset=int(offsets[0]))
+        known = RASTER_MAPS[key] = (stat.st_size, stat.st_mtime, mapped)
+    return known[2]
+
+def readMapped(mapped, window, out=None):
+    """Cells of a window inside a raster from its rasterMap, without decoding.
+
+    With out None, a window inside one strip run or tile is returned as a read-only view of the file
+    (zero copy); otherwise the strips or tiles it covers are copied into out (or a new array) once.
+    """
+    layout = mapped["layout"]
+    r0, c0 = int(window.row_off), int(window.col_off)
+    r1, c1 = r0 + int(window.height), c0 + int(window.width)
+    if mapped["image"] is not None:
+        if out is None:
+            return mapped["image"][r0:r1, c0:c1]
+        np.copyto(out, mapped["image"][r0:r1, c0:c1])
+        return out
+    block_w, block_h = layout["block"]
+    tiles_x = -(-layout["width"] // block_w)
+    def block(block_row, block_col):
+        rows = min(block_h, layout["height"] - block_row * block_h) if not layout["tiled"] else block_h
+        return np.ndarray((rows, block_w), dtype=layout["dtype"], buffer=mapped["file"],
+                          offset=layout["offsets"][block_row * tiles_x + block_col])
+    first_row, last_row = r0 // block_h, (r1 - 1) // block_h
+    first_col, last_col = c0 // block_w, (c1 - 1) // block_w
+    if out is None:
+        if first_row == last_row and first_col == last_col:
+            top, left = first_row * block_h, first_col * block_w
+            return block(first_row, first_col)[r0 - top:r1 - top, c0 - left:c1 - left]
+        out = np.empty((r1 - r0, c1 - c0), dtype=layout["dtype"])
+    for block_row in range(first_row, last_row + 1):
+        top, bottom = max(r0, block_row * block_h), min(r1, (block_row + 1) * block_h)
+        for block_col in range(first_col, last_col + 1):
+            left, right = max(c0, block_col * block_w), min(c1, (block_col + 1) * block_w)
+            out[top - r0:bottom - r0, left - c0:right - c0] = block(block_row, block_col)[
+                top - block_row * block_h:bottom - block_row * block_h, left - block_col * block_w:right - block_col * block_w]
+    return out
+
+def readBlock(ds, window, ref_transform, tileIndex=None, out=None):
+    """Read band 1 of ds over a block window defined on the ref_transform grid.
+
+    Cells outside ds are filled with its NoData value, like the UnionOf extent in RasterCalculator: only the
+    part of the block inside ds is read, into a NoData block, so no grid larger than a block is allocated.
+    If the tile index of ds shows no data in the window, the NoData block is returned without a read.
+    With out (a rows x cols array, e.g. a plane of a preallocated stack), the block is read into it.
+    An uncompressed raster is read in place (see rasterMap): without out, a block inside it is then a
+    read-only view of the file, with out it is copied into out without passing through GDAL.
+    """
+    src_window = sourceWindow(ds, window, ref_transform)
+    rows, cols = int(window.height), int(window.width)
+    read_window = overlapWindow(ds, src_window)
+    has_data = read_window is not None and (tileIndex is None or windowHasData(tileIndex, src_window))
+    whole = has_data and (read_window.height, read_window.width) == (rows, cols)
+    mapped = rasterMap(ds) if has_data else None
+    if out is None:
+        if whole:
+            return ds.read(1, window=read_window) if mapped is None else readMapped(mapped, read_window)
+        out = np.empty((rows, cols), dtype=ds.dtypes[0])
+    if not whole:
+        out.fill(ds.nodata if ds.nodata is not None else 0)
+    if has_data:
+        row, col = int(read_window.row_off - src_window.row_off), int(read_window.col_off - src_window.col_off)
+        part = out[row:row + int(read_window.height), col:col + int(read_window.width)]
+        if mapped is None:
+            ds.read(1, window=read_window, out=part)
+        else:
+            readMapped(mapped, read_window, part)
+    return out
+
+def writeWorkingCopy(source, target):
+    """Write source as an uncompressed, stripped GeoTIFF at target, with the strips one after the other, so all its
+    cells can be read in place as one array (see rasterMap). The rows are copied in order, in chunks of
+    WORKING_CHUNK bytes, as the streamable layout needs."""
+    with rasterio.open(source) as src:
+        profile = {key: value for key, value in src.profile.items()
+                   if key not in ("compress", "predictor", "tiled", "blockxsize", "blockysize", "interleave")}
+        rows = max(1, WORKING_CHUNK // (src.width * src.count * np.dtype(src.dtypes[0]).itemsize))
+        with rasterio.open(target, 'w', **dict(profile, compress="none", tiled=False, BIGTIFF="IF_SAFER",
+                                                  STREAMABLE_OUTPUT="YES")) as dst:
+            dst.update_tags(**src.tags())
+            for row in range(0, src.height, rows):
+                window = Window(0, row, src.width, min(rows, src.height - row))
+                dst.write(src.read(window=window), window=window)
+
+def workingCopies(rasters, workingFolder):
+    """Uncompressed local copies of rasters for the comparison reads.
+
+    rasters maps keys to GeoTIFF paths (None when missing), as detectRasters. Each raster is copied to
+    workingFolder under its own file name by writeWorkingCopy, which LZW or DEFLATE rasters cannot be
+    read in place without, and the copy is kept for the next runs until the source changes (size and
+    modification time, kept in WORKING_INDEX). Returns the same mapping with the paths of the copies.
+    """
+    if not os.path.exists(workingFolder):
+        os.makedirs(workingFolder)
+    index = qccache.loadIndex(workingFolder, WORKING_INDEX)
+    copies = {}
+    for key, path in rasters.items():
+        if not path:
+            copies[key] = path
+            continue
+        target = os.path.join(workingFolder, os.path.basename(path))
+        stat = os.stat(path)
+        known = index.get(os.path.basename(path))
+        if not (known and known["source"] == os.path.abspath(path) and known["size"] == stat.st_size
+                and known["mtime"] == stat.st_mtime and os.path.exists(target)
+                and known["copy_mtime"] == os.stat(target).st_mtime):
+            print("Writing an uncompressed working copy of " + os.path.basename(path))
+            RASTER_MAPS.pop(os.path.abspath(target), None)   # a mapped file cannot be replaced on Windows
+            writeWorkingCopy(path, target + ".tmp")
+            os.replace(target + ".tmp", target)
+            index[os.path.basename(path)] = {"source": os.path.abspath(path), "size": stat.st_size,
+                                             "mtime": stat.st_mtime, "copy_mtime": os.stat(target).st_mtime}
+            qccache.saveIndex(workingFolder, index, WORKING_INDEX)
+        copies[key] = target
+    return copies
+
+def openRasters(rasters, keys):
+    """Open the rasters of keys; print which of them are read in place (see rasterMap)."""
+    datasets = {key: rasterio.open(rasters[key]) for key in keys}
+    mapped = [key for key in keys if rasterMap(datasets[key])]
+    if mapped:
+        print(f"{len(mapped)} of {len(keys)} rasters are uncompressed and read in place: " + ", ".join(mapped))
+    return datasets
+
+def closeRasters(datasets):
+    """Close datasets opened by openRasters and release their maps."""
+    for ds in datasets.values():
+        RASTER_MAPS.pop(os.path.abspath(ds.name), None)
+        ds.close()
+
+def tileIndexPath(path):
+    return path + TILE_INDEX_SUFFIX
+
+def updateTileIndex(tiles, block, valid, row, col, height, width, tileSize=TILE_INDEX_SIZE):
+    """Merge the valid cells of a block into a tile index.
+
+    block holds the values and valid the valid-data mask of the block, with its upper left cell at (row, col)
+    of a raster of height x width cells (cells outside the raster are ignored). tiles maps (tile row, tile col)
+    to the bounding box [row0, col0, row1, col1) of the valid cells in the tile, in raster cells, followed
+    by the number of valid cells and their minimum and maximum value.
+    """
+    top, left = max(row, 0), max(col, 0)
+    bottom, right = min(row + valid.shape[0], height), min(col + valid.shape[1], width)
+    for tile_row in range(top // tileSize, (bottom - 1) // tileSize + 1) if bottom > top else ():
+        for tile_col in range(left // tileSize, (right - 1) // tileSize + 1) if right > left else ():
+            r0, c0 = max(top, tile_row * tileSize), max(left, tile_col * tileSize)
+            r1, c1 = min(bottom, (tile_row + 1) * tileSize), min(right, (tile_col + 1) * tileSize)
+            part = valid[r0 - row:r1 - row, c0 - col:c1 - col]
+            rows = np.flatnonzero(part.any(axis=1))
+            if rows.size == 0:
+                continue
+            cols = np.flatnonzero(part.any(axis=0))
+            values = block[r0 - row:r1 - row, c0 - col:c1 - col][part]
+            box = [r0 + int(rows[0]), c0 + int(cols[0]), r0 + int(rows[-1]) + 1, c0 + int(cols[-1]) + 1,
+                   int(values.size), float(values.min()), float(values.max())]
+            known = tiles.get((tile_row, tile_col))
+            if known:
+                box = [min(known[0], box[0]), min(known[1], box[1]), max(known[2], box[2]), max(known[3], box[3]),
+                       known[4] + box[4], min(known[5], box[5]), max(known[6], box[6])]
+            tiles[(tile_row, tile_col)] = box
+
+def windowHasData(tileIndex, window):
+    """True if a window of raster cells overlaps the valid-data bounding box of any tile of the index."""
+    tileSize, tiles = tileIndex["tile_size"], tileIndex["tiles"]
+    r0, c0 = int(window.row_off), int(window.col_off)
+    r1, c1 = r0 + int(window.height), c0 + int(window.width)
+    for tile_row in range(max(r0, 0) // tileSize, max(r1 - 1, 0) // tileSize + 1):
+        for tile_col in range(max(c0, 0) // tileSize, max(c1 - 1, 0) // tileSize + 1):
+            box = tiles.get((tile_row, tile_col))
+            if box and box[0] < r1 and r0 < box[2] and box[1] < c1 and c0 < box[3]:
+                return True
+    return False
+
+def dataWindows(datasets, transform, width, height, blockSize=BLOCK_SIZE, tileIndexes=None, skipBlock=None):
+    """Block windows of the common grid, without the blocks that hold no data in any of the datasets.
+
+    A block outside the extent of every dataset (e.g. in the corner of an L-shaped union) is left out.
+    tileIndexes lists the tile index of each dataset, or None for a dataset without one (read wherever it
+    overlaps the block). Blocks for which skipBlock(window) is True are left out as well.
+    """
+    tileIndexes = tileIndexes or [None] * len(datasets)
+    for window in iterBlockWindows(width, height, blockSize):
+        src_windows = [sourceWindow(ds, window, transform) for ds in datasets]
+        if any(overlapWindow(ds, src_window) is not None and (index is None or windowHasData(index, src_window))
+               for ds, src_window, index in zip(datasets, src_windows, tileIndexes)):
+            if skipBlock is None or not skipBlock(window):
+                yield window
+
+def buildPyramid(tileStats, tileSize, height, width, levels=PYRAMID_LEVELS):
+    """Block min/max pyramid of a height x width grid from per-tile stats.
+
+    tileStats maps (tile row, tile col) to (valid count, min, max) or (valid count, min, max, flagged
+    count). Level 0 has one cell per tile; each next level merges 2 x 2 cells of the previous one. Every
+    level is a dict of (tile rows, tile cols) arrays: count, min, max, flagged, and full (every cell of
+    the tile inside the grid is valid).
+    """
+    shape = (math.ceil(height / tileSize), math.ceil(width / tileSize))
+    count, flagged = np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64)
+    low, high = np.full(shape, np.inf), np.full(shape, -np.inf)
+    for (tile_row, tile_col), stats in tileStats.items():
+        count[tile_row, tile_col], low[tile_row, tile_col], high[tile_row, tile_col] = stats[:3]
+        flagged[tile_row, tile_col] = stats[3] if len(stats) > 3 else 0
+    rows = np.minimum(tileSize, height - np.arange(shape[0]) * tileSize)
+    cols = np.minimum(tileSize, width - np.arange(shape[1]) * tileSize)
+    pyramid = [{"count": count, "min": low, "max": high, "flagged": flagged, "full": count == np.outer(rows, cols)}]
+    for level in range(1, levels):
+        prev = pyramid[-1]
+        pad = ((0, prev["count"].shape[0] % 2), (0, prev["count"].shape[1] % 2))
+        def merge(arr, fill, reduce):
+            arr = np.pad(arr, pad, constant_values=fill)
+            return reduce(reduce(arr.reshape(arr.shape[0] // 2, 2, arr.shape[1] // 2, 2), axis=3), axis=1)
+        pyramid.append({"count": merge(prev["count"], 0, np.sum), "min": merge(prev["min"], np.inf, np.min),
+                        "max": merge(prev["max"], -np.inf, np.max), "flagged": merge(prev["flagged"], 0, np.sum),
+                        "full": merge(prev["full"], True, np.all)})
+    return {"tile_size": tileSize, "height": height, "width": width, "levels": pyramid}
+
+def windowStats(pyramid, window, level):
+    """(valid count, min, max, full, flagged count) bounds of a window of cells from one pyramid level.
+
+    The cells of the level that overlap the window are merged, so the bounds may be wider than the
+    window itself; full is only True if every cell of the window is valid.
+    """
+    cells = pyramid["tile_size"] * 2 ** level
+    r0, c0 = max(int(window.row_off), 0), max(int(window.col_off), 0)
+    r1 = min(int(window.row_off + window.height), pyramid["height"])
+    c1 = min(int(window.col_off + window.width), pyramid["width"])
+    if r1 <= r0 or c1 <= c0:
+        return 0, np.inf, -np.inf, False, 0
+    inside = (window.row_off >= 0 and window.col_off >= 0 and
+              window.row_off + window.height <= pyramid["height"] and window.col_off + window.width <= pyramid["width"])
+    stats = pyramid["levels"][level]
+    rows, cols = slice(r0 // cells, (r1 - 1) // cells + 1), slice(c0 // cells, (c1 - 1) // cells + 1)
+    return (int(stats["count"][rows, cols].sum()), float(stats["min"][rows, cols].min()),
+            float(stats["max"][rows, cols].max()), bool(inside and stats["full"][rows, cols].all()),
+            int(stats["flagged"][rows, cols].sum()))
+
+def diffBounds(lower, higher):
+    """(count, min, max) bounds of (higher - lower) from the window stats of two rasters.
+
+    The count is that of the lower raster (an upper bound of the cells where both hold data). A float32
+    rounding margin widens the bounds, so they also hold for the differences computed by evaluateBlock.
+    """
+    lower_count, lower_min, lower_max = lower[:3]
+    higher_count, higher_min, higher_max = higher[:3]
+    if lower_count == 0 or higher_count == 0:
+        return 0, np.inf, -np.inf
+    margin = 4 * np.finfo(np.float32).eps * max(abs(lower_min), abs(lower_max), abs(higher_min), abs(higher_max))
+    return lower_count, higher_min - lower_max - margin, higher_max - lower_min + margin
+
+def pairPasses(lower, higher, remap, diff=None):
+    """True if window stats prove that no cell of a pair is flagged by the extent or the cell value check.
+
+    diff, the window stats of the pair's own differences from an earlier run, gives exact bounds. Without it
+    the bounds come from the stats of the two rasters: the extent check passes when the lower raster has no
+    data or the higher raster is full, and the cell value check when (higher - lower) is bounded inside the
+    pass band of remap. A value on the lower edge of the pass band is flagged, as in Reclassify.
+    """
+    low, high = passBand(remap)
+    if diff is not None:
+        count, diff_min, diff_max, full, flagged = diff
+        return flagged == 0 and (count == 0 or (low < diff_min and diff_max <= high))
+    if lower[0] == 0:
+        return True
+    if not higher[3]:
+        return False
+    count, diff_min, diff_max = diffBounds(lower, higher)
+    return low < diff_min and diff_max <= high
+
+def screenBlock(datasets, pyramids, pairs, transform, pairPyramids=None):
+    """Coarse-to-fine screening function for dataWindows: True for a block where every pair provably passes.
+
+    pyramids are the min/max pyramids of the datasets, pairPyramids those of the pair differences (None for a
+    pair without one). Each block is tested on the coarsest pyramid level first; only when that is not
+    conclusive are the finer levels, down to single tiles, used. A pair passes when it passes its remap
+    table and the table of every one of its tolerances.
+    """
+    pairPyramids = pairPyramids or [None] * len(pairs)
+    def skipBlock(window):
+        src_windows = [sourceWindow(ds, window, transform) for ds in datasets]
+        for level in reversed(range(len(pyramids[0]["levels"]))):
+            stats = [windowStats(pyramid, src_window, level) for pyramid, src_window in zip(pyramids, src_windows)]
+            if all(pairPasses(stats[pair["lower_index"]], stats[pair["higher_index"]], remap,
+                              windowStats(pair_pyramid, window, level) if pair_pyramid else None)
+                   for pair, pair_pyramid in zip(pairs, pairPyramids)
+                   for remap in [pair["remap"]] + [cellRemap(tolerance) for tolerance in pair["tolerances"][1:]]):
+                return True
+        return False
+    return skipBlock
+
+def histogramEdges(remap, binWidth=HIST_BIN_WIDTH):
+    """Fixed bin edges of the (higher - lower) histogram of a pair: binWidth wide bins over the range of remap."""
+    low, high = remap[0][0], remap[-1][1]
+    return low + binWidth * np.arange(int(round((high - low) / binWidth)) + 1)
+
+def dtypeEdges(edges, dtype):
+    """Histogram edges rounded up to a float dtype, so d >= edge is decided for a difference d of dtype as
+    for the decimal edges, without a float64 copy of the differences. Other dtypes keep the edges as they are."""
+    if np.dtype(dtype).kind != 'f':
+        return edges
+    rounded = edges.astype(dtype)
+    return np.where(rounded < edges, np.nextafter(rounded, np.inf), rounded)
+
+def updatePairStats(tiles, diff, both, flagged, row, col, edges, tileSize=TILE_INDEX_SIZE):
+    """Merge the differences of a pair over one block into its per-tile stats.
+
+    diff is (higher - lower), both the cells where both rasters hold data and flagged the extent flags of
+    the block, with its upper left cell at (row, col) of the common grid. tiles maps (tile row, tile col)
+    to [cells with both, min diff, max diff, extent flags, sum of diff, histogram]. The histogram maps a
+    bin to its count: 0 below edges[0], len(edges) at or above edges[-1], bin i for edges[i - 1] <= d < edges[i].
+    """
+    bins = np.searchsorted(dtypeEdges(edges, diff.dtype), diff, side='right')
+    for tile_row, tile_col, tile in blockTiles(Window(col, row, diff.shape[1], diff.shape[0]), tileSize):
+        r0, c0 = int(tile.row_off) - row, int(tile.col_off) - col
+        r1, c1 = r0 + int(tile.height), c0 + int(tile.width)
+        valid = both[r0:r1, c0:c1]
+        values = diff[r0:r1, c0:c1][valid]
+        counts = np.bincount(bins[r0:r1, c0:c1][valid], minlength=len(edges) + 1)
+        stats = [int(values.size), float(values.min()) if values.size else math.inf,
+                 float(values.max()) if values.size else -math.inf, int(np.count_nonzero(flagged[r0:r1, c0:c1])),
+                 float(values.sum(dtype=np.float64)), {int(b): int(counts[b]) for b in np.flatnonzero(counts)}]
+        mergeTileStats(tiles, (tile_row, tile_col), stats)
+
+def blockTiles(window, tileSize=TILE_INDEX_SIZE):
+    """Yield (tile row, tile col, window) of the tiles of the common grid that overlap a block window, cut to the block."""
+    row, col = int(window.row_off), int(window.col_off)
+    rows, cols = int(window.height), int(window.width)
+    for tile_row in range(row // tileSize, (row + rows - 1) // tileSize + 1):
+        for tile_col in range(col // tileSize, (col + cols - 1) // tileSize + 1):
+            r0, c0 = max(row, tile_row * tileSize), max(col, tile_col * tileSize)
+            r1, c1 = min(row + rows, (tile_row + 1) * tileSize), min(col + cols, (tile_col + 1) * tileSize)
+            yield tile_row, tile_col, Window(c0, r0, c1 - c0, r1 - r0)
+
+def mergeTileStats(tiles, key, stats):
+    known = tiles.get(key)
+    if known:
+        histogram = dict(known[5])
+        for b, count in stats[5].items():
+            histogram[b] = histogram.get(b, 0) + count
+        stats = [known[0] + stats[0], min(known[1], stats[1]), max(known[2], stats[2]), known[3] + stats[3],
+                 known[4] + stats[4], histogram]
+    tiles[key] = stats
+
+def rasterIdentity(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+def loadPairStats(statsFile, pair, lowerRaster, higherRaster, grid):
+    """Per-tile difference stats of a pair saved by an earlier run, or None if either raster or the grid changed."""
+    try:
+        with open(statsFile) as stats_file:
+            saved = json.load(stats_file).get(pair["label"])
+    except (OSError, ValueError):
+        return None
+    if not saved or saved["lower"] != rasterIdentity(lowerRaster) or saved["higher"] != rasterIdentity(higherRaster) \
+            or saved["grid"] != grid or saved["tile_size"] != TILE_INDEX_SIZE or saved.get("edges") != \
+            histogramEdges(pair["remap"]).tolist():
+        return None
+    return {(tile[0], tile[1]): tile[2:7] + [{b: count for b, count in tile[7]}] for tile in saved["tiles"]}
+
+def savePairStats(statsFile, pair, lowerRaster, higherRaster, grid, tiles):
+    """Save the per-tile difference stats of a pair for the next runs (JSON cannot hold inf, so empty tiles are left out)."""
+    try:
+        with open(statsFile) as stats_file:
+            saved = json.load(stats_file)
+    except (OSError, ValueError):
+        saved = {}
+    saved[pair["label"]] = {"lower": rasterIdentity(lowerRaster), "higher": rasterIdentity(higherRaster), "grid": grid,
+                            "tile_size": TILE_INDEX_SIZE, "edges": histogramEdges(pair["remap"]).tolist(),
+                            "tiles": [list(key) + stats[:5] + [sorted(stats[5].items())]
+                                      for key, stats in sorted(tiles.items()) if stats[0] or stats[3]]}
+    with open(statsFile + ".tmp", "w") as stats_file:
+        json.dump(saved, stats_file)
+    os.replace(statsFile + ".tmp", statsFile)
+
+def pairStatistics(tiles, edges, violations, cellArea):
+    """Summary of the cell value check of a pair from its per-tile stats (see updatePairStats).
+
+    The difference min, max and mean are over the cells where both rasters hold data (None without any);
+    the histogram counts those cells in the bins of edges, with the cells below and above the edges apart.
+    """
+    compared = sum(stats[0] for stats in tiles.values())
+    histogram = np.zeros(len(edges) + 1, dtype=np.int64)
+    for stats in tiles.values():
+        for b, count in stats[5].items():
+            histogram[b] += count
+    return {"compared_cells": compared, "violations": violations, "violation_area": violations * cellArea,
+            "diff_min": min(stats[1] for stats in tiles.values()) if compared else None,
+            "diff_max": max(stats[2] for stats in tiles.values()) if compared else None,
+            "diff_mean": sum(stats[4] for stats in tiles.values()) / compared if compared else None,
+            "histogram": {"edges": [round(edge, 6) for edge in edges.tolist()], "counts": histogram[1:-1].tolist(),
+                          "below": int(histogram[0]), "above": int(histogram[-1])}}
+
+def loadTileIndex(path, tileSize=TILE_INDEX_SIZE):
+    """Read the valid-data tile index sidecar of a raster. Returns None if it is missing or out of date."""
+    try:
+        with open(tileIndexPath(path)) as index_file:
+            saved = json.load(index_file)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(path)
+    if saved.get("size") != stat.st_size or saved.get("mtime") != stat.st_mtime or saved.get("tile_size") != tileSize:
+        return None
+    if any(len(tile) != 9 for tile in saved["tiles"]):   #saved without the tile min/max
+        return None
+    return {"tile_size": tileSize, "tiles": {(tile[0], tile[1]): tile[2:] for tile in saved["tiles"]}}
+
+def saveTileIndex(path, tileIndex):
+    """Write the valid-data tile index sidecar next to a raster (skipped with a message if the folder is read-only)."""
+    stat = os.stat(path)
+    saved = {"size": stat.st_size, "mtime": stat.st_mtime, "tile_size": tileIndex["tile_size"],
+             "tiles": [list(key) + box for key, box in sorted(tileIndex["tiles"].items())]}
+    try:
+        with open(tileIndexPath(path), "w") as index_file:
+            json.dump(saved, index_file)
+    except OSError:
+        print("Could not save the tile index of " + os.path.basename(path) + "; it will be built again next run.")
+
+def unionGrid(datasets):
+    """Return the transform, width and height of the union extent of datasets, snapped to the first one's grid."""
+    ref = datasets[0]
+    res_x, res_y = ref.res
+    left = min(ds.bounds.left for ds in datasets)
+    bottom = min(ds.bounds.bottom for ds in datasets)
+    right = max(ds.bounds.right for ds in datasets)
+    top = max(ds.bounds.top for ds in datasets)
+    # snap the union corner to the reference grid so every block maps onto whole cells
+    left = ref.transform.c + math.floor((left - ref.transform.c) / res_x + 1e-6) * res_x
+    top = ref.transform.f - math.floor((ref.transform.f - top) / res_y + 1e-6) * res_y
+    width = int(math.ceil((right - left) / res_x - 1e-6))
+    height = int(math.ceil((top - bottom) / res_y - 1e-6))
+    return Affine(res_x, 0.0, left, 0.0, -res_y, top), width, height
+
+def maskProfile(crs, transform, width, height, nodata=MASK_NODATA):
+    """GeoTIFF profile for the rasters written by the engine (uint8 by default)."""
+    return dict(driver='GTiff', dtype='uint8', count=1, width=width, height=height, crs=crs, transform=transform,
+                nodata=nodata, compress='lzw', tiled=True, blockxsize=256, blockysize=256)
+
+def compareCellPair(lowerRaster, higherRaster, outMask, remap=CELL_REMAP, gridRaster=None, blockSize=BLOCK_SIZE):
+    """Reclassify (higher - lower) block by block and save the flagged (value 1) cells as a bit-packed mask.
+
+    gridRaster sets the output grid, like the "FirstOf" cell size in RasterCalculator. The difference
+    is NoData wherever either raster is NoData, so cells outside gridRaster never need to be written, and
+    blocks where the tile index sidecar of either raster shows no data are skipped.
+    Returns the mask path and the number of flagged cells.
+    """
+    if gridRaster is None:
+        gridRaster = lowerRaster
+    violations = 0
+    tile_indexes = (loadTileIndex(lowerRaster), loadTileIndex(higherRaster))
+    with rasterio.open(lowerRaster) as lower_ds, rasterio.open(higherRaster) as higher_ds:
+        checkSameGrid(lower_ds, higher_ds)
+        ref_ds = lower_ds if gridRaster == lowerRaster else higher_ds
+
+        crs_wkt = ref_ds.crs.to_wkt() if ref_ds.crs else ''
+        with qcmasks.createMask(outMask, ref_ds.width, ref_ds.height, ref_ds.transform, crs_wkt) as out_mask:
+            for window in iterBlockWindows(ref_ds.width, ref_ds.height, blockSize):
+                if any(index is not None and not windowHasData(index, sourceWindow(ds, window, ref_ds.transform))
+                       for ds, index in zip((lower_ds, higher_ds), tile_indexes)):
+                    continue
+                lower = readBlock(lower_ds, window, ref_ds.transform)
+                higher = readBlock(higher_ds, window, ref_ds.transform)
+                valid = validMask(lower, lower_ds.nodata) & validMask(higher, higher_ds.nodata)
+                diff = higher - lower
+                flagged = reclassifyArray(diff, valid, remap) == 1
+                violations += int(np.count_nonzero(flagged))
+                out_mask.write(flagged, int(window.row_off), int(window.col_off))
+    return outMask, violations
+
+def compareCellvalue(raster0, raster1, raster2, raster3, tempFolder):
+    """NumPy version of compareCellvalue: returns the paths of the reclassify1..3 masks (flagged cells, bit-packed)."""
+    reclas1 = compareCellPair(raster0, raster1, os.path.join(tempFolder, "reclassify1" + qcmasks.MASK_EXTENSION))[0]
+    print("1/3 reclassify tasks is finished.")
+    reclas2 = compareCellPair(raster1, raster2, os.path.join(tempFolder, "reclassify2" + qcmasks.MASK_EXTENSION))[0]
+    print("2/3 reclassify tasks is finished.")
+    reclas3 = compareCellPair(raster2, raster3, os.path.join(tempFolder, "reclassify3" + qcmasks.MASK_EXTENSION))[0]
+    print("3/3 reclassify tasks is finished.")
+    return reclas1, reclas2, reclas3
+
+def compareCellvalue02(raster0, raster02, tempFolder):
+    """NumPy version of compareCellvalue02: flags cells where 0_2PCT is below 00FVA."""
+    reclas02 = compareCellPair(raster0, raster02, os.path.join(tempFolder, "reclassify02" + qcmasks.MASK_EXTENSION),
+                               remap=PCT02_REMAP, gridRaster=raster02)[0]
+    print("Reclassify task for 0_2PCT minus 00FVA is finished.")
+    return reclas02
+
+def extentDiffMask(lowerRaster, higherRaster, blockSize=BLOCK_SIZE):
+    """Return a boolean mask on the lowerRaster grid that is True where lowerRaster has data and higherRaster has not.
+
+    Also returns the grid transform, CRS and cell area of lowerRaster. Blocks where the tile index
+    sidecar of lowerRaster shows no data are skipped.
+    """
+    with rasterio.open(lowerRaster) as lower_ds, rasterio.open(higherRaster) as higher_ds:
+        checkSameGrid(lower_ds, higher_ds)
+        mask = np.zeros((lower_ds.height, lower_ds.width), dtype=bool)
+        higher_index = loadTileIndex(higherRaster)
+        for window in dataWindows([lower_ds], lower_ds.transform, lower_ds.width, lower_ds.height, blockSize,
+                                  [loadTileIndex(lowerRaster)]):
+            lower = readBlock(lower_ds, window, lower_ds.transform)
+            higher = readBlock(higher_ds, window, lower_ds.transform, higher_index)
+            row, col = int(window.row_off), int(window.col_off)
+            mask[row:row + lower.shape[0], col:col + lower.shape[1]] = (
+                validMask(lower, lower_ds.nodata) & ~validMask(higher, higher_ds.nodata))
+        cell_area = abs(lower_ds.res[0] * lower_ds.res[1])
+        return mask, lower_ds.transform, lower_ds.crs, cell_area
+
+def labelRegions(mask):
+    """Label the regions of a boolean mask where cells share an edge, as RasterToPolygon groups them.
+
+    Labelling is done on the bounding box of the True cells only. Returns the labels, the number of
+    regions and the (row, col) offset of the labelled box in the mask.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return np.zeros((0, 0), dtype=np.int32), 0, (0, 0)
+    cols = np.flatnonzero(mask.any(axis=0))
+    box = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    labels, count = ndimage.label(box)
+    return labels, count, (int(rows[0]), int(cols[0]))
+
+def writeRegionPolygons(labels, region_area, transform, crs, outShp):
+    """Polygonize labelled regions (label > 0) into a shapefile with RegionID and Area fields."""
+    schema = {'geometry': 'Polygon', 'properties': {'RegionID': 'int', 'Area': 'float'}}
+    crs_wkt = crs.to_wkt() if crs else ''
+    with fiona.open(outShp, 'w', driver='ESRI Shapefile', crs_wkt=crs_wkt, schema=schema) as dst:
+        if labels.size:
+            dst.writerecords(
+                {'geometry': geom, 'properties': {'RegionID': int(value), 'Area': float(region_area[int(value)])}}
+                for geom, value in shapes(labels, mask=labels > 0, connectivity=4, transform=transform))
+    return outShp
+
+def passBand(remap):
+    """The (from, to) range of a RemapRange table that is reclassified to 0, i.e. within tolerance."""
+    return next((low, high) for low, high, new_value in remap if new_value == 0)
+
+def streamRegions(mask, values=None, remap=None):
+    """Streaming connected-component labelling of the True cells of a PackedMask (cells sharing an edge).
+
+    Each tile is labelled on its own with ndimage.label, and the labels on both sides of every tile edge are
+    merged with union-find, so only one tile and the last row of cells of the tiles above are held besides
+    the per-region attributes. With values (the open two band raster of the lower and higher values of a
+    pair) and its remap table, the representative cell of a region is its worst cell, the one farthest
+    outside the pass band, ties going to the first cell in row order; without, it is the first cell.
+
+    Returns a dict of arrays with one item per region, numbered as ndimage.label numbers the whole mask
+    (by first cell in row order): cells, row0, col0, row1, col1 (bounding box, end exclusive), row and col
+    of the representative cell, and with values its severity, lower and higher value.
+    """
+    parent = [0]   #union-find forest of the tile labels; label 0 is the background
+
+    def find(label):
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    def union(edge_a, edge_b):
+        touching = (edge_a > 0) & (edge_b > 0)
+        for label_a, label_b in set(zip(edge_a[touching].tolist(), edge_b[touching].tolist())):
+            root_a, root_b = find(label_a), find(label_b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    low, high = passBand(remap) if remap else (0, 0)
+    parts = []
+    above = np.zeros(mask.width, dtype=np.int64)   #labels of the bottom row of the previous row of tiles
+    for tile_row in range(mask.tiles_y):
+        below, left = np.zeros(mask.width, dtype=np.int64), None
+        for tile_col in range(mask.tiles_x):
+            if mask.counts[tile_row * mask.tiles_x + tile_col] == 0:
+                left = None
+                continue
+            row, col, rows, cols = mask.tileWindow(tile_row, tile_col)
+            labels, count = ndimage.label(mask.readTile(tile_row, tile_col))
+            offset = len(parent) - 1
+            parent.extend(range(offset + 1, offset + count + 1))
+            local = labels
+            labels = np.where(labels > 0, labels.astype(np.int64) + offset, 0)
+            union(above[col:col + cols], labels[0])
+            if left is not None:
+                union(left, labels[:, 0])
+            below[col:col + cols], left = labels[-1], labels[:, -1]
+
+            cells = np.flatnonzero(labels)
+            label = labels.ravel()[cells] - offset - 1
+            cell_rows, cell_cols = np.divmod(cells, cols)
+            severity = np.zeros(cells.size)
+            lower = higher = severity
+            if values is not None:
+                lower, higher = (band.ravel()[cells] for band in values.read(window=Window(col, row, cols, rows)))
+                severity = np.maximum(low - (higher - lower), (higher - lower) - high)
+            order = np.lexsort((cells, -severity, label))
+            first = np.ones(order.size, dtype=bool)
+            first[1:] = label[order[1:]] != label[order[:-1]]
+            pick = order[first]
+            boxes = ndimage.find_objects(local)
+            first_cells = np.unique(label, return_index=True)[1]
+            parts.append({"cells": np.bincount(label, minlength=count),
+                          "row0": row + np.array([box[0].start for box in boxes]),
+                          "col0": col + np.array([box[1].start for box in boxes]),
+                          "row1": row + np.array([box[0].stop for box in boxes]),
+                          "col1": col + np.array([box[1].stop for box in boxes]),
+                          "first": (row + cell_rows[first_cells]) * mask.width + col + cell_cols[first_cells],
+                          "row": row + cell_rows[pick], "col": col + cell_cols[pick], "severity": severity[pick],
+                          "lower": lower[pick], "higher": higher[pick]})
+        above = below
+
+    if len(parent) == 1:
+        return {key: np.zeros(0) for key in ("cells", "row0", "col0", "row1", "col1", "row", "col", "severity",
+                                             "lower", "higher")}
+    roots = np.array(parent)
+    while True:
+        next_roots = roots[roots]
+        if np.array_equal(next_roots, roots):
+            break
+        roots = next_roots
+    tiles = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+    root = roots[1:]
+    # regions numbered by first cell in row order, as ndimage.label over the whole mask
+    region_roots = np.unique(root)
+    first = np.full(region_roots.size, np.iinfo(np.int64).max)
+    region = np.searchsorted(region_roots, root)
+    np.minimum.at(first, region, tiles["first"])
+    rank = np.empty(region_roots.size, dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(region_roots.size)
+    region = rank[region]
+
+    regions = {"cells": np.bincount(region, weights=tiles["cells"]).astype(np.int64)}
+    for key, reduce, fill in (("row0", np.minimum, np.iinfo(np.int64).max), ("col0", np.minimum, np.iinfo(np.int64).max),
+                              ("row1", np.maximum, 0), ("col1", np.maximum, 0)):
+        regions[key] = np.full(region_roots.size, fill, dtype=np.int64)
+        reduce.at(regions[key], region, tiles[key])
+    order = np.lexsort((tiles["row"] * mask.width + tiles["col"], -tiles["severity"], region))
+    pick = order[np.r_[True, region[order[1:]] != region[order[:-1]]]]
+    for key in ("row", "col", "severity", "lower", "higher"):
+        regions[key] = tiles[key][pick]
+    return regions
+
+def extractViolationPoints(pair, reclassify, values, outShp, regionsCsv=None):
+    """Vectorized replacement of the extractCellValue chain (RasterToPolygon, MultipartToSinglepart,
+    FeatureToPoint, ExtractMultiValuesToPoints, CalculateField).
+
+    The flagged cells of the reclassify mask are grouped into regions (cells sharing an edge) tile by tile
+    with streamRegions, and each region is represented by its worst cell, the one farthest outside the pass
+    band of the pair's remap table. reclassify is the bit-packed mask of the flagged cells, and values the
+    two band raster of the lower and higher values of the pair, written by runFusedQC for the flagged cells.
+    The points get the fields of the ArcPy output, with ValueDiff = second value field - first value field,
+    and are written to outShp in one write. With regionsCsv, the attributes of every region (cells, area,
+    bounding box, representative cell and its difference) are written there as well.
+    Returns the shapefile path and the number of points.
+    """
+    first_field, second_field = pair["fields"]
+    schema = {'geometry': 'Point', 'properties': {'Id': 'int', 'gridcode': 'int', 'ORIG_FID': 'int',
+                                                  first_field: 'float', second_field: 'float', 'ValueDiff': 'float'}}
+    records = []
+    with qcmasks.openMask(reclassify, mmap=True) as mask, rasterio.open(values) as values_ds:
+        regions = streamRegions(mask, values_ds, pair["remap"])
+        transform = Affine(*mask.transform)
+        xs, ys = transform * (regions["col"] + 0.5, regions["row"] + 0.5)
+        for region_id, (x, y, lower_value, higher_value) in enumerate(zip(xs, ys, regions["lower"], regions["higher"])):
+            cell_values = {pair["lower"]: float(lower_value), pair["higher"]: float(higher_value)}
+            records.append({'geometry': {'type': 'Point', 'coordinates': (float(x), float(y))},
+                            'properties': {'Id': 0, 'gridcode': 1, 'ORIG_FID': region_id,
+                                           first_field: cell_values[first_field],
+                                           second_field: cell_values[second_field],
+                                           'ValueDiff': cell_values[second_field] - cell_values[first_field]}})
+        crs_wkt = mask.crs_wkt
+    with fiona.open(outShp, 'w', driver='ESRI Shapefile', crs_wkt=crs_wkt, schema=schema) as dst:
+        dst.writerecords(records)
+    if regionsCsv:
+        writeRegionsCsv(regions, transform, regionsCsv)
+    return outShp, len(records)
+
+def writeRegionsCsv(regions, transform, outCsv):
+    """Write the attributes of the regions of streamRegions, one row per region (RegionID = ORIG_FID + 1)."""
+    cell_area = abs(transform.a * transform.e)
+    x_min, y_max = transform * (regions["col0"], regions["row0"])
+    x_max, y_min = transform * (regions["col1"], regions["row1"])
+    x, y = transform * (regions["col"] + 0.5, regions["row"] + 0.5)
+    with open(outCsv, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(['RegionID', 'Cells', 'Area', 'XMin', 'YMin', 'XMax', 'YMax', 'Row', 'Col', 'X', 'Y',
+                             'Lower', 'Higher', 'WorstDiff'])
+        for index in range(len(regions["cells"])):
+            csv_writer.writerow([index + 1, int(regions["cells"][index]), float(regions["cells"][index] * cell_area),
+                                 float(x_min[index]), float(y_min[index]), float(x_max[index]), float(y_max[index]),
+                                 int(regions["row"][index]), int(regions["col"][index]), float(x[index]), float(y[index]),
+                                 float(regions["lower"][index]), float(regions["higher"][index]),
+                                 float(regions["higher"][index] - regions["lower"][index])])
+    return outCsv
+
+def compareExtentPair(lowerRaster, higherRaster, outShp, blockSize=BLOCK_SIZE):
+    """Find the areas where lowerRaster has data outside the extent of higherRaster.
+
+    Works on valid-data masks: mask set difference, connected region labelling and region areas
+    from cell counts times cell area. Only the flagged regions are polygonized to outShp.
+    Returns the shapefile path, the number of regions and their total area.
+    """
+    mask, transform, crs, cell_area = extentDiffMask(lowerRaster, higherRaster, blockSize)
+    count, area = extentRegions(mask, transform, crs, cell_area, outShp)
+    return outShp, count, area
+
+def extentRegions(mask, transform, crs, cell_area, outShp):
+    """Label the flagged cells of an extent difference mask and polygonize the regions to outShp.
+
+    Returns the number of regions and their total area.
+    """
+    labels, count, (row, col) = labelRegions(mask)
+    region_area = np.bincount(labels.ravel(), minlength=count + 1) * cell_area
+    box_transform = window_transform(Window(col, row, labels.shape[1], labels.shape[0]), transform)
+    writeRegionPolygons(labels, region_area, box_transform, crs, outShp)
+    return count, float(region_area[1:].sum())
+
+def compareExtent(raster0, raster1, raster2, raster3, tempFolder, shapefilesFolder):
+    """Mask-based version of compareExtent: returns the same three extent statuses."""
+    statuses = []
+    for lowerRaster, higherRaster, lower, higher in ((raster0, raster1, 0, 1), (raster1, raster2, 1, 2), (raster2, raster3, 2, 3)):
+        diffFva = os.path.join(shapefilesFolder, f"diffFva{lower}_{higher}.shp")
+        diffFva, count, area = compareExtentPair(lowerRaster, higherRaster, diffFva)
+        if count > 0:
+            statuses.append("Warning! See " + diffFva + " in Output folder for details. ")
+            print(f"Warning! FFRMS FVA {higher} raster extent is less than FFRMS FVA {lower} raster extent. "
+                  f"See diffFva{lower}_{higher}.shp in Output folder for details. ")
+        else:
+            statuses.append("Pass")
+            print(f"Extent compare FVA0{higher} vs FVA0{lower} Pass!")
+    return tuple(statuses)
+
+def compareExtent02(raster0, raster02, tempFolder, shapefilesFolder):
+    """Mask-based version of compareExtent02: flags 00FVA areas outside the 0_2PCT extent."""
+    diffFva0_02 = os.path.join(shapefilesFolder, "diffFva0_02.shp")
+    diffFva0_02, count, area = compareExtentPair(raster0, raster02, diffFva0_02)
+    if count > 0:
+        print("Warning! FFRMS FVA00 raster extent is less than 0.2 PCT raster extent. See diffFva0_02.shp in Output folder for details. ")
+        return "Warning! See " + diffFva0_02 + " in Output folder for details. "
+    print("Extent compare FVA00 vs 0.2 PCT Pass!")
+    return "Pass"
+
+def wktName(wkt, keywords):
+    """Return the name of the first WKT node with one of the keywords, or None."""
+    match = re.search(r'(?:' + '|'.join(keywords) + r')\["([^"]+)"', wkt)
+    return match.group(1) if match else None
+
+def getRasterProperties(ds):
+    """Read the checklist properties (R3-R8) from an open dataset, in the order of the ArcPy tool."""
+    sr_name, vcs_name, vcs_unit = 'Not Defined', 'Not Defined', 'Not Defined'
+    if ds.crs:
+        wkt = ds.crs.to_wkt()
+        sr_name = wktName(wkt, ['PROJCS', 'GEOGCS', 'PROJCRS', 'GEOGCRS']) or sr_name
+        vcs_start = re.search(r'VERT_CS\[|VERTCRS\[', wkt)
+        if vcs_start:
+            vcs_wkt = wkt[vcs_start.start():]
+            vcs_name = wktName(vcs_wkt, ['VERT_CS', 'VERTCRS']) or vcs_name
+            vcs_unit = wktName(vcs_wkt, ['UNIT', 'LENGTHUNIT']) or vcs_unit
+
+    raster_properties = [
+        os.path.basename(ds.name), #QC R3
+        PIXEL_TYPES.get(ds.dtypes[0], ds.dtypes[0]), #QC R4
+        round(ds.res[1], 5),  #QC R6
+        sr_name,    #QC R7
+        vcs_name, #QC R8
+        vcs_unit #QC R8 unit
+    ]
+    return raster_properties
+
+def triageNote(first):
+    """Detail of a fail-fast Warning status: where the first flagged cell is, and that no shapefile was written."""
+    where = f" at x {first[0]:.2f}, y {first[1]:.2f}" if first else ""
+    return f"Pass/fail only run: first flagged cell{where}; no shapefile was written, run the full QC for the details. "
+
+def extentStatus(lower, higher, diffFva, count, first=None):
+    """Extent comparison status string, worded as in the ArcPy tool.
+
+    count None is a fail-fast result: at least one flagged cell, the first one at the map coordinates first, and
+    diffFva was not written, so the status does not name it.
+    """
+    if count is None:
+        print(f"Warning! FFRMS {higher} raster extent is less than FFRMS {lower} raster extent "
+              f"(stopped at the first cell; run the full QC for {os.path.basename(diffFva)}).")
+        return "Warning! " + triageNote(first)
+    if count > 0:
+        print(f"Warning! FFRMS {higher} raster extent is less than FFRMS {lower} raster extent. "
+              f"See {os.path.basename(diffFva)} in Output folder for details. ")
+        return "Warning! See " + diffFva + " in Output folder for details. "
+    print(f"Extent compare {higher} vs {lower} Pass!")
+    return "Pass"
+
+def cellStatus(lower, higher, pointsShp, count, first=None):
+    """Cell value comparison status string for a pair, worded as reportCellComp in the ArcPy tool.
+
+    count None is a fail-fast result: at least one cell out of tolerance, the first one at the map coordinates
+    first, and pointsShp was not written, so the status does not name it.
+    """
+    if count is None:
+        print(f"Warning! {higher} have cells out of tolerance against {lower} "
+              f"(stopped at the first cell; run the full QC for {os.path.basename(pointsShp)}).")
+        return "Warning! " + triageNote(first)
+    if count > 0:
+        print(f"Warning! {higher} have {count} cells out of tolerance against {lower}. "
+              f"See {os.path.basename(pointsShp)} in Output folder for details.")
+        return "Warning! See " + os.path.basename(pointsShp) + " in Output folder for details. "
+    print(f"Pass! All cells in {higher} are within tolerance against {lower}")
+    return "Pass"
+
+def blockBuffers(nRasters, rows, cols, dtype):
+    """Work arrays of evaluateBlock for blocks of up to rows x cols cells of a stack of nRasters: the
+    differences of the pairs (in the stack dtype), the cells where both rasters of a pair hold data, and
+    the range tests of reclassifyArray. Allocated once and cut to each block with blockView."""
+    n_pairs = nRasters - 1
+    return {"diff": np.empty((n_pairs, rows, cols), dtype=dtype), "both": np.empty((n_pairs, rows, cols), dtype=bool),
+            "work": np.empty((2, n_pairs, rows, cols), dtype=bool)}
+
+def blockView(buffers, rows, cols):
+    """The arrays of blockBuffers cut to a block of rows x cols cells (views, nothing is copied)."""
+    return {key: array[..., :rows, :cols] for key, array in buffers.items()}
+
+def blockPairs(nRasters, with02, cellRemap=CELL_REMAP):
+    """(lower, higher, remap) of the pairs of a stack of nRasters, ordered as in qcPairs."""
+    n_levels = nRasters - 1 if with02 else nRasters
+    pairs = [(index, index + 1, cellRemap) for index in range(n_levels - 1)]
+    return pairs + ([(0, nRasters - 1, PCT02_REMAP)] if with02 else [])
+
+def evaluateBlock(stack, nodatas, with02, ext_out, reclas_out, valid_out, cellRemap=CELL_REMAP, buffers=None, row=0,
+                  col=0, useKernel=False):
+    """Evaluate the extent and cell value checks of every pair on one block.
+
+    stack is (rasters, rows, cols): the freeboard levels in order, followed by 0_2PCT when with02, with
+    their NoData values in nodatas. The pairs are ordered as in qcPairs. ext_out and reclas_out are
+    (pairs, rows, cols) uint8 arrays, filled in place with the extent flags (0/1) and the reclassified
+    differences, and valid_out, (rasters, rows, cols) bool, with the valid-data masks (see validMask);
+    the freeboard level pairs are reclassified with cellRemap. The differences are taken in the stack dtype
+    (float32 for FVA rasters) into buffers (see blockView), so nothing the size of the block is allocated
+    when they are given.
+
+    With useKernel, all of it runs as one loop over the cells in the compiled kernel of
+    FFRMS_Raster_QC_Kernels (numba), which gives the same flags, counts and tile stats. Returns the number
+    of flagged extent cells and flagged cell values per pair, and per pair the stats of the tiles of the
+    block (see updatePairStats), whose upper left cell is at (row, col) of the common grid.
+    """
+    pairs = blockPairs(stack.shape[0], with02, cellRemap)
+    if useKernel:
+        bounds = [[remapBounds(low, high, stack.dtype) + (new_value,) for low, high, new_value in remap]
+                  for lower, higher, remap in pairs]
+        edges = [dtypeEdges(histogramEdges(remap), stack.dtype) for lower, higher, remap in pairs]
+        return qckernels.fusedBlock(stack, nodatas, [pair[:2] for pair in pairs], bounds, edges, row, col,
+                                    TILE_INDEX_SIZE, ext_out, reclas_out, valid_out, MASK_NODATA)
+    buffers = buffers or blockBuffers(stack.shape[0], stack.shape[1], stack.shape[2], stack.dtype)
+    diff, both, work = buffers["diff"], buffers["both"], buffers["work"]
+    valid = valid_out
+    for index, nodata in enumerate(nodatas):
+        validMask(stack[index], nodata, out=valid[index], work=work[0, 0])
+    n_levels = len(nodatas) - 1 if with02 else len(nodatas)
+    n = n_levels - 1
+    # pair i is level i + 1 minus level i, for all adjacent pairs at once; the extent flag is
+    # lower valid and higher not, i.e. lower > higher on the masks
+    np.subtract(stack[1:n_levels], stack[:n], out=diff[:n])
+    np.logical_and(valid[:n], valid[1:n_levels], out=both[:n])
+    np.greater(valid[:n], valid[1:n_levels], out=ext_out[:n])
+    reclassifyArray(diff[:n], both[:n], cellRemap, out=reclas_out[:n], work=work[:, :n])
+    if with02:
+        np.subtract(stack[-1], stack[0], out=diff[n])
+        np.logical_and(valid[0], valid[-1], out=both[n])
+        np.greater(valid[0], valid[-1], out=ext_out[n])
+        reclassifyArray(diff[n], both[n], PCT02_REMAP, out=reclas_out[n], work=work[:, n])
+    tile_stats = [{} for pair in pairs]
+    for index, (lower, higher, remap) in enumerate(pairs):
+        updatePairStats(tile_stats[index], diff[index], both[index], ext_out[index], row, col, histogramEdges(remap))
+    flagged = np.equal(reclas_out, 1, out=work[0])
+    return np.count_nonzero(ext_out, axis=(1, 2)), np.count_nonzero(flagged, axis=(1, 2)), tile_stats
+
+def blockWorker(task):
+    """Worker process side of evaluateBlocks: evaluate one block held in shared memory.
+
+    Only the shared memory names and the block size are pickled; the tile data and the result masks
+    stay in the shared buffers of the slot. The work arrays are allocated once per worker process.
+    """
+    in_name, out_name, in_shape, dtype, out_shape, row, col, rows, cols, nodatas, with02, cellRemap, useKernel = task
+    if (in_shape, dtype) not in WORKER_BUFFERS:
+        WORKER_BUFFERS.clear()
+        WORKER_BUFFERS[(in_shape, dtype)] = blockBuffers(*in_shape, dtype)
+    buffers = blockView(WORKER_BUFFERS[(in_shape, dtype)], rows, cols)
+    n_pairs = in_shape[0] - 1
+    in_shm, out_shm = SharedMemory(name=in_name), SharedMemory(name=out_name)
+    try:
+        stack = np.ndarray(in_shape, dtype=dtype, buffer=in_shm.buf)[:, :rows, :cols]
+        out = np.ndarray(out_shape, dtype=np.uint8, buffer=out_shm.buf)[:, :rows, :cols]
+        result = evaluateBlock(stack, nodatas, with02, out[:n_pairs], out[n_pairs:2 * n_pairs], out[2 * n_pairs:].view(bool),
+                               cellRemap, buffers, row, col, useKernel)
+        del stack, out, buffers
+    finally:
+        in_shm.close()
+        out_shm.close()
+    return result
+
+def prefetchBlocks(datasets, windows, transform, stacks, free, tileIndexes=None, readers=READ_THREADS,
+                   depth=PREFETCH_DEPTH):
+    """Read the blocks of windows ahead on a pool of reader threads, so the reads overlap the evaluation.
+
+    Each block is read into one of stacks, (rasters, rows, cols) arrays, with one read task per raster;
+    free is a deque of the indexes of the stacks the caller is not using. Up to depth blocks are read
+    ahead while the caller evaluates the current one (GDAL releases the GIL while it decodes, and the
+    compiled kernel while it runs). Reading waits when depth blocks are pending or no stack is free: the
+    caller hands a stack back by appending its index to free once it is done with it, and must leave one
+    free or pending after each block. A GDAL dataset must not be read from two threads at once, so every
+    reader thread opens its own handle of each raster. With readers or depth below 1 the blocks are read
+    in the calling thread. Yields (window, stack index) in the order of windows.
+    """
+    tile_indexes = tileIndexes or [None] * len(datasets)
+    if readers < 1 or depth < 1:
+        for window in windows:
+            index = free.popleft()
+            rows, cols = int(window.height), int(window.width)
+            for raster, ds in enumerate(datasets):
+                readBlock(ds, window, transform, tile_indexes[raster], out=stacks[index][raster, :rows, :cols])
+            yield window, index
+        return
+
+    local, handles, lock = threading.local(), [], threading.Lock()
+    def read(window, stack, raster):
+        if not hasattr(local, "datasets"):
+            local.datasets = {}
+        if raster not in local.datasets:
+            local.datasets[raster] = rasterio.open(datasets[raster].name)
+            with lock:
+                handles.append(local.datasets[raster])
+        rows, cols = int(window.height), int(window.width)
+        readBlock(local.datasets[raster], window, transform, tile_indexes[raster], out=stack[raster, :rows, :cols])
+
+    pending, windows, window = deque(), iter(windows), True
+    executor = ThreadPoolExecutor(max_workers=readers)
+    try:
+        while True:
+            while window is not None and free and len(pending) < depth:
+                window = next(windows, None)
+                if window is not None:
+                    index = free.popleft()
+                    pending.append((window, index, [executor.submit(read, window, stacks[index], raster)
+                                                    for raster in range(len(datasets))]))
+            if not pending:
+                if window is not None:
+                    raise RuntimeError("prefetchBlocks: no free stack to read the next block into")
+                return
+            window, index, reads = pending.popleft()
+            for future in reads:
+                future.result()
+            yield window, index
+    finally:
+        for window, index, reads in pending:
+            for future in reads:
+                future.cancel()
+        executor.shutdown(wait=True)
+        for ds in handles:
+            ds.close()
+
+def evaluateBlocks(datasets, transform, width, height, with02, blockSize=BLOCK_SIZE, workers=1, tileIndexes=None,
+                   skipBlock=None, cellRemap=CELL_REMAP, useKernel=False, readers=READ_THREADS, prefetch=PREFETCH_DEPTH):
+    """Tiled executor: read every block of the common grid once and evaluate it with evaluateBlock.
+
+    datasets are the open freeboard levels in order, followed by 0_2PCT when with02. Yields
+    (window, stack, valid, ext_flags, reclas, ext_counts, cell_counts, tile_stats) in block order; the freeboard
+    level pairs are reclassified with cellRemap, by the compiled kernel with useKernel. With tileIndexes (one tile index or None per dataset), blocks without
+    data in any dataset are skipped (nothing is flagged there), and a dataset without data in a block is
+    not read. Blocks for which skipBlock(window) is True (see screenBlock) are not read either. With
+    workers > 1 the blocks are dispatched to a process pool; the tile data and results move through a ring of shared memory
+    slots instead of being pickled, and up to 2 x workers blocks are in flight while the next ones are read.
+    The yielded arrays are only valid until the next block is requested. All block arrays are allocated
+    once: the blocks are read straight into the stack, and evaluated with the work arrays of blockBuffers.
+    The next prefetch blocks are read on readers threads while a block is evaluated (see prefetchBlocks):
+    into prefetch more stacks in a serial pass, into the free slots of the ring with workers.
+    """
+    nodatas = [ds.nodata for ds in datasets]
+    tile_indexes = tileIndexes or [None] * len(datasets)
+    n_pairs = len(datasets) - 1
+    dtype = np.result_type(*[ds.dtypes[0] for ds in datasets])
+
+    windows = dataWindows(datasets, transform, width, height, blockSize, tileIndexes, skipBlock)
+    if workers <= 1:
+        depth = max(prefetch, 0) if readers >= 1 else 0
+        stacks = np.empty((depth + 1, len(datasets), blockSize, blockSize), dtype=dtype)
+        outs = np.empty((2 * n_pairs, blockSize, blockSize), dtype=np.uint8)
+        valids = np.empty((len(datasets), blockSize, blockSize), dtype=bool)
+        buffers = blockBuffers(len(datasets), blockSize, blockSize, dtype)
+        free = deque(range(depth + 1))
+        for window, index in prefetchBlocks(datasets, windows, transform, stacks, free, tile_indexes, readers, depth):
+            rows, cols = int(window.height), int(window.width)
+            stack, valid = stacks[index, :, :rows, :cols], valids[:, :rows, :cols]
+            ext_flags, reclas = outs[:n_pairs, :rows, :cols], outs[n_pairs:, :rows, :cols]
+            result = evaluateBlock(stack, nodatas, with02, ext_flags, reclas, valid, cellRemap, blockView(buffers, rows, cols),
+                                   int(window.row_off), int(window.col_off), useKernel)
+            yield (window, stack, valid, ext_flags, reclas) + tuple(result)
+            free.append(index)
+        return
+
+    # the results of a slot: the extent flags and reclassified values of the pairs, then the valid masks
+    in_shape = (len(datasets), blockSize, blockSize)
+    out_shape = (2 * n_pairs + len(datasets), blockSize, blockSize)
+    slots = [(SharedMemory(create=True, size=int(np.prod(in_shape)) * dtype.itemsize),
+              SharedMemory(create=True, size=int(np.prod(out_shape)))) for _ in range(2 * workers)]
+    free, pending = deque(range(len(slots))), deque()
+
+    def finish():
+        window, slot, future = pending.popleft()
+        ext_counts, cell_counts, tile_stats = future.result()
+        rows, cols = int(window.height), int(window.width)
+        stack = np.ndarray(in_shape, dtype=dtype, buffer=slots[slot][0].buf)[:, :rows, :cols]
+        out = np.ndarray(out_shape, dtype=np.uint8, buffer=slots[slot][1].buf)[:, :rows, :cols]
+        free.append(slot)   # reused only after the caller has consumed this block
+        return (window, stack, out[2 * n_pairs:].view(bool), out[:n_pairs], out[n_pairs:2 * n_pairs],
+                ext_counts, cell_counts, tile_stats)
+
+    stacks = [np.ndarray(in_shape, dtype=dtype, buffer=in_shm.buf) for in_shm, out_shm in slots]
+    blocks = prefetchBlocks(datasets, windows, transform, stacks, free, tile_indexes, readers, min(prefetch, len(slots) - 1))
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for window, slot in blocks:
+                rows, cols = int(window.height), int(window.width)
+                task = (slots[slot][0].name, slots[slot][1].name, in_shape, dtype.str, out_shape, int(window.row_off),
+                        int(window.col_off), rows, cols, nodatas, with02, cellRemap, useKernel)
+                pending.append((window, slot, executor.submit(blockWorker, task)))
+                # a slot for the next read: the blocks in the workers are taken in order
+                if not free:
+                    yield finish()
+            while pending:
+                yield finish()
+    finally:
+        # the reader threads are done with the slots before they are released
+        blocks.close()
+        del blocks, stacks
+        for in_shm, out_shm in slots:
+            in_shm.close()
+            in_shm.unlink()
+            out_shm.close()
+            out_shm.unlink()
+
+def exportPair(job):
+    """Pair job: polygonize the flagged extent regions and extract the violation points of one pair
+    from its local masks.
+
+    job is (pair, extent mask, flagged extent cell count, extent shapefile, reclassify mask, values raster,
+    points shapefile); the masks are bit-packed mask files. Returns the extent shapefile path, the number of regions, their total area,
+    the points shapefile path and the number of points.
+    """
+    pair, ext_mask, flagged, diffFva, reclassify, values, pointsShp = job
+    with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MB * 2**20):
+        with qcmasks.openMask(ext_mask, mmap=True) as mask:
+            transform = Affine(*mask.transform)
+            crs = CRS.from_wkt(mask.crs_wkt) if mask.crs_wkt else None
+            if flagged > 0:
+                cell_area = abs(transform.a * transform.e)
+                regions, area = extentRegions(mask.read(), transform, crs, cell_area, diffFva)
+            else:
+                writeRegionPolygons(np.zeros((0, 0), dtype=np.int32), None, transform, crs, diffFva)
+                regions, area = 0, 0.0
+        regionsCsv = os.path.join(os.path.dirname(pointsShp), pair["points_name"] + "_regions.csv")
+        pointsShp, points = extractViolationPoints(pair, reclassify, values, pointsShp, regionsCsv)
+    return diffFva, regions, area, pointsShp, points
+
+def runPairJobs(function, jobs, workers=1):
+    """Run function on every job, on a process pool when workers > 1.
+
+    Results come back in the order of jobs whatever the completion order, so the output is deterministic.
+    """
+    if workers <= 1 or len(jobs) <= 1:
+        return [function(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        return list(executor.map(function, jobs))
+
+def availableMemory():
+    """Free physical memory in bytes, or None when it cannot be detected."""
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                            ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                            ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                            ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                            ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return None
+            return int(status.ullAvailPhys)
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def memoryBudget(budgetGb=None):
+    """RAM budget of a pass in bytes: budgetGb when given, else MEMORY_FRACTION of the free RAM (4 GB if unknown)."""
+    if budgetGb:
+        return int(float(budgetGb) * 2**30)
+    available = availableMemory()
+    return int(available * MEMORY_FRACTION) if available else 4 * 2**30
+
+def blockAlignment(datasets):
+    """Smallest block size (rows/columns) that is a whole number of internal GeoTIFF blocks of every dataset.
+
+    Tiled rasters contribute their tile width and height, stripped rasters the rows per strip. The size is
+    also a multiple of TILE_INDEX_SIZE, so the tile index, pair stats and mask tiles stay block aligned.
+    Layouts without a common multiple up to BLOCK_SIZE * 4 fall back to TILE_INDEX_SIZE.
+    """
+    align = TILE_INDEX_SIZE
+    for ds in datasets:
+        rows, cols = ds.block_shapes[0]
+        for size in (rows,) if cols >= ds.width else (rows, cols):
+            align = align * size // math.gcd(align, size)
+    return align if align <= BLOCK_SIZE * 4 else TILE_INDEX_SIZE
+
+def blockCellBytes(nRasters, itemsize, workers=1, prefetch=PREFETCH_DEPTH):
+    """Bytes in use per cell of the block size in runFusedQC, for a stack of nRasters of itemsize bytes.
+
+    The block arrays are preallocated (see evaluateBlocks): the stack, the uint8 results and valid masks of
+    a block (a shared memory slot, 2 x workers of them with workers > 1), the work arrays of evaluateBlock
+    (once per worker) with the histogram bins of a pair for its tile stats, and in the main process the work
+    arrays of one pair and its values. A serial pass also holds the stacks of the prefetch blocks read ahead;
+    with workers they are read into the slots.
+    """
+    n_pairs = nRasters - 1
+    slot = nRasters * (itemsize + 1) + 2 * n_pairs
+    evaluate = n_pairs * (itemsize + 3) + 8
+    consume = 2 * itemsize + 13
+    if workers <= 1:
+        return slot + prefetch * nRasters * itemsize + evaluate + consume
+    return 2 * workers * slot + workers * evaluate + consume
+
+def planMemory(datasets, budget, workers=1, blockSize=None, prefetch=PREFETCH_DEPTH):
+    """Memory governor: (block size, workers, estimated bytes) of a pass over datasets that fits in budget.
+
+    The block size is a multiple of blockAlignment, at most BLOCK_SIZE (or the alignment when larger);
+    workers is at most the requested number. The workers are kept and the blocks made smaller
+    first, down to the alignment, then the workers are reduced. A given blockSize is kept as it is. Raises
+    ValueError when even one worker with the smallest block would exceed the budget.
+    """
+    itemsize = np.result_type(*[ds.dtypes[0] for ds in datasets]).itemsize
+    if blockSize:
+        sizes = [blockSize]
+    else:
+        align = blockAlignment(datasets)
+        sizes = list(range(max(align, BLOCK_SIZE // align * align), 0, -align))
+    for n in range(max(workers, 1), 0, -1):
+        for size in sizes:
+            need = BASE_MEMORY + (n * WORKER_MEMORY if n > 1 else 0) + \
+                size * size * blockCellBytes(len(datasets), itemsize, n, prefetch)
+            if need <= budget:
+                return size, n, need
+    raise ValueError(f"The memory budget of {budget / 2**30:.2f} GB is below the {need / 2**30:.2f} GB needed "
+                     f"for blocks of {sizes[-1]} cells with one worker.")
+
+def exportWorkers(width, height, budget, workers=1):
+    """Pair exports that can run at a time within budget: each one may hold a whole grid extent mask and its labels.
+    Raises ValueError when even one export would exceed the budget."""
+    job = EXPORT_CELL_BYTES * width * height + WORKER_MEMORY
+    fitting = int((budget - BASE_MEMORY) // job)
+    if fitting < 1:
+        raise ValueError(f"The memory budget of {budget / 2**30:.2f} GB is below the {(BASE_MEMORY + job) / 2**30:.2f} GB "
+                         f"needed to export a pair of the {width} x {height} cell grid.")
+    return min(max(workers, 1), fitting)
+
+def kernelChoice(kernel="auto"):
+    """True to evaluate the blocks with the compiled kernel: for "numba", or "auto" when numba is installed."""
+    if kernel == "numba" and not qckernels.AVAILABLE:
+        print("numba is not installed; the blocks are evaluated with the NumPy steps.")
+    return kernel in ("auto", "numba") and qckernels.AVAILABLE
+
+def toleranceName(pair, tolerance):
+    """Name of the mask of the cells of a pair outside a further pass band, e.g. reclassify1_tol0.1."""
+    return f"{pair['reclassify_name']}_tol{tolerance:g}"
+
+def runFusedQC(rasters, tempFolder, shapefilesFolder, blockSize=None, workers=1, tileIndex=True,
+               tolerances=(TOLERANCE,), memoryGb=None, kernel="auto", workingFolder=None, readers=READ_THREADS,
+               prefetch=PREFETCH_DEPTH):
+    """Run the extent (R11), cell value (R14) and property (R3-R8) checks in a single pass over the rasters.
+
+    rasters maps the freeboard level keys, in stack order, and optionally PCT02_KEY to GeoTIFF paths
+    (None when missing), as returned by detectRasters. Each raster is opened once and every block of
+    the common grid is read once for all checks. The freeboard levels of a block are stacked, so all
+    adjacent pairs are checked by the same array operations. The per-block flags are written to local
+    bit-packed masks in tempFolder, with the lower and higher values of the flagged cells; the flagged extent
+    regions are polygonized and the violation points extracted from those files afterwards, so the
+    input rasters are not read again. With workers > 1 the blocks are evaluated by a pool of worker
+    processes (see evaluateBlocks), and the per-pair exports run on a process pool as well.
+    With tileIndex, the valid-data tile index sidecar of each raster is used to skip the blocks without
+    data; the index of a raster without an up-to-date sidecar is built during the pass and saved. The
+    per-tile difference stats of every pair are collected in the same pass and saved in tempFolder. When
+    every raster has an index and every pair saved stats, the block min/max pyramid built from them
+    screens the blocks first, and the blocks where every pair provably passes are not read at full
+    resolution. The freeboard level pairs are checked against every pass band of tolerances (ft around
+    1 ft) in the same pass: the first one gives the statuses, masks and shapefiles, each further one
+    its own statistics and mask. The pass stays within a RAM budget of memoryGb (see memoryBudget): the
+    block size, when not given, and the number of workers are chosen by planMemory, and the exports run
+    on as many workers as exportWorkers allows. kernel picks how the blocks are evaluated: "numba" with
+    the compiled kernel of FFRMS_Raster_QC_Kernels, "numpy" with the NumPy array steps, "auto" with the
+    kernel when numba is installed. Uncompressed rasters are read in place (see rasterMap); with
+    workingFolder, uncompressed copies of the rasters are made there (see workingCopies) and read instead,
+    while the properties are still those of the rasters. While a block is evaluated, the next prefetch
+    blocks are read on readers threads (see prefetchBlocks); readers 0 reads each block when it is needed.
+
+    Returns a dict with the raster "properties" by key, and "pairs", a list with one dict per checked pair,
+    with its "statistics" as returned by pairStatistics and, in them, one entry per tolerance.
+    """
+    levels = [key for key, path in rasters.items() if key != PCT02_KEY and path]
+    with02 = bool(rasters.get(PCT02_KEY))
+    keys = levels + ([PCT02_KEY] if with02 else [])
+    pairs = qcPairs(levels, with02, tolerances)
+    read_paths = workingCopies(rasters, workingFolder) if workingFolder else rasters
+    datasets = openRasters(read_paths, keys)
+    outputs = {}
+    try:
+        ref_ds = datasets[keys[0]]
+        for key in keys[1:]:
+            checkSameGrid(ref_ds, datasets[key])
+        # from the GeoTIFF headers (cached in tempFolder), or the open datasets if a header cannot be resolved
+        properties = {key: qcheader.headerProperties(rasters[key], tempFolder) or getRasterProperties(datasets[key])
+                      for key in keys}
+
+        transform, width, height = unionGrid([datasets[key] for key in keys])
+        dtype = np.result_type(*[datasets[key].dtypes[0] for key in keys])
+        use_kernel = kernelChoice(kernel)
+        budget = memoryBudget(memoryGb)
+        prefetch = max(prefetch, 0) if readers >= 1 else 0
+        blockSize, block_workers, need = planMemory([datasets[key] for key in keys], budget, workers, blockSize, prefetch)
+        # checked before the pass, so a grid whose exports cannot fit is not read for nothing
+        export_workers = exportWorkers(width, height, budget, workers)
+        print(f"Memory budget {budget / 2**30:.1f} GB: blocks of {blockSize} x {blockSize} cells on "
+              f"{block_workers} worker process(es), about {need / 2**30:.2f} GB in use.")
+        values_profile = dict(maskProfile(ref_ds.crs, transform, width, height, nodata=np.nan), dtype='float32', count=2)
+        crs_wkt = ref_ds.crs.to_wkt() if ref_ds.crs else ''
+        for pair in pairs:
+            outputs[pair["extent_name"]] = qcmasks.createMask(
+                os.path.join(tempFolder, pair["extent_name"] + qcmasks.MASK_EXTENSION), width, height, transform, crs_wkt)
+            outputs[pair["reclassify_name"]] = qcmasks.createMask(
+                os.path.join(tempFolder, pair["reclassify_name"] + qcmasks.MASK_EXTENSION), width, height, transform, crs_wkt)
+            # lower and higher values of the flagged cells, for the violation points; blocks without flags stay NoData
+            outputs[pair["points_name"]] = rasterio.open(os.path.join(tempFolder, pair["reclassify_name"] + "_values.tif"), 'w',
+                                                         **values_profile)
+            for tolerance in pair["tolerances"][1:]:
+                outputs[toleranceName(pair, tolerance)] = qcmasks.createMask(
+                    os.path.join(tempFolder, toleranceName(pair, tolerance) + qcmasks.MASK_EXTENSION), width, height,
+                    transform, crs_wkt)
+        counts = dict.fromkeys(outputs, 0)
+
+        tile_indexes = [loadTileIndex(read_paths[key]) if tileIndex else None for key in keys]
+        building = {index: {} for index, tile_index in enumerate(tile_indexes) if tileIndex and tile_index is None}
+        # per-tile difference stats of the pairs: saved by an earlier run over the same rasters (for the screening),
+        # and accumulated in this pass, from the blocks read and the saved stats of the blocks skipped
+        stats_file, grid = os.path.join(tempFolder, PAIR_STATS_FILE), list(transform)[:6] + [width, height]
+        saved_tiles = [loadPairStats(stats_file, pair, read_paths[keys[pair["lower_index"]]], read_paths[keys[pair["higher_index"]]],
+                                     grid) if tileIndex else None for pair in pairs]
+        pair_tiles = [{} for pair in pairs]
+        edges = [histogramEdges(pair["remap"]) for pair in pairs]
+        screened = []
+        # only blocks of whole tiles are skipped, whose stats are then exactly the saved ones
+        if tileIndex and not building and all(tiles is not None for tiles in saved_tiles) and blockSize % TILE_INDEX_SIZE == 0:
+            pyramids = [buildPyramid({tile: box[4:7] for tile, box in tile_indexes[index]["tiles"].items()},
+                                     TILE_INDEX_SIZE, datasets[key].height, datasets[key].width)
+                        for index, key in enumerate(keys)]
+            pair_pyramids = [buildPyramid(tiles, TILE_INDEX_SIZE, height, width) for tiles in saved_tiles]
+            screen = screenBlock([datasets[key] for key in keys], pyramids, pairs, transform, pair_pyramids)
+            def skip_block(window):
+                if not screen(window):
+                    return False
+                screened.append(window)
+                for tile_row, tile_col, tile in blockTiles(window):
+                    for tiles, saved in zip(pair_tiles, saved_tiles):
+                        if (tile_row, tile_col) in saved:
+                            tiles[(tile_row, tile_col)] = saved[(tile_row, tile_col)]
+                return True
+        else:
+            skip_block = None
+        # work arrays of the per-pair steps, allocated once for the pass and cut to each block
+        pair_diff = np.empty((blockSize, blockSize), dtype=dtype)
+        pair_masks = np.empty((4, blockSize, blockSize), dtype=bool)
+        pair_reclas = np.empty((blockSize, blockSize), dtype=np.uint8)
+        pair_values = np.empty((2, blockSize, blockSize), dtype=np.float32)
+        with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MB * 2**20):
+            for window, stack, valid, ext_flags, reclas, ext_counts, cell_counts, tile_stats in evaluateBlocks(
+                    [datasets[key] for key in keys], transform, width, height, with02, blockSize, block_workers, tile_indexes,
+                    skip_block, cellRemap(tolerances[0]), use_kernel, readers, prefetch):
+                rows, cols = int(window.height), int(window.width)
+                diff, reclas_tol = pair_diff[:rows, :cols], pair_reclas[:rows, :cols]
+                both, flagged, work = pair_masks[0, :rows, :cols], pair_masks[1, :rows, :cols], pair_masks[2:, :rows, :cols]
+                values = pair_values[:, :rows, :cols]
+                for index, tiles in building.items():
+                    ds = datasets[keys[index]]
+                    src_window = sourceWindow(ds, window, transform)
+                    updateTileIndex(tiles, stack[index], valid[index], int(src_window.row_off), int(src_window.col_off),
+                                    ds.height, ds.width)
+                row, col = int(window.row_off), int(window.col_off)
+                for index, pair in enumerate(pairs):
+                    for key, stats in tile_stats[index].items():
+                        mergeTileStats(pair_tiles[index], key, stats)
+                    if len(pair["tolerances"]) < 2:
+                        continue
+                    # the further pass bands, on the differences of the pair
+                    lower, higher = pair["lower_index"], pair["higher_index"]
+                    np.subtract(stack[higher], stack[lower], out=diff)
+                    np.logical_and(valid[lower], valid[higher], out=both)
+                    for tolerance in pair["tolerances"][1:]:
+                        reclassifyArray(diff, both, cellRemap(tolerance), out=reclas_tol, work=work)
+                        np.equal(reclas_tol, 1, out=flagged)
+                        counts[toleranceName(pair, tolerance)] += int(np.count_nonzero(flagged))
+                        outputs[toleranceName(pair, tolerance)].write(flagged, row, col)
+                for index, pair in enumerate(pairs):
+                    counts[pair["extent_name"]] += int(ext_counts[index])
+                    outputs[pair["extent_name"]].write(ext_flags[index].view(bool), row, col)
+                    counts[pair["reclassify_name"]] += int(cell_counts[index])
+                    np.equal(reclas[index], 1, out=flagged)
+                    outputs[pair["reclassify_name"]].write(flagged, row, col)
+                    if cell_counts[index]:
+                        values.fill(np.nan)
+                        np.copyto(values[0], stack[pair["lower_index"]], where=flagged)
+                        np.copyto(values[1], stack[pair["higher_index"]], where=flagged)
+                        outputs[pair["points_name"]].write(values, window=window)
+
+        for index, tiles in building.items():
+            ds = datasets[keys[index]]
+            n_tiles = math.ceil(ds.height / TILE_INDEX_SIZE) * math.ceil(ds.width / TILE_INDEX_SIZE)
+            print(f"Tile index of {keys[index]}: {len(tiles)} of {n_tiles} tiles hold data.")
+            saveTileIndex(read_paths[keys[index]], {"tile_size": TILE_INDEX_SIZE, "tiles": tiles})
+        if tileIndex:
+            for pair, tiles in zip(pairs, pair_tiles):
+                savePairStats(stats_file, pair, read_paths[keys[pair["lower_index"]]], read_paths[keys[pair["higher_index"]]],
+                              grid, tiles)
+        if screened:
+            print(f"{len(screened)} blocks pass on the block min/max pyramid and were not read.")
+    finally:
+        closeRasters(datasets)
+        for ds in outputs.values():
+            ds.close()
+
+    # the exports of the pairs share no outputs, so they run as independent jobs
+    jobs = [(pair, outputs[pair["extent_name"]].path, counts[pair["extent_name"]],
+             os.path.join(shapefilesFolder, pair["extent_name"] + ".shp"), outputs[pair["reclassify_name"]].path,
+             outputs[pair["points_name"]].name, os.path.join(shapefilesFolder, pair["points_name"] + ".shp"))
+            for pair in pairs]
+    exports = runPairJobs(exportPair, jobs, export_workers)
+
+    results = {"properties": properties, "pairs": []}
+    cell_area = abs(transform.a * transform.e)
+    for index, (pair, (diffFva, regions, area, pointsShp, points)) in enumerate(zip(pairs, exports)):
+        lower, higher, violations = pair["lower"], pair["higher"], counts[pair["reclassify_name"]]
+        results["pairs"].append({
+            "lower": lower, "higher": higher, "label": pair["label"],
+            "extent_status": extentStatus(lower, higher, diffFva, regions),
+            "extent_shp": diffFva, "extent_regions": regions, "extent_area": area,
+            "cell_status": cellStatus(lower, higher, pointsShp, violations),
+            "reclassify": outputs[pair["reclassify_name"]].path, "cell_violations": violations,
+            "points_shp": pointsShp, "points": points,
+            "statistics": pairStatistics(pair_tiles[index], edges[index], violations, cell_area),
+        })
+        results["pairs"][-1]["statistics"]["tolerances"] = [
+            {"tolerance": tolerance, "violations": counts[name], "violation_area": counts[name] * cell_area,
+             "mask": outputs[name].path}
+            for tolerance, name in zip(pair["tolerances"], [pair["reclassify_name"]] +
+                                       [toleranceName(pair, tolerance) for tolerance in pair["tolerances"][1:]])]
+    return results
+
+def firstCell(flags, window, transform):
+    """Map coordinates (x, y) of the centre of the first flagged cell of a block, in row order."""
+    row, col = np.unravel_index(np.argmax(flags), flags.shape)
+    return transform * (window.col_off + col + 0.5, window.row_off + row + 0.5)
+
+def runTriageQC(rasters, tempFolder, shapefilesFolder, blockSize=None, tileIndex=True, tolerances=(TOLERANCE,),
+                memoryGb=None, workingFolder=None):
+    """Pass/fail only extent (R11) and cell value (R14) checks that stop each pair at its first violation.
+
+    The blocks are streamed as in runFusedQC, but nothing is written: no masks, polygons or points. A check
+    of a pair is decided at its first flagged cell; the rasters of decided pairs are not read any more, and
+    the pass ends once every check is decided, so only the pairs that pass are read to the end. A Pass
+    status is worded as in runFusedQC; a Warning names no shapefile, as none is written, but the first
+    flagged cell (see triageNote). With
+    tileIndex, saved tile indexes and pair stats skip blocks as in runFusedQC; they are not built here.
+    Only the first pass band of tolerances is checked. The block size, when not given, is chosen by
+    planMemory within the memoryGb budget, as in runFusedQC with one worker. Rasters are read in place and
+    from working copies in workingFolder as in runFusedQC.
+
+    Returns a dict with the raster "properties" by key, and "pairs", one dict per pair with lower, higher,
+    label, extent_status, cell_status, and extent_first / cell_first, the map coordinates of the first
+    flagged cell of each check (None when it passes).
+    """
+    levels = [key for key, path in rasters.items() if key != PCT02_KEY and path]
+    with02 = bool(rasters.get(PCT02_KEY))
+    keys = levels + ([PCT02_KEY] if with02 else [])
+    pairs = qcPairs(levels, with02, tolerances[:1])
+    read_paths = workingCopies(rasters, workingFolder) if workingFolder else rasters
+    datasets = openRasters(read_paths, keys)
+    try:
+        ref_ds = datasets[keys[0]]
+        for key in keys[1:]:
+            checkSameGrid(ref_ds, datasets[key])
+        properties = {key: qcheader.headerProperties(rasters[key], tempFolder) or getRasterProperties(datasets[key])
+                      for key in keys}
+        transform, width, height = unionGrid([datasets[key] for key in keys])
+        # the differences are computed in the stack dtype of runFusedQC, so the statuses match at the tolerance edges
+        dtype = np.result_type(*[datasets[key].dtypes[0] for key in keys])
+        budget = memoryBudget(memoryGb)
+        blockSize, _, need = planMemory([datasets[key] for key in keys], budget, 1, blockSize, 0)
+        print(f"Memory budget {budget / 2**30:.1f} GB: blocks of {blockSize} x {blockSize} cells, "
+              f"about {need / 2**30:.2f} GB in use.")
+
+        tile_indexes = [loadTileIndex(read_paths[key]) if tileIndex else None for key in keys]
+        skip_block = None
+        if tileIndex and all(index is not None for index in tile_indexes):
+            stats_file, grid = os.path.join(tempFolder, PAIR_STATS_FILE), list(transform)[:6] + [width, height]
+            pyramids = [buildPyramid({tile: box[4:7] for tile, box in tile_indexes[index]["tiles"].items()},
+                                     TILE_INDEX_SIZE, datasets[key].height, datasets[key].width)
+                        for index, key in enumerate(keys)]
+            pair_pyramids = []
+            for pair in pairs:
+                tiles = loadPairStats(stats_file, pair, read_paths[keys[pair["lower_index"]]],
+                                      read_paths[keys[pair["higher_index"]]], grid)
+                pair_pyramids.append(buildPyramid(tiles, TILE_INDEX_SIZE, height, width) if tiles is not None else None)
+            skip_block = screenBlock([datasets[key] for key in keys], pyramids, pairs, transform, pair_pyramids)
+
+        extent_first, cell_first = [None] * len(pairs), [None] * len(pairs)
+        with rasterio.Env(GDAL_CACHEMAX=GDAL_CACHE_MB * 2**20):
+            for window in dataWindows([datasets[key] for key in keys], transform, width, height, blockSize, tile_indexes,
+                                      skip_block):
+                open_pairs = [index for index in range(len(pairs)) if extent_first[index] is None or cell_first[index] is None]
+                if not open_pairs:
+                    break
+                blocks = {}
+                for index in open_pairs:
+                    pair = pairs[index]
+                    for raster in (pair["lower_index"], pair["higher_index"]):
+                        if raster not in blocks:
+                            ds = datasets[keys[raster]]
+                            block = readBlock(ds, window, transform, tile_indexes[raster]).astype(dtype, copy=False)
+                            blocks[raster] = (block, validMask(block, ds.nodata))
+                    (lower, lower_valid), (higher, higher_valid) = blocks[pair["lower_index"]], blocks[pair["higher_index"]]
+                    if extent_first[index] is None:
+                        flags = lower_valid & ~higher_valid
+                        if flags.any():
+                            extent_first[index] = firstCell(flags, window, transform)
+                    if cell_first[index] is None:
+                        flags = reclassifyArray(higher - lower, lower_valid & higher_valid, pair["remap"]) == 1
+                        if flags.any():
+                            cell_first[index] = firstCell(flags, window, transform)
+    finally:
+        closeRasters(datasets)
+
+    results = {"properties": properties, "pairs": []}
+    for index, pair in enumerate(pairs):
+        lower, higher = pair["lower"], pair["higher"]
+        diffFva = os.path.join(shapefilesFolder, pair["extent_name"] + ".shp")
+        pointsShp = os.path.join(shapefilesFolder, pair["points_name"] + ".shp")
+        results["pairs"].append({
+            "lower": lower, "higher": higher, "label": pair["label"],
+            "extent_status": extentStatus(lower, higher, diffFva, None if extent_first[index] else 0, extent_first[index]),
+            "cell_status": cellStatus(lower, higher, pointsShp, None if cell_first[index] else 0, cell_first[index]),
+            "extent_first": extent_first[index], "cell_first": cell_first[index],
+        })
+    return results
+
+def generate_csv(properties, pairs, output_csv):
+    """Write the QC result CSV: one column of properties and comparison results per raster.
+
+    Same layout as generate_csv in the ArcPy tool; each pair's results go in its lower raster's column,
+    except the 0_2PCT pair, which goes in the 0_2PCT column.
+    """
+    csvheader = ['Name', 'Pixel_Type', 'Cell_Size', 'Spatial_Reference', 'Vertical_Datum', 'Vertical_Unit',
+                 '', 'Compared rasters', 'FVA rasters extents compare', 'FVA rasters cells value compare',
+                 'pbl(still developing)']
+    qclist = ['R3', 'R4', 'R6', 'R7', 'R8', 'R8', '', '', 'R11', 'R14', 'R17']
+
+    keys = list(properties)
+    columns = {key: list(properties[key]) + ["", "", "", "", ""] for key in keys}
+    for pair in pairs:
+        column_key = pair["higher"] if pair["higher"] == PCT02_KEY else pair["lower"]
+        columns[column_key][6:] = ["", pair["label"], pair["extent_status"], pair["cell_status"],
+                                   "" if column_key == PCT02_KEY else "TBD"]
+
+    with open(output_csv, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(['AttributeName', 'QC checklist item'] +
+                            [key.replace(PCT02_KEY, '0.2PCT') + ' Raster properties' for key in keys])
+        for row, (item1, item2) in enumerate(zip(csvheader, qclist)):
+            csv_writer.writerow([item1, item2] + [columns[key][row] for key in keys])
+        for row in statisticsRows(pairs, keys):
+            csv_writer.writerow(row)
+    print("Data written to CSV:", output_csv)
+    return output_csv
+
+def statisticsRows(pairs, keys):
+    """CSV rows with the cell value statistics of the pairs, in the columns of generate_csv (keys in column order).
+
+    Pairs without "statistics" (the pass/fail only mode) leave their cells empty.
+    """
+    rows = [['Cells out of tolerance', 'R14'], ['Area out of tolerance (sq map units)', 'R14'],
+            ['Cell difference min / max / mean', 'R14']]
+    # one more row per further pass band, with the cells out of it
+    tolerances = sorted({entry["tolerance"] for pair in pairs for entry in
+                         (pair.get("statistics") or {}).get("tolerances", [])[1:]})
+    rows += [[f'Cells out of +/-{tolerance:g} ft tolerance', 'R14'] for tolerance in tolerances]
+    columns = {key: [""] * len(rows) for key in keys}
+    for pair in pairs:
+        statistics = pair.get("statistics")
+        if not statistics:
+            continue
+        column_key = pair["higher"] if pair["higher"] == PCT02_KEY else pair["lower"]
+        columns[column_key][0] = str(statistics["violations"])
+        columns[column_key][1] = f"{statistics['violation_area']:.1f}"
+        if statistics["compared_cells"]:
+            columns[column_key][2] = (f"{statistics['diff_min']:.3f} / {statistics['diff_max']:.3f} / "
+                                      f"{statistics['diff_mean']:.3f}")
+        for entry in statistics.get("tolerances", [])[1:]:
+            columns[column_key][3 + tolerances.index(entry["tolerance"])] = str(entry["violations"])
+    return [row + [columns[key][index] for key in keys] for index, row in enumerate(rows)]
+
+def writeSummary(properties, pairs, outJson):
+    """Write the machine-readable QC summary: raster properties, and per pair the statuses and statistics."""
+    summary = {"rasters": properties, "pairs": [
+        {key: pair.get(key) for key in ("label", "lower", "higher", "extent_status", "extent_regions", "extent_area",
+                                         "cell_status", "cell_violations", "statistics")} for pair in pairs]}
+    with open(outJson, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=1)
+    print("Summary written to:", outJson)
+    return outJson
+
+def detectRasters(rasters_folder, levelPattern=LEVEL_PATTERN):
+    """Find the freeboard level GeoTIFFs and the optional 0_2PCT GeoTIFF in a folder.
+
+    Every file name matching levelPattern (00FVA, 01FVA, ... 05FVA by default) is one level of the stack.
+    Returns a dict of key -> path with the levels in ascending order, followed by PCT02_KEY (None if missing).
+    """
+    found = {}
+    for file in sorted(os.listdir(rasters_folder)):
+        if not file.endswith('.tif'):
+            continue
+        if PCT02_KEY in file:
+            key = PCT02_KEY
+        else:
+            match = re.search(levelPattern, file)
+            if not match:
+                continue
+            key = match.group()
+        if key in found:
+            raise ValueError(f"Duplicate '{key}' raster found.")
+        found[key] = os.path.join(rasters_folder, file)
+
+    levels = sorted((key for key in found if key != PCT02_KEY), key=levelNumber)
+    detected_rasters = {key: found[key] for key in levels}
+    detected_rasters[PCT02_KEY] = found.get(PCT02_KEY)
+    return detected_rasters
+
+
+#-------------------------------------------------------------------------------
+# Command line entry point for machines without ArcGIS
+#-------------------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare FFRMS FVA raster extents and cell values without ArcGIS.")
+    parser.add_argument("rasters_folder", help="folder holding the freeboard level (and optional 0_2PCT) GeoTIFFs")
+    parser.add_argument("--levels", default=None,
+                        help="comma separated freeboard levels in stack order (default: every 00FVA, 01FVA, ... found)")
+    parser.add_argument("--level-pattern", default=LEVEL_PATTERN,
+                        help="regular expression for the level key in the file names (default: %(default)s)")
+    parser.add_argument("--temp", default=None, help="folder for the reclassify masks (default: ./Temp)")
+    parser.add_argument("--shapefiles", default=None, help="folder for the diffFva shapefiles (default: ./Shapefiles)")
+    parser.add_argument("--output", default=None, help="QC result CSV (default: ./Raster_QC_Results.csv)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes for the blocks and the per-pair exports (default: 1)")
+    parser.add_argument("--block-size", type=int, default=None,
+                        help="rows/columns per block (default: the largest block up to %d aligned to the GeoTIFF "
+                             "blocks that fits the memory budget)" % BLOCK_SIZE)
+    parser.add_argument("--memory-gb", type=float, default=None,
+                        help="RAM budget of the run in GB; the block size and workers are reduced to stay within it "
+                             "(default: %d%%%% of the free RAM)" % (MEMORY_FRACTION * 100))
+    parser.add_argument("--kernel", choices=["auto", "numba", "numpy"], default="auto",
+                        help="block evaluation: the compiled numba kernel or the NumPy array steps (default: %(default)s, "
+                             "numba when installed)")
+    parser.add_argument("--read-threads", type=int, default=READ_THREADS,
+                        help="threads reading the next blocks while a block is evaluated; 0 reads each block when it "
+                             "is needed (default: %(default)s)")
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_DEPTH,
+                        help="blocks read ahead of the block being evaluated (default: %(default)s)")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="time the numba kernel against the NumPy steps on a synthetic block of --block-size cells and exit")
+    parser.add_argument("--stage", default=None, metavar="FOLDER",
+                        help="copy the rasters (e.g. from a network share) to a local staging cache in FOLDER and read the "
+                             "copies; kept for the next runs while the rasters are unchanged")
+    parser.add_argument("--stage-gb", type=float, default=qccache.STAGING_BYTES / 1024**3,
+                        help="size limit of the staging cache in GB; least recently used rasters are evicted (default: %(default)g)")
+    parser.add_argument("--stage-checksum", action="store_true",
+                        help="also check the staged copies against their checksums before reusing them")
+    parser.add_argument("--working-copies", default=None, metavar="FOLDER",
+                        help="compare uncompressed copies of the rasters made in FOLDER (kept for the next runs), which "
+                             "are read in place instead of being decoded")
+    parser.add_argument("--no-memmap", action="store_true",
+                        help="read uncompressed rasters with GDAL instead of in place through np.memmap")
+    parser.add_argument("--no-tile-index", action="store_true",
+                        help="do not read or write the valid-data tile index sidecars (.tif.qctiles.json) of the rasters")
+    parser.add_argument("--tolerances", default=str(TOLERANCE),
+                        help="comma separated pass bands (ft around 1 ft) of the freeboard level check; the first one "
+                             "gives the statuses and shapefiles, the others extra statistics and masks (default: %(default)s)")
+    parser.add_argument("--triage", action="store_true",
+                        help="pass/fail only: stop each pair at its first violation and write no shapefiles")
+    parser.add_argument("--sample", type=int, default=None, metavar="CELLS",
+                        help="quick look: estimate the cells out of tolerance of every pair from a stratified sample of CELLS cells")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of --sample (default: %(default)s)")
+    parser.add_argument("--preflight", choices=["abort", "warn", "off"], default="abort",
+                        help="check cell size, snap, CRS and vertical datum from the headers before comparing (default: %(default)s)")
+    args = parser.parse_args(argv)
+    global MAP_READS
+    MAP_READS = not args.no_memmap
+    if args.benchmark:
+        qckernels.benchmark(args.block_size or BLOCK_SIZE)
+        return 0
+
+    start_time = time.time()
+    rasters = detectRasters(args.rasters_folder, args.level_pattern)
+    if args.levels:
+        levels = [level.strip() for level in args.levels.split(',') if level.strip()]
+        missing = [level for level in levels if level not in rasters]
+        if missing:
+            print("Required rasters are missing: " + ", ".join(missing))
+            return 1
+        rasters = dict([(level, rasters[level]) for level in levels] + [(PCT02_KEY, rasters[PCT02_KEY])])
+    if len(rasters) - 1 < 2:
+        print("At least two freeboard level rasters are required.")
+        return 1
+    print(str(len(rasters) - 1) + " freeboard levels are read: " + ", ".join(key for key in rasters if key != PCT02_KEY))
+
+    tempFolder = args.temp or os.path.join(os.getcwd(), "Temp")
+    shapefilesFolder = args.shapefiles or os.path.join(os.getcwd(), "Shapefiles")
+    for folder in (tempFolder, shapefilesFolder):
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    if args.preflight != "off":
+        errors, warnings = qcheader.preflightCheck(rasters, tempFolder)
+        for message in errors + warnings:
+            print(message)
+        if errors and args.preflight == "abort":
+            print("Rasters are not comparable. Use --preflight warn to run anyway.")
+            return 1
+    if args.stage:
+        # after the pre-flight check, so rasters that cannot be compared are not copied
+        rasters = qccache.stageRasters(rasters, args.stage, int(args.stage_gb * 1024**3), verify=args.stage_checksum)
+
+    if args.sample:
+        import FFRMS_Raster_QC_Sample as qcsample
+        if args.sample < qcsample.MIN_STRATUM_SAMPLES:
+            print(f"--sample needs at least {qcsample.MIN_STRATUM_SAMPLES} cells.")
+            return 1
+        estimates = qcsample.runSampleQC(rasters, budget=args.sample, seed=args.seed, tileIndex=not args.no_tile_index)
+        qcsample.writeSampleCsv(estimates, args.output or os.path.join(os.getcwd(), "Raster_QC_Sample_Estimate.csv"))
+        print("The tool has been running for", str(timedelta(seconds=(time.time() - start_time))))
+        return 0
+    try:
+        tolerances = parseTolerances(args.tolerances)
+    except ValueError as error:
+        print("--tolerances: " + str(error))
+        return 1
+    if args.triage:
+        results = runTriageQC(rasters, tempFolder, shapefilesFolder, blockSize=args.block_size,
+                              tileIndex=not args.no_tile_index, tolerances=tolerances, memoryGb=args.memory_gb,
+                              workingFolder=args.working_copies)
+    else:
+        results = runFusedQC(rasters, tempFolder, shapefilesFolder, blockSize=args.block_size, workers=args.workers,
+                             tileIndex=not args.no_tile_index, tolerances=tolerances, memoryGb=args.memory_gb,
+                             kernel=args.kernel, workingFolder=args.working_copies, readers=args.read_threads,
+                             prefetch=args.prefetch)
+    output_csv = args.output or os.path.join(os.getcwd(), "Raster_QC_Results.csv")
+    generate_csv(results["properties"], results["pairs"], output_csv)
+    writeSummary(results["properties"], results["pairs"], os.path.splitext(output_csv)[0] + "_summary.json")
+
+    print("The tool has been running for", str(timedelta(seconds=(time.time() - start_time))))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,369 @@
+#-------------------------------------------------------------------------------
+# Name:        FFRMS_Raster_QC_Header.py
+# Purpose:     Header-only GeoTIFF reader for the FFRMS raster QC tool. Parses the
+#              TIFF tags and GeoKeys (including the vertical CRS keys) of the first
+#              image, so the checklist properties (R3-R8) are read without opening
+#              the raster. Standard library only.
+# Author:      Rachel Fan, GISP
+#              rachel.fan@stantec.com
+# Version:     1.5
+# Updated:     10/17/2026
+# Created:     10/17/2026
+# Copyright:   (c) rfan2023
+
+#-------------------------------------------------------------------------------
+
+import os
+import re
+import struct
+
+import FFRMS_Raster_QC_Cache as qccache
+
+HEADERS_NAME = "raster_headers.json"
+
+# TIFF field types: struct format and size in bytes of one value
+TIFF_TYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1), 7: ('B', 1),
+              8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8)}
+
+# TIFF and GeoTIFF tags read from the first image
+TAGS = {256: 'width', 257: 'height', 258: 'bits', 259: 'compression', 277: 'samples', 278: 'rows_per_strip',
+        284: 'planar', 322: 'tile_width', 323: 'tile_height', 339: 'sample_format', 33550: 'pixel_scale',
+        33922: 'tiepoint', 34264: 'model_transform', 34735: 'geokeys', 34736: 'geo_doubles', 34737: 'geo_ascii',
+        42113: 'nodata'}
+
+# tags of the location of the image data, read only by dataLayout: one value per strip or tile
+LAYOUT_TAGS = {273: 'strip_offsets', 279: 'strip_byte_counts', 324: 'tile_offsets', 325: 'tile_byte_counts'}
+COMPRESSION_NONE = 1
+
+# GeoKeys
+GT_MODEL_TYPE, GT_RASTER_TYPE, GT_CITATION = 1024, 1025, 1026
+GEOGRAPHIC_TYPE, GEOG_CITATION = 2048, 2049
+PROJECTED_CS_TYPE, PCS_CITATION = 3072, 3073
+VERTICAL_CS_TYPE, VERTICAL_CITATION, VERTICAL_DATUM, VERTICAL_UNITS = 4096, 4097, 4098, 4099
+RASTER_PIXEL_IS_POINT = 2
+USER_DEFINED = 32767   #GeoKey value of a reference system that has no EPSG code
+
+# arcpy Raster.pixelType codes by (SampleFormat, BitsPerSample)
+PIXEL_TYPES = {(1, 1): 'U1', (1, 2): 'U2', (1, 4): 'U4', (1, 8): 'U8', (2, 8): 'S8', (1, 16): 'U16', (2, 16): 'S16',
+               (1, 32): 'U32', (2, 32): 'S32', (3, 32): 'F32', (3, 64): 'F64'}
+DTYPES = {(1, 8): 'uint8', (2, 8): 'int8', (1, 16): 'uint16', (2, 16): 'int16', (1, 32): 'uint32', (2, 32): 'int32',
+          (3, 32): 'float32', (3, 64): 'float64'}
+ARRAY_CODES = {'uint8': 'u1', 'int8': 'i1', 'uint16': 'u2', 'int16': 'i2', 'uint32': 'u4', 'int32': 'i4', 'float32': 'f4',
+               'float64': 'f8'}   #NumPy type codes of DTYPES, without the byte order
+
+# EPSG linear units and the vertical CRSs used for FFRMS deliveries, for files that carry codes without citations
+LINEAR_UNITS = {9001: 'metre', 9002: 'foot', 9003: 'US survey foot'}
+VERTICAL_CS = {5703: ('NAVD88 height', 9001), 6360: ('NAVD88 height (ftUS)', 9003), 8228: ('NAVD88 height (ft)', 9002),
+               5702: ('NGVD29 height (ftUS)', 9003), 7968: ('NGVD29 height (m)', 9001), 6357: ('NAVD88 depth', 9001),
+               5714: ('MSL height', 9001), 6132: ('PRVD02 height', 9001), 6130: ('GUVD04 height', 9001)}
+
+ESRI_PE = "ESRI PE String = "
+
+_headers = {}   #headers read by this process, by absolute path
+
+
+def readIFD(tiff, offset, order, bigtiff, names=TAGS):
+    """Read the tags of names (TAGS by default) from the image file directory at offset. Returns a dict of tag
+    name -> values."""
+    count_format, entry_format, entry_size = ('Q', 'HHQ8s', 20) if bigtiff else ('H', 'HHI4s', 12)
+    tiff.seek(offset)
+    count = struct.unpack(order + count_format, tiff.read(struct.calcsize(count_format)))[0]
+    entries = tiff.read(count * entry_size)
+    inline = 8 if bigtiff else 4
+    tags = {}
+    for index in range(count):
+        code, field_type, length, value = struct.unpack(order + entry_format, entries[index * entry_size:(index + 1) * entry_size])
+        if code not in names or field_type not in TIFF_TYPES:
+            continue
+        value_format, size = TIFF_TYPES[field_type]
+        if length * size > inline:
+            tiff.seek(struct.unpack(order + ('Q' if bigtiff else 'I'), value)[0])
+            value = tiff.read(length * size)
+        if field_type == 2:
+            tags[names[code]] = value[:length].rstrip(b'\0').decode('latin-1')
+        else:
+            values = struct.unpack(order + value_format * length, value[:length * size])
+            if field_type in (5, 10):
+                values = tuple(values[i] / values[i + 1] if values[i + 1] else 0.0 for i in range(0, len(values), 2))
+            tags[names[code]] = values
+    return tags
+
+def parseGeoKeys(tags):
+    """Decode the GeoKeyDirectory into a dict of key ID -> value (int, float tuple or string)."""
+    directory = tags.get('geokeys')
+    geokeys = {}
+    if not directory:
+        return geokeys
+    for index in range(4, 4 + 4 * directory[3], 4):
+        key, location, count, value = directory[index:index + 4]
+        if location == 0:
+            geokeys[key] = value
+        elif location == 34736 and 'geo_doubles' in tags:
+            geokeys[key] = tags['geo_doubles'][value:value + count]
+        elif location == 34737 and 'geo_ascii' in tags:
+            geokeys[key] = tags['geo_ascii'][value:value + count].rstrip('|\0')
+    return geokeys
+
+def geoTransform(tags, geokeys):
+    """Affine coefficients (a, b, c, d, e, f) of the upper left corner of the cells, as GDAL reports them."""
+    if 'model_transform' in tags:
+        m = tags['model_transform']
+        a, b, c, d, e, f = m[0], m[1], m[3], m[4], m[5], m[7]
+    elif 'pixel_scale' in tags and 'tiepoint' in tags:
+        scale_x, scale_y = tags['pixel_scale'][:2]
+        i, j, _, x, y, _ = tags['tiepoint'][:6]
+        a, b, c, d, e, f = scale_x, 0.0, x - i * scale_x, 0.0, -scale_y, y + j * scale_y
+    else:
+        return None
+    if geokeys.get(GT_RASTER_TYPE) == RASTER_PIXEL_IS_POINT:
+        c, f = c - (a + b) / 2.0, f - (d + e) / 2.0
+    return (a, b, c, d, e, f)
+
+def readFirstIFD(path, names=TAGS):
+    """Read the tags of names from the first image file directory of a TIFF file.
+
+    Returns (tags, byte order '<' or '>'). Raises ValueError if path is not a TIFF file.
+    """
+    with open(path, 'rb') as tiff:
+        head = tiff.read(16)
+        if head[:2] not in (b'II', b'MM'):
+            raise ValueError(path + " is not a TIFF file.")
+        order = '<' if head[:2] == b'II' else '>'
+        version = struct.unpack(order + 'H', head[2:4])[0]
+        if version == 42:
+            return readIFD(tiff, struct.unpack(order + 'I', head[4:8])[0], order, False, names), order
+        if version == 43:
+            return readIFD(tiff, struct.unpack(order + 'Q', head[8:16])[0], order, True, names), order
+        raise ValueError(path + " is not a TIFF file.")
+
+def readHeader(path):
+    """Parse the first image header of a GeoTIFF. Raises ValueError if path is not a TIFF file.
+
+    Returns a dict with width, height, samples, dtype, pixel_type, compression, block size, nodata,
+    transform (a, b, c, d, e, f) and the GeoKeys by ID.
+    """
+    tags, order = readFirstIFD(path)
+    geokeys = parseGeoKeys(tags)
+    sample_type = (tags.get('sample_format', (1,))[0], tags.get('bits', (1,))[0])
+    nodata = tags.get('nodata')
+    if nodata is not None:
+        try:
+            nodata = float(nodata.strip())
+        except ValueError:
+            nodata = None
+    tiled = 'tile_width' in tags
+    return {
+        'width': tags['width'][0], 'height': tags['height'][0], 'samples': tags.get('samples', (1,))[0],
+        'dtype': DTYPES.get(sample_type), 'pixel_type': PIXEL_TYPES.get(sample_type),
+        'compression': tags.get('compression', (1,))[0], 'tiled': tiled,
+        'block': (tags['tile_width'][0], tags['tile_height'][0]) if tiled else
+                 (tags['width'][0], min(tags.get('rows_per_strip', tags['height'])[0], tags['height'][0])),
+        'nodata': nodata,
+        'transform': geoTransform(tags, geokeys),
+        'geokeys': {str(key): value for key, value in geokeys.items()},   #str keys, like the JSON cache
+    }
+
+def dataLayout(path):
+    """Where the cells of the first image of a GeoTIFF lie in the file, for reading them without decoding.
+
+    Only an uncompressed single band image with every strip or tile written out can be read in place.
+    Returns a dict with width, height, tiled, block (width, height), the dtype with the byte order of
+    the file (e.g. '<f4') and the byte offsets of the strips or tiles, in row order. The last strip may
+    hold fewer rows. Returns None for any other file (LZW, DEFLATE, sparse blocks, several bands), which
+    is then read with GDAL.
+    """
+    try:
+        tags, order = readFirstIFD(path, {**TAGS, **LAYOUT_TAGS})
+    except (OSError, ValueError, struct.error):
+        return None
+    dtype = DTYPES.get((tags.get('sample_format', (1,))[0], tags.get('bits', (1,))[0]))
+    if (tags.get('compression', (COMPRESSION_NONE,))[0] != COMPRESSION_NONE or tags.get('samples', (1,))[0] != 1
+            or dtype is None or 'width' not in tags or 'height' not in tags):
+        return None
+    width, height = tags['width'][0], tags['height'][0]
+    itemsize = int(ARRAY_CODES[dtype][1])
+    tiled = 'tile_width' in tags
+    if tiled:
+        block = (tags['tile_width'][0], tags['tile_height'][0])
+        offsets, counts = tags.get('tile_offsets'), tags.get('tile_byte_counts')
+        n_blocks = -(-height // block[1]) * -(-width // block[0])
+    else:
+        block = (width, min(tags.get('rows_per_strip', (height,))[0], height))
+        offsets, counts = tags.get('strip_offsets'), tags.get('strip_byte_counts')
+        n_blocks = -(-height // block[1])
+    if not offsets or not counts or len(offsets) != n_blocks or len(counts) != n_blocks:
+        return None
+    block_bytes = block[0] * block[1] * itemsize
+    last_bytes = block_bytes if tiled else (height - (n_blocks - 1) * block[1]) * width * itemsize
+    if min(counts[:-1], default=block_bytes) < block_bytes or counts[-1] < last_bytes:
+        return None
+    return {'width': width, 'height': height, 'tiled': tiled, 'block': block, 'dtype': order + ARRAY_CODES[dtype],
+            'offsets': list(offsets)}
+
+def cachedHeader(path, cacheFolder=None):
+    """readHeader with a cache keyed by path, modification time and size.
+
+    Headers are remembered for the process, and in cacheFolder (if given) for later runs, so an
+    unchanged raster is not opened again.
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    known = _headers.get(key)
+    if known is None and cacheFolder:
+        known = qccache.loadIndex(cacheFolder, HEADERS_NAME).get(key)
+    if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+        _headers[key] = known
+        return known['header']
+
+    header = readHeader(path)
+    _headers[key] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'header': header}
+    if cacheFolder:
+        if not os.path.exists(cacheFolder):
+            os.makedirs(cacheFolder)
+        headers = qccache.loadIndex(cacheFolder, HEADERS_NAME)
+        headers[key] = _headers[key]
+        qccache.saveIndex(cacheFolder, headers, HEADERS_NAME)
+    return header
+
+def peName(pe_string, keywords):
+    """Return the name of the first node with one of the keywords in an ESRI PE (WKT) string, or None."""
+    match = re.search(r'(?:' + '|'.join(keywords) + r')\["([^"]+)"', pe_string)
+    return match.group(1) if match else None
+
+def crsCitation(geokeys):
+    """The citation of the reference system in the GeoKeys, '' when there is none."""
+    return geokeys.get(str(PCS_CITATION)) or geokeys.get(str(GT_CITATION)) or geokeys.get(str(GEOG_CITATION)) or ''
+
+def crsNames(geokeys):
+    """Spatial reference name, vertical CS name and vertical unit from the GeoKeys.
+
+    'Not Defined' is returned for a reference system that is absent, None for one that is present
+    but cannot be named from the header alone. Without an ESRI PE string the names are the EPSG ones
+    cited in the header, which only compare the rasters with each other (see headerProperties).
+    """
+    citation = crsCitation(geokeys)
+    sr_name, vcs_name, vcs_unit = 'Not Defined', 'Not Defined', 'Not Defined'
+    if ESRI_PE in citation:
+        # written by ArcGIS: the full PE string carries the names arcpy reports
+        pe_string = citation[citation.index(ESRI_PE) + len(ESRI_PE):]
+        sr_name = peName(pe_string, ['PROJCS', 'GEOGCS']) or None
+        vcs_start = pe_string.find('VERTCS[')
+        if vcs_start >= 0:
+            vcs_name = peName(pe_string[vcs_start:], ['VERTCS'])
+            vcs_unit = peName(pe_string[vcs_start:], ['UNIT'])
+    else:
+        if str(PROJECTED_CS_TYPE) in geokeys or str(GEOGRAPHIC_TYPE) in geokeys or citation:
+            sr_name = citation or None
+        vertical = geokeys.get(str(VERTICAL_CS_TYPE))
+        if vertical is not None:
+            # GDAL cites a compound CRS as "horizontal + vertical"
+            if sr_name and ' + ' in sr_name:
+                sr_name = sr_name.split(' + ')[0]
+            known_name, known_unit = VERTICAL_CS.get(vertical, (None, None))
+            vcs_name = geokeys.get(str(VERTICAL_CITATION)) or known_name
+            vcs_unit = LINEAR_UNITS.get(geokeys.get(str(VERTICAL_UNITS), known_unit))
+    return sr_name, vcs_name, vcs_unit
+
+def crsCodes(geokeys):
+    """EPSG codes of the horizontal (projected, else geographic) and vertical reference systems in the GeoKeys,
+    None for one that is absent or user defined."""
+    horizontal = geokeys.get(str(PROJECTED_CS_TYPE)) or geokeys.get(str(GEOGRAPHIC_TYPE))
+    vertical = geokeys.get(str(VERTICAL_CS_TYPE))
+    return tuple(code if code and code != USER_DEFINED else None for code in (horizontal, vertical))
+
+def sameCrs(code, refCode, names, refNames):
+    """True, False, or None when it cannot be told: two reference systems are the same when their EPSG codes
+    match, or, when neither has a code, their names. The names are ESRI PE names or EPSG citations (see
+    crsNames), so they do not decide between a raster with a code and one without."""
+    if code and refCode:
+        return code == refCode
+    if not code and not refCode:
+        return names == refNames
+    return True if names == refNames else None
+
+def headerProperties(path, cacheFolder=None):
+    """Read the checklist properties (R3-R8) of a GeoTIFF from its header, in the order of getRasterProperties.
+
+    Returns None if the file is not a GeoTIFF or a property cannot be resolved from the header; the
+    caller then falls back to opening the raster. Only a header with an ESRI PE string names the
+    reference systems as arcpy does, so for any other the raster is opened as well.
+    """
+    try:
+        header = cachedHeader(path, cacheFolder)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+    if ESRI_PE not in crsCitation(header['geokeys']):
+        return None
+    sr_name, vcs_name, vcs_unit = crsNames(header['geokeys'])
+    if header['transform'] is None or None in (header['pixel_type'], sr_name, vcs_name, vcs_unit):
+        return None
+    a, b, c, d, e, f = header['transform']
+    raster_properties = [
+        os.path.basename(path), #QC R3
+        header['pixel_type'], #QC R4
+        round(abs(e) if b == 0 and d == 0 else (b * b + e * e) ** 0.5, 5),  #QC R6
+        sr_name,    #QC R7
+        vcs_name, #QC R8
+        vcs_unit #QC R8 unit
+    ]
+    return raster_properties
+
+def preflightCheck(rasters, cacheFolder=None, tolerance=1e-6):
+    """Check from the headers alone that the rasters can be compared cell by cell.
+
+    rasters maps keys to paths (None for a missing raster); the first raster is the reference. Cell
+    size, rotation, snap alignment of the grid origins and the horizontal and vertical reference
+    systems must match, else an error is reported; a different pixel type is a warning. The reference
+    systems are compared by their EPSG codes (see sameCrs); when only one raster has a code and the names
+    differ, it is a warning. Returns (errors, warnings), two lists of messages.
+    """
+    errors, warnings = [], []
+    headers = {}
+    for key, path in rasters.items():
+        if not path:
+            continue
+        try:
+            headers[key] = cachedHeader(path, cacheFolder)
+        except (OSError, ValueError, KeyError, struct.error):
+            warnings.append(f"{key}: {os.path.basename(path)} is not a GeoTIFF, its grid is not checked.")
+            continue
+        if headers[key]['transform'] is None:
+            errors.append(f"{key}: {os.path.basename(path)} has no georeferencing.")
+            del headers[key]
+    if len(headers) < 2:
+        return errors, warnings
+
+    ref_key = next(iter(headers))
+    ref = headers[ref_key]
+    ref_a, ref_b, ref_c, ref_d, ref_e, ref_f = ref['transform']
+    ref_names, ref_codes = crsNames(ref['geokeys']), crsCodes(ref['geokeys'])
+    for key, header in list(headers.items())[1:]:
+        a, b, c, d, e, f = header['transform']
+        if b or d or ref_b or ref_d:
+            if (a, b, d, e) != (ref_a, ref_b, ref_d, ref_e):
+                errors.append(f"{key}: rotated grid does not match {ref_key}.")
+            continue
+        if abs(a - ref_a) > tolerance * abs(ref_a) or abs(e - ref_e) > tolerance * abs(ref_e):
+            errors.append(f"{key}: cell size {a:g} x {-e:g} differs from {ref_key} ({ref_a:g} x {-ref_e:g}).")
+        else:
+            # the grid origins must be a whole number of cells apart
+            shift_x, shift_y = (c - ref_c) / ref_a, (f - ref_f) / ref_e
+            off_x, off_y = abs(shift_x - round(shift_x)), abs(shift_y - round(shift_y))
+            if off_x > 1e-3 or off_y > 1e-3:
+                errors.append(f"{key}: grid origin ({c:.3f}, {f:.3f}) is not snapped to the {ref_key} grid "
+                              f"(off by {off_x:.3f} x {off_y:.3f} cells).")
+
+        names, codes = crsNames(header['geokeys']), crsCodes(header['geokeys'])
+        same = sameCrs(codes[0], ref_codes[0], names[0], ref_names[0])
+        if not same:
+            message = f"{key}: spatial reference '{names[0]}' differs from {ref_key} ('{ref_names[0]}')"
+            (errors if same is False else warnings).append(
+                message + ("." if same is False else "; only one of them has an EPSG code, check it."))
+        same = sameCrs(codes[1], ref_codes[1], names[1:], ref_names[1:])
+        if not same:
+            message = f"{key}: vertical datum '{names[1]}' ({names[2]}) differs from {ref_key} ('{ref_names[1]}' ({ref_names[2]}))"
+            (errors if same is False else warnings).append(
+                message + ("." if same is False else "; only one of them has an EPSG code, check it."))
+        if header['pixel_type'] != ref['pixel_type']:
+            warnings.append(f"{key}: pixel type {header['pixel_type']} differs from {ref_key} ({ref['pixel_type']}).")
+    return errors, warnings
@@ -0,0 +1,214 @@
+#-------------------------------------------------------------------------------
+# Name:        FFRMS_Raster_QC_Kernels.py
+# Purpose:     Optional compiled block kernel of the NumPy engine of the FFRMS raster
+#              QC tool: the NoData tests, differences, reclassify, flag counts and
+#              per-tile difference stats of every pair of a block in one loop over
+#              its cells. Needs numba; without it the engine keeps its NumPy array
+#              steps, with the same results.
+# Author:      Rachel Fan, GISP
+#              rachel.fan@stantec.com
+# Version:     1.5
+# Updated:     10/17/2026
+# Created:     10/17/2026
+# Copyright:   (c) rfan2023
+
+#-------------------------------------------------------------------------------
+
+import sys
+import time
+import math
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+AVAILABLE = njit is not None   #True when numba can be imported
+
+
+def _fusedBlock(stack, nodatas, hasNodata, lowerIndex, higherIndex, lows, highs, codes, edges, nEdges, binScale, maskNodata,
+                tileSize, row0, col0, extOut, reclasOut, validOut, extCounts, cellCounts,
+                tileCount, tileMin, tileMax, tileExt, tileSum, tileHist):
+    """One pass over the cells of a block for all pairs, tile by tile; see fusedBlock. Compiled with numba
+    when available. The stats of a tile are kept in local variables while its cells are read, and its
+    valid masks are reused by the pairs while the tile is in the CPU cache."""
+    n_rasters, rows, cols = stack.shape
+    n_pairs, n_ranges = lows.shape
+    tiles_y, tiles_x = tileCount.shape[1], tileCount.shape[2]
+    for tile_row in range(tiles_y):
+        r0 = max((row0 // tileSize + tile_row) * tileSize - row0, 0)
+        r1 = min((row0 // tileSize + tile_row + 1) * tileSize - row0, rows)
+        for tile_col in range(tiles_x):
+            c0 = max((col0 // tileSize + tile_col) * tileSize - col0, 0)
+            c1 = min((col0 // tileSize + tile_col + 1) * tileSize - col0, cols)
+            for i in range(n_rasters):
+                nodata, has_nodata = nodatas[i], hasNodata[i]
+                for r in range(r0, r1):
+                    for c in range(c0, c1):
+                        value = stack[i, r, c]
+                        # NaN is never data
+                        validOut[i, r, c] = value == value and not (has_nodata and value == nodata)
+            for k in range(n_pairs):
+                lower, higher, n_edges = lowerIndex[k], higherIndex[k], nEdges[k]
+                count, ext_count, flag_count = 0, 0, 0
+                low_diff, high_diff, total = np.inf, -np.inf, 0.0
+                for r in range(r0, r1):
+                    for c in range(c0, c1):
+                        lower_valid, higher_valid = validOut[lower, r, c], validOut[higher, r, c]
+                        ext = lower_valid and not higher_valid
+                        extOut[k, r, c] = ext
+                        if ext:
+                            ext_count += 1
+                        code = maskNodata
+                        if lower_valid and higher_valid:
+                            diff = stack[higher, r, c] - stack[lower, r, c]
+                            for j in range(n_ranges):
+                                if diff >= lows[k, j] and diff <= highs[k, j]:
+                                    code = codes[k, j]
+                                    break
+                            count += 1
+                            low_diff = min(low_diff, diff)
+                            high_diff = max(high_diff, diff)
+                            total += diff
+                            # histogram bin: the number of edges <= diff, as np.searchsorted(side='right'); the edges
+                            # are evenly spaced, so the bin is guessed from the spacing and corrected on the exact edges
+                            if diff != diff or diff >= edges[k, n_edges - 1]:
+                                b = n_edges
+                            elif diff < edges[k, 0]:
+                                b = 0
+                            else:
+                                b = min(max(int((diff - edges[k, 0]) * binScale[k]) + 1, 1), n_edges - 1)
+                                while b > 1 and edges[k, b - 1] > diff:
+                                    b -= 1
+                                while edges[k, b] <= diff:
+                                    b += 1
+                            tileHist[k, tile_row, tile_col, b] += 1
+                        reclasOut[k, r, c] = code
+                        if code == 1:
+                            flag_count += 1
+                tileCount[k, tile_row, tile_col], tileExt[k, tile_row, tile_col] = count, ext_count
+                tileMin[k, tile_row, tile_col], tileMax[k, tile_row, tile_col] = low_diff, high_diff
+                tileSum[k, tile_row, tile_col] = total
+                extCounts[k] += ext_count
+                cellCounts[k] += flag_count
+
+if AVAILABLE:
+    _fusedBlock = njit(cache=True, nogil=True)(_fusedBlock)
+
+
+def fusedBlock(stack, nodatas, pairs, bounds, edges, row, col, tileSize, extOut, reclasOut, validOut, maskNodata=255):
+    """Evaluate every pair of a block in one loop over its cells, with the compiled kernel.
+
+    stack is (rasters, rows, cols) with the NoData value (or None) of each raster in nodatas, and pairs lists
+    the (lower, higher) stack indexes of the pairs. bounds holds, per pair, the reclassify table as
+    (low, high, new value) rows with the bounds in the stack dtype (see remapBounds in the engine), and
+    edges the histogram edges of the pair in the stack dtype. extOut, reclasOut and validOut are filled as
+    by the NumPy steps of evaluateBlock; the block's upper left cell is at (row, col) of the common grid.
+
+    Returns the flagged extent cells and flagged cell values per pair, and per pair a dict of the stats of
+    the tiles of tileSize cells that overlap the block, as updatePairStats builds them. The difference sums
+    are added in cell order, so they can differ from the NumPy ones in the last digits.
+    """
+    dtype = stack.dtype
+    n_pairs = len(pairs)
+    nodata_values = np.zeros(len(nodatas), dtype=dtype)
+    has_nodata = np.zeros(len(nodatas), dtype=np.bool_)
+    for index, nodata in enumerate(nodatas):
+        # a NoData value the stack dtype cannot hold matches no cell, as in the NumPy comparison
+        if nodata is None or math.isnan(nodata):
+            continue
+        if dtype.kind == 'f' or (float(nodata).is_integer() and np.iinfo(dtype).min <= nodata <= np.iinfo(dtype).max):
+            nodata_values[index], has_nodata[index] = nodata, True
+    n_ranges = max(len(rows) for rows in bounds)
+    lows = np.ones((n_pairs, n_ranges), dtype=dtype)     #unused rows: low 1 > high 0, never hit
+    highs = np.zeros((n_pairs, n_ranges), dtype=dtype)
+    codes = np.zeros((n_pairs, n_ranges), dtype=np.uint8)
+    for k, rows in enumerate(bounds):
+        for j, (low, high, new_value) in enumerate(rows):
+            lows[k, j], highs[k, j], codes[k, j] = low, high, new_value
+    n_edges = np.array([len(pair_edges) for pair_edges in edges], dtype=np.int64)
+    edge_dtype = dtype if dtype.kind == 'f' else np.float64
+    edge_array = np.full((n_pairs, int(n_edges.max())), np.inf, dtype=edge_dtype)
+    for k, pair_edges in enumerate(edges):
+        edge_array[k, :len(pair_edges)] = pair_edges
+    bin_scale = np.array([(len(pair_edges) - 1) / (float(pair_edges[-1]) - float(pair_edges[0])) if len(pair_edges) > 1
+                          else 0.0 for pair_edges in edges])
+
+    rows, cols = stack.shape[1:]
+    tiles_y = (row + rows - 1) // tileSize - row // tileSize + 1
+    tiles_x = (col + cols - 1) // tileSize - col // tileSize + 1
+    shape = (n_pairs, tiles_y, tiles_x)
+    tile_count, tile_ext = np.zeros(shape, dtype=np.int64), np.zeros(shape, dtype=np.int64)
+    tile_min, tile_max = np.full(shape, np.inf), np.full(shape, -np.inf)
+    tile_sum = np.zeros(shape)
+    tile_hist = np.zeros(shape + (int(n_edges.max()) + 1,), dtype=np.int64)
+    ext_counts, cell_counts = np.zeros(n_pairs, dtype=np.int64), np.zeros(n_pairs, dtype=np.int64)
+    _fusedBlock(stack, nodata_values, has_nodata, np.array([pair[0] for pair in pairs], dtype=np.int64),
+                np.array([pair[1] for pair in pairs], dtype=np.int64), lows, highs, codes, edge_array, n_edges,
+                bin_scale, maskNodata, tileSize, row, col, extOut.view(np.bool_), reclasOut, validOut, ext_counts, cell_counts,
+                tile_count, tile_min, tile_max, tile_ext, tile_sum, tile_hist)
+
+    tile_stats = []
+    for k in range(n_pairs):
+        tiles = {}
+        for tile_row in range(tiles_y):
+            for tile_col in range(tiles_x):
+                histogram = tile_hist[k, tile_row, tile_col]
+                tiles[(row // tileSize + tile_row, col // tileSize + tile_col)] = [
+                    int(tile_count[k, tile_row, tile_col]), float(tile_min[k, tile_row, tile_col]),
+                    float(tile_max[k, tile_row, tile_col]), int(tile_ext[k, tile_row, tile_col]),
+                    float(tile_sum[k, tile_row, tile_col]), {int(b): int(histogram[b]) for b in np.flatnonzero(histogram)}]
+        tile_stats.append(tiles)
+    return ext_counts, cell_counts, tile_stats
+
+
+def benchmark(blockSize=1024, levels=4, with02=True, repeat=5, seed=0):
+    """Time evaluateBlock on a synthetic float32 block with the NumPy steps and with the compiled kernel.
+
+    The block holds water surface elevations with NoData holes and a few cells out of tolerance. The two
+    results are compared (flags, reclassify, valid masks and tile stats), and the best of repeat runs of
+    each is printed in ms per block. Returns (NumPy seconds, kernel seconds or None).
+    """
+    import FFRMS_Raster_QC_Engine as engine
+    rng = np.random.default_rng(seed)
+    n_rasters = levels + (1 if with02 else 0)
+    base = rng.uniform(100, 200, (blockSize, blockSize)).astype(np.float32)
+    stack = np.stack([base + level for level in range(levels)] + ([base + 0.5] if with02 else []))
+    stack += rng.normal(0, 0.01, stack.shape).astype(np.float32)
+    stack[rng.random(stack.shape) < 0.2] = -9999.0
+    nodatas = [-9999.0] * n_rasters
+    n_pairs = n_rasters - 1
+
+    def run(useKernel):
+        outs = np.empty((2 * n_pairs, blockSize, blockSize), dtype=np.uint8)
+        valid = np.empty(stack.shape, dtype=bool)
+        buffers = engine.blockBuffers(n_rasters, blockSize, blockSize, stack.dtype)
+        best = math.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = engine.evaluateBlock(stack, nodatas, with02, outs[:n_pairs], outs[n_pairs:], valid,
+                                          buffers=buffers, useKernel=useKernel)
+            best = min(best, time.perf_counter() - start)
+        return best, outs, valid, result
+
+    numpy_time, numpy_outs, numpy_valid, numpy_result = run(False)
+    print(f"NumPy steps: {numpy_time * 1000:.1f} ms per {blockSize} x {blockSize} block of {n_rasters} rasters")
+    if not AVAILABLE:
+        print("numba is not installed; only the NumPy steps were timed.")
+        return numpy_time, None
+    run(True)   # compile, or load the cached compilation
+    kernel_time, kernel_outs, kernel_valid, kernel_result = run(True)
+    same = (np.array_equal(numpy_outs, kernel_outs) and np.array_equal(numpy_valid, kernel_valid) and
+            all(np.array_equal(a, b) for a, b in zip(numpy_result[:2], kernel_result[:2])) and
+            all(len(a) == len(b) and all(a[key][:4] + a[key][5:] == b[key][:4] + b[key][5:] and
+                                         math.isclose(a[key][4], b[key][4], rel_tol=1e-9, abs_tol=1e-6) for key in a)
+                for a, b in zip(numpy_result[2], kernel_result[2])))
+    print(f"Compiled kernel: {kernel_time * 1000:.1f} ms per block, {numpy_time / kernel_time:.1f} x faster; "
+          f"results {'identical' if same else 'DIFFERENT'}")
+    return numpy_time, kernel_time
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1024)
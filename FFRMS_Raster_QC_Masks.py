@@ -0,0 +1,181 @@
+#-------------------------------------------------------------------------------
+# Name:        FFRMS_Raster_QC_Masks.py
+# Purpose:     Bit-packed store for the boolean masks of the FFRMS raster QC tool
+#              (flagged extent cells, flagged cell values). One bit per cell, in
+#              fixed-size tiles, so any tile can be read or written on its own and
+#              the file can be memory mapped.
+# Author:      Rachel Fan, GISP
+#              rachel.fan@stantec.com
+# Version:     1.5
+# Updated:     10/17/2026
+# Created:     10/17/2026
+# Copyright:   (c) rfan2023
+
+#-------------------------------------------------------------------------------
+
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'QCMASK1\0'
+MASK_EXTENSION = ".qcmask"
+TILE_SIZE = 256   #rows/columns per tile, a multiple of 8
+
+
+class PackedMask:
+    """Boolean mask of a raster grid stored with one bit per cell, tile by tile.
+
+    File layout: MAGIC, the length of a JSON header and the header (grid size, tile size, transform,
+    CRS WKT), then one fixed-size slot of tile_size x tile_size bits per tile in row order, then a
+    JSON trailer with the number of True cells per tile. Tiles that are never written read as False.
+    Use createMask / openMask rather than the constructor.
+    """
+
+    def __init__(self, path, mode, header, data_start, counts, mmap=False):
+        self.path, self.mode, self.header, self.data_start = path, mode, header, data_start
+        self.width, self.height, self.tile_size = header['width'], header['height'], header['tile_size']
+        self.tiles_x = -(-self.width // self.tile_size)
+        self.tiles_y = -(-self.height // self.tile_size)
+        self.tile_bytes = self.tile_size * self.tile_size // 8
+        self.counts = counts
+        self.file = open(path, 'r+b' if mode == 'w' else 'rb')
+        self.tiles = None
+        if mmap and self.tiles_x * self.tiles_y:
+            self.tiles = np.memmap(self.file, dtype=np.uint8, mode='r+' if mode == 'w' else 'r', offset=data_start,
+                                   shape=(self.tiles_y * self.tiles_x, self.tile_bytes))
+
+    @property
+    def transform(self):
+        return tuple(self.header['transform'])
+
+    @property
+    def crs_wkt(self):
+        return self.header['crs_wkt']
+
+    def count(self):
+        """Number of True cells in the mask."""
+        return int(sum(self.counts))
+
+    def tileWindow(self, tile_row, tile_col):
+        """(row, col, rows, cols) of the cells of a tile in the grid."""
+        row, col = tile_row * self.tile_size, tile_col * self.tile_size
+        return row, col, min(self.tile_size, self.height - row), min(self.tile_size, self.width - col)
+
+    def readTile(self, tile_row, tile_col):
+        """Boolean array of one tile, cut to the grid at the right and bottom edges."""
+        row, col, rows, cols = self.tileWindow(tile_row, tile_col)
+        index = tile_row * self.tiles_x + tile_col
+        if self.counts[index] == 0:
+            return np.zeros((rows, cols), dtype=bool)
+        if self.tiles is not None:
+            packed = self.tiles[index]
+        else:
+            self.file.seek(self.data_start + index * self.tile_bytes)
+            packed = np.frombuffer(self.file.read(self.tile_bytes), dtype=np.uint8)
+        tile = np.unpackbits(packed).reshape(self.tile_size, self.tile_size).view(bool)
+        return tile[:rows, :cols]
+
+    def writeTile(self, tile_row, tile_col, tile):
+        """Write a boolean tile (cut to the grid at the edges like readTile)."""
+        index = tile_row * self.tiles_x + tile_col
+        full = np.zeros((self.tile_size, self.tile_size), dtype=bool)
+        full[:tile.shape[0], :tile.shape[1]] = tile
+        packed = np.packbits(full)
+        self.counts[index] = int(np.count_nonzero(tile))
+        if self.tiles is not None:
+            self.tiles[index] = packed
+        else:
+            self.file.seek(self.data_start + index * self.tile_bytes)
+            self.file.write(packed.tobytes())
+
+    def tilesIn(self, row, col, rows, cols):
+        """Yield (tile_row, tile_col) of the tiles that overlap a window of cells."""
+        for tile_row in range(row // self.tile_size, (row + rows - 1) // self.tile_size + 1):
+            for tile_col in range(col // self.tile_size, (col + cols - 1) // self.tile_size + 1):
+                yield tile_row, tile_col
+
+    def write(self, array, row=0, col=0):
+        """Write a boolean array with its upper left cell at (row, col). Windows need not be tile aligned."""
+        rows, cols = array.shape
+        for tile_row, tile_col in self.tilesIn(row, col, rows, cols):
+            tile_row_off, tile_col_off, tile_rows, tile_cols = self.tileWindow(tile_row, tile_col)
+            r0, c0 = max(row, tile_row_off), max(col, tile_col_off)
+            r1, c1 = min(row + rows, tile_row_off + tile_rows), min(col + cols, tile_col_off + tile_cols)
+            part = array[r0 - row:r1 - row, c0 - col:c1 - col]
+            if (r0, c0, r1, c1) == (tile_row_off, tile_col_off, tile_row_off + tile_rows, tile_col_off + tile_cols):
+                tile = part
+            else:
+                tile = self.readTile(tile_row, tile_col).copy()
+                tile[r0 - tile_row_off:r1 - tile_row_off, c0 - tile_col_off:c1 - tile_col_off] = part
+            self.writeTile(tile_row, tile_col, tile)
+
+    def read(self, row=0, col=0, rows=None, cols=None):
+        """Boolean array of a window of cells (the whole grid by default)."""
+        rows = self.height - row if rows is None else rows
+        cols = self.width - col if cols is None else cols
+        out = np.zeros((rows, cols), dtype=bool)
+        if rows <= 0 or cols <= 0:
+            return out
+        for tile_row, tile_col in self.tilesIn(row, col, rows, cols):
+            if self.counts[tile_row * self.tiles_x + tile_col] == 0:
+                continue
+            tile_row_off, tile_col_off, tile_rows, tile_cols = self.tileWindow(tile_row, tile_col)
+            r0, c0 = max(row, tile_row_off), max(col, tile_col_off)
+            r1, c1 = min(row + rows, tile_row_off + tile_rows), min(col + cols, tile_col_off + tile_cols)
+            out[r0 - row:r1 - row, c0 - col:c1 - col] = self.readTile(tile_row, tile_col)[
+                r0 - tile_row_off:r1 - tile_row_off, c0 - tile_col_off:c1 - tile_col_off]
+        return out
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.tiles is not None:
+            self.tiles.flush()
+            self.tiles = None
+        if self.mode == 'w':
+            self.file.seek(self.data_start + len(self.counts) * self.tile_bytes)
+            self.file.write(json.dumps(self.counts).encode())
+            self.file.truncate()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def createMask(path, width, height, transform, crs_wkt='', tileSize=TILE_SIZE, mmap=False):
+    """Create an all-False PackedMask for a width x height grid and open it for writing.
+
+    transform is the (a, b, c, d, e, f) affine of the grid. The tile slots are allocated by extending the
+    file, which leaves a sparse file on NTFS/ext4 until tiles are written.
+    """
+    if tileSize % 8:
+        raise ValueError("Mask tile size must be a multiple of 8.")
+    header = {'width': int(width), 'height': int(height), 'tile_size': int(tileSize),
+              'transform': [float(value) for value in tuple(transform)[:6]], 'crs_wkt': crs_wkt or ''}
+    header_bytes = json.dumps(header).encode()
+    data_start = len(MAGIC) + 4 + len(header_bytes)
+    n_tiles = -(-width // tileSize) * -(-height // tileSize)
+    with open(path, 'wb') as mask_file:
+        mask_file.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        mask_file.truncate(data_start + n_tiles * tileSize * tileSize // 8)
+    return PackedMask(path, 'w', header, data_start, [0] * n_tiles, mmap)
+
+def openMask(path, mmap=False):
+    """Open a PackedMask for reading; with mmap the tile data is memory mapped instead of read."""
+    with open(path, 'rb') as mask_file:
+        if mask_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a QC mask file.")
+        header_length = struct.unpack('<I', mask_file.read(4))[0]
+        header = json.loads(mask_file.read(header_length))
+        data_start = len(MAGIC) + 4 + header_length
+        tile_size = header['tile_size']
+        n_tiles = -(-header['width'] // tile_size) * -(-header['height'] // tile_size)
+        mask_file.seek(data_start + n_tiles * tile_size * tile_size // 8)
+        counts = json.loads(mask_file.read() or b'null')
+    if counts is None or len(counts) != n_tiles:
+        raise ValueError(path + " was not closed after writing.")
+    return PackedMask(path, 'r', header, data_start, counts, mmap)
@@ -0,0 +1,45 @@
+#-------------------------------------------------------------------------------
+# Name:        FFRMS_Raster_QC_Remap.py
+# Purpose:     RemapRange tables and tolerance bands of the cell value checks of the
+#              FFRMS raster QC tool. Standard library only, so it can be imported by
+#              the ArcGIS tool as well as by the NumPy engine.
+# Author:      Rachel Fan, GISP
+#              rachel.fan@stantec.com
+# Version:     1.5
+# Updated:     10/17/2026
+# Created:     10/17/2026
+# Copyright:   (c) rfan2023
+
+#-------------------------------------------------------------------------------
+
+# RemapRange tables used by arcpy.sa.Reclassify in FFRMS_Raster_QC_Tool_V1.5.py,
+# as [from, to, new value]. A value on the boundary of two ranges goes to the lower range.
+CELL_REMAP = [[-1, 0.95, 1], [0.95, 1.05, 0], [1.05, 10, 1]]   #higher FVA minus lower FVA (R14)
+PCT02_REMAP = [[-10, 0, 1], [0, 10, 0]]                        #0_2PCT minus 00FVA
+TOLERANCE = 0.05   #half width (ft) of the CELL_REMAP pass band around 1 ft
+
+
+def cellRemap(tolerance=TOLERANCE):
+    """RemapRange table of the freeboard level check with a pass band of 1 ft +/- tolerance (CELL_REMAP for 0.05)."""
+    return [[-1, round(1 - tolerance, 6), 1], [round(1 - tolerance, 6), round(1 + tolerance, 6), 0],
+            [round(1 + tolerance, 6), 10, 1]]
+
+def parseTolerances(text):
+    """Pass bands from a comma separated string ("0.05, 0.1"), in the given order without repeats.
+
+    Raises ValueError with a readable message for an item that is not a number or not between 0 and 1 ft.
+    """
+    tolerances = []
+    for item in str(text).split(','):
+        if item.strip():
+            try:
+                tolerance = float(item)
+            except ValueError:
+                raise ValueError(f"Tolerance '{item.strip()}' is not a number; separate the bands with commas.")
+            if not 0 < tolerance < 1:
+                raise ValueError(f"Tolerance {item.strip()} ft is not between 0 and 1 ft.")
+            if tolerance not in tolerances:
+                tolerances.append(tolerance)
+    if not tolerances:
+        raise ValueError("No tolerance given.")
+    return tolerances
@@ -0,0 +1,197 @@
+#-------------------------------------------------------------------------------
+# Name:        FFRMS_Raster_QC_Sample.py
+# Purpose:     Quick-look estimate of the cell value check (R14) of the FFRMS raster
+#              QC tool from a stratified random sample of cells. Reports, for every
+#              pair, the estimated fraction and area of the cells out of tolerance
+#              with 95% confidence intervals, for a fixed number of sampled cells.
+#              Uses the block reading and reclassify code of FFRMS_Raster_QC_Engine.
+# Author:      Rachel Fan, GISP
+#              rachel.fan@stantec.com
+# Version:     1.5
+# Updated:     10/17/2026
+# Created:     10/17/2026
+# Copyright:   (c) rfan2023
+
+#-------------------------------------------------------------------------------
+
+import csv
+import math
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+import FFRMS_Raster_QC_Engine as engine
+
+SAMPLE_BUDGET = 10000   #sampled cells per run, shared by all pairs
+MIN_STRATUM_SAMPLES = 10   #sampled cells per stratum at least, for its variance
+Z_95 = 1.959964
+
+
+def footprintBoxes(datasets, tileIndexes, transform, width, height, tileSize=engine.TILE_INDEX_SIZE):
+    """Sampling frame: (tile row, tile col) -> [row0, col0, row1, col1) box of the common grid cells to sample.
+
+    Each tile of the common grid is cut to the bounding box of the valid data of all rasters in it, from
+    their tile indexes. Without a tile index for every raster the whole grid is the frame.
+    """
+    boxes = {}
+    if any(index is None for index in tileIndexes):
+        for window in engine.iterBlockWindows(width, height, tileSize):
+            row, col = int(window.row_off), int(window.col_off)
+            boxes[(row // tileSize, col // tileSize)] = [row, col, row + int(window.height), col + int(window.width)]
+        return boxes
+    for ds, tileIndex in zip(datasets, tileIndexes):
+        row_shift, col_shift = engine.gridOffset(ds, transform)
+        for box in tileIndex["tiles"].values():
+            window = Window(box[1] + col_shift, box[0] + row_shift, box[3] - box[1], box[2] - box[0])
+            for tile_row, tile_col, part in engine.blockTiles(window, tileSize):
+                part = [int(part.row_off), int(part.col_off), int(part.row_off + part.height), int(part.col_off + part.width)]
+                known = boxes.get((tile_row, tile_col))
+                if known:
+                    part = [min(known[0], part[0]), min(known[1], part[1]), max(known[2], part[2]), max(known[3], part[3])]
+                boxes[(tile_row, tile_col)] = part
+    return boxes
+
+def strata(boxes, budget, tileSize=engine.TILE_INDEX_SIZE):
+    """Group the frame tiles into square strata of 2^k x 2^k tiles, with k the smallest that leaves room for
+    MIN_STRATUM_SAMPLES cells per stratum within the budget, or that puts every tile in one stratum.
+    Returns a list of lists of boxes, empty for an empty frame."""
+    level = 0
+    while True:
+        groups = {}
+        for (tile_row, tile_col), box in sorted(boxes.items()):
+            groups.setdefault((tile_row >> level, tile_col >> level), []).append(box)
+        if len(groups) <= 1 or len(groups) * MIN_STRATUM_SAMPLES <= budget:
+            return list(groups.values())
+        level += 1
+
+def sampleCells(stratumBoxes, n, rng):
+    """n random cells (with replacement) of the boxes of a stratum, each cell with the same probability."""
+    areas = np.array([(box[2] - box[0]) * (box[3] - box[1]) for box in stratumBoxes], dtype=np.float64)
+    picks = rng.choice(len(stratumBoxes), size=n, p=areas / areas.sum())
+    boxes = np.array(stratumBoxes)[picks]
+    rows = boxes[:, 0] + (rng.random(n) * (boxes[:, 2] - boxes[:, 0])).astype(np.int64)
+    cols = boxes[:, 1] + (rng.random(n) * (boxes[:, 3] - boxes[:, 1])).astype(np.int64)
+    return rows, cols
+
+def readCells(ds, rows, cols, transform, tileIndex=None, tileSize=engine.TILE_INDEX_SIZE):
+    """Values of ds at cells of the common grid. The cells are grouped by tile of tileSize cells, and the
+    window around the cells of a tile is read once with engine.readBlock."""
+    values = np.empty(rows.size, dtype=ds.dtypes[0])
+    if rows.size == 0:
+        return values
+    order = np.lexsort((cols // tileSize, rows // tileSize))
+    tiles = np.stack([rows[order] // tileSize, cols[order] // tileSize], axis=1)
+    starts = np.flatnonzero(np.any(tiles[1:] != tiles[:-1], axis=1)) + 1
+    for cells in np.split(order, starts):
+        row0, col0 = int(rows[cells].min()), int(cols[cells].min())
+        window = Window(col0, row0, int(cols[cells].max()) - col0 + 1, int(rows[cells].max()) - row0 + 1)
+        block = engine.readBlock(ds, window, transform, tileIndex)
+        values[cells] = block[rows[cells] - row0, cols[cells] - col0]
+    return values
+
+def stratifiedEstimate(sizes, flagged, withData):
+    """Stratified estimates of the number of flagged cells, of the cells with data and of their ratio.
+
+    sizes holds the number of cells N_h of each stratum, flagged and withData the 0/1 sample values of each
+    stratum. Returns (flagged total, its variance, cells with data, ratio, ratio variance); the variance of
+    the ratio is the usual linearized one.
+    """
+    total = sum(size * y.mean() for size, y in zip(sizes, flagged))
+    data = sum(size * z.mean() for size, z in zip(sizes, withData))
+    ratio = total / data if data else 0.0
+    variance = sum(size ** 2 * y.var(ddof=1) / y.size for size, y in zip(sizes, flagged) if y.size > 1)
+    ratio_variance = sum(size ** 2 * (y - ratio * z).var(ddof=1) / y.size
+                         for size, y, z in zip(sizes, flagged, withData) if y.size > 1) / data ** 2 if data else 0.0
+    return total, variance, data, ratio, ratio_variance
+
+def runSampleQC(rasters, budget=SAMPLE_BUDGET, seed=0, tileIndex=True):
+    """Estimate the share and area of the cells out of tolerance (R14) of every pair from a stratified sample.
+
+    The frame is the common grid, cut to the valid data of the rasters when every raster has a tile index
+    sidecar (see footprintBoxes). Its tiles are grouped into strata (see strata), and the budget is split
+    over the strata in proportion to their size, with at least MIN_STRATUM_SAMPLES cells each. Every sampled
+    cell is read from all rasters and classified as in the exact engine. A cell counts for a pair when both
+    rasters hold data there, as in compareCellvalue.
+
+    The intervals are normal 95% intervals. When no flagged cell is sampled for a pair, the upper bound of
+    the fraction is 3 / (sampled cells with data), the rule of three, since the normal interval would be empty.
+
+    Returns a list with one dict per pair: label, samples, samples_with_data, cells_with_data (estimated),
+    fraction, fraction_ci, area and area_ci (in squared map units); with no data in the rasters, nothing is
+    sampled and the estimates are 0. Raises ValueError when budget is below MIN_STRATUM_SAMPLES.
+    """
+    if budget < MIN_STRATUM_SAMPLES:
+        raise ValueError(f"The sample needs at least {MIN_STRATUM_SAMPLES} cells, not {budget}.")
+    levels = [key for key, path in rasters.items() if key != engine.PCT02_KEY and path]
+    with02 = bool(rasters.get(engine.PCT02_KEY))
+    keys = levels + ([engine.PCT02_KEY] if with02 else [])
+    pairs = engine.qcPairs(levels, with02)
+    datasets = {key: rasterio.open(rasters[key]) for key in keys}
+    try:
+        for key in keys[1:]:
+            engine.checkSameGrid(datasets[keys[0]], datasets[key])
+        transform, width, height = engine.unionGrid([datasets[key] for key in keys])
+        dtype = np.result_type(*[datasets[key].dtypes[0] for key in keys])
+        tile_indexes = [engine.loadTileIndex(rasters[key]) if tileIndex else None for key in keys]
+        boxes = footprintBoxes([datasets[key] for key in keys], tile_indexes, transform, width, height)
+        groups = strata(boxes, budget)
+        sizes = [sum((box[2] - box[0]) * (box[3] - box[1]) for box in group) for group in groups]
+        spare = budget - MIN_STRATUM_SAMPLES * len(groups)
+        counts = [min(size, MIN_STRATUM_SAMPLES + int(spare * size / sum(sizes))) for size in sizes]
+        print(f"Sampling {sum(counts)} cells in {len(groups)} strata of {len(boxes)} tiles.")
+
+        rng = np.random.default_rng(seed)
+        samples = [sampleCells(group, n, rng) for group, n in zip(groups, counts)]
+        if not samples:
+            print("The rasters hold no data: nothing is sampled.")
+            samples = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))]
+        rows, cols = np.concatenate([s[0] for s in samples]), np.concatenate([s[1] for s in samples])
+        values, valid = [], []
+        for key, tile_index in zip(keys, tile_indexes):
+            ds = datasets[key]
+            cells = readCells(ds, rows, cols, transform, tile_index).astype(dtype, copy=False)
+            values.append(cells)
+            valid.append(engine.validMask(cells, ds.nodata))
+    finally:
+        for ds in datasets.values():
+            ds.close()
+
+    cell_area = abs(transform.a * transform.e)
+    bounds = np.cumsum([0] + counts)
+    results = []
+    for pair in pairs:
+        lower, higher = pair["lower_index"], pair["higher_index"]
+        both = valid[lower] & valid[higher]
+        flagged = engine.reclassifyArray(values[higher] - values[lower], both, pair["remap"]) == 1
+        split = lambda arr: [arr[start:end].astype(np.float64) for start, end in zip(bounds[:-1], bounds[1:])]
+        total, variance, data, ratio, ratio_variance = stratifiedEstimate(sizes, split(flagged), split(both))
+        n_data = int(np.count_nonzero(both))
+        if flagged.any():
+            half, ratio_half = Z_95 * math.sqrt(variance), Z_95 * math.sqrt(ratio_variance)
+            fraction_ci = (max(ratio - ratio_half, 0.0), min(ratio + ratio_half, 1.0))
+            area_ci = (max(total - half, 0.0) * cell_area, (total + half) * cell_area)
+        else:
+            upper = min(3.0 / n_data, 1.0) if n_data else 1.0
+            fraction_ci, area_ci = (0.0, upper), (0.0, upper * data * cell_area)
+        results.append({"label": pair["label"], "samples": int(rows.size), "samples_with_data": n_data,
+                        "cells_with_data": data, "fraction": ratio, "fraction_ci": fraction_ci,
+                        "area": total * cell_area, "area_ci": area_ci})
+        print(f"{pair['label']}: {ratio:.4%} of the cells out of tolerance "
+              f"(95% CI {fraction_ci[0]:.4%} - {fraction_ci[1]:.4%}), about {total * cell_area:,.0f} sq map units.")
+    return results
+
+def writeSampleCsv(results, output_csv):
+    """Write the sampling estimates, one row per pair."""
+    with open(output_csv, 'w', newline='') as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(['Compared rasters', 'Sampled cells', 'Sampled cells with data', 'Estimated cells with data',
+                             'Fraction out of tolerance', 'Fraction 95% CI low', 'Fraction 95% CI high',
+                             'Area out of tolerance (sq map units)', 'Area 95% CI low', 'Area 95% CI high'])
+        for result in results:
+            csv_writer.writerow([result["label"], result["samples"], result["samples_with_data"],
+                                 round(result["cells_with_data"]), f"{result['fraction']:.6f}",
+                                 f"{result['fraction_ci'][0]:.6f}", f"{result['fraction_ci'][1]:.6f}",
+                                 f"{result['area']:.1f}", f"{result['area_ci'][0]:.1f}", f"{result['area_ci'][1]:.1f}"])
+    print("Data written to CSV:", output_csv)
+    return output_csv
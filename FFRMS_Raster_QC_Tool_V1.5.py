@@ -24,6 +24,13 @@ import csv
 import time
 import pandas as pd
 from arcpy.sa import *
+from concurrent.futures import ProcessPoolExecutor
+
+import FFRMS_Raster_QC_Cache as qccache
+import FFRMS_Raster_QC_Header as qcheader
+import FFRMS_Raster_QC_Remap as qcremap
+
+POLYGON_CACHE_BYTES = 5 * 1024**3   #default size limit of the polygon cache in the Temp folder
 
 
 def check_extention():
@@ -79,27 +86,29 @@ def log_message(message):
         arcpy.AddMessage(message)
         log.write(message + "\n")
         
-def compareExtent(raster0, raster1, raster2, raster3,tempFolder, shapefilesFolder): #Function to compare the extent of 00FVA, 01FVA, 02 FVA and 03FVA 
+def rasterToPolygonCached(in_raster, tempFolder, cacheBytes=POLYGON_CACHE_BYTES):
+    """Int() + RasterToPolygon of a FVA raster, memoized in the PolygonCache folder under Temp.
+
+    The polygons are keyed by the content fingerprint of the raster and the conversion parameters, so an
+    unchanged raster is polygonized once and shared by compareExtent, compareExtent02 and later runs.
+    """
+    def convert(out_shp):
+        raster_int = arcpy.sa.Int(arcpy.Raster(in_raster))
+        arcpy.conversion.RasterToPolygon(raster_int, out_shp, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART")
+    params = ["Int", "RasterToPolygon", "NO_SIMPLIFY", "MULTIPLE_OUTER_PART"]
+    return qccache.cachedConversion(os.path.join(tempFolder, "PolygonCache"), in_raster, params, convert,
+                                    "footprint.shp", cacheBytes)
+
+def compareExtent(raster0, raster1, raster2, raster3,tempFolder, shapefilesFolder, cacheBytes=POLYGON_CACHE_BYTES): #Function to compare the extent of 00FVA, 01FVA, 02 FVA and 03FVA 
     """compare raster extent between each adjecent freeboard value set: 00FVA vs 01FVA, 02FVA vs 03FVA, 02FVA vs 03FVA"""
     arcpy.env.workspace = tempFolder
     arcpy.env.compression = "LZW"
      
-    #convert raster to polygon
-    polyFva0 = os.path.join(tempFolder, "FVA0.shp")
-    raster0_int = arcpy.sa.Int(arcpy.Raster(raster0))
-    arcpy.conversion.RasterToPolygon(raster0_int, polyFva0, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART") #direct output shp to temp folder
-          
-    polyFva1 = os.path.join(tempFolder, "FVA1.shp")
-    raster1_int = arcpy.sa.Int(arcpy.Raster(raster1))
-    arcpy.conversion.RasterToPolygon(raster1_int, polyFva1, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART")
-    
-    polyFva2 = os.path.join(tempFolder, "FVA2.shp")
-    raster2_int = arcpy.sa.Int(arcpy.Raster(raster2))
-    arcpy.conversion.RasterToPolygon(raster2_int, polyFva2, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART")
-    
-    polyFva3 = os.path.join(tempFolder, "FVA3.shp")
-    raster3_int = arcpy.sa.Int(arcpy.Raster(raster3))
-    arcpy.conversion.RasterToPolygon(raster3_int, polyFva3, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART")    
+    #convert raster to polygon (cached, see rasterToPolygonCached)
+    polyFva0 = rasterToPolygonCached(raster0, tempFolder, cacheBytes)
+    polyFva1 = rasterToPolygonCached(raster1, tempFolder, cacheBytes)
+    polyFva2 = rasterToPolygonCached(raster2, tempFolder, cacheBytes)
+    polyFva3 = rasterToPolygonCached(raster3, tempFolder, cacheBytes)
     
     #create extent difference shapefile by erasing the lower values from higher values
     clipFva1_0 = os.path.join(tempFolder, "clipFva1_0.shp")
@@ -215,18 +224,13 @@ def compareExtent(raster0, raster1, raster2, raster3,tempFolder, shapefilesFolde
         
     return diff0_1_sts, diff1_2_sts, diff2_3_sts
 
-def compareExtent02(raster0, raster02, tempFolder, shapefilesFolder):
+def compareExtent02(raster0, raster02, tempFolder, shapefilesFolder, cacheBytes=POLYGON_CACHE_BYTES):
     arcpy.env.workspace = tempFolder
     arcpy.env.compression = "LZW"
     
-    #convert raster to polygon
-    polyFva0 = os.path.join(tempFolder, "FVA0.shp")
-    raster0_int = arcpy.sa.Int(arcpy.Raster(raster0))
-    arcpy.conversion.RasterToPolygon(raster0_int, polyFva0, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART") #direct output shp to temp folder
-    
-    polyFva02 = os.path.join(tempFolder, "FVA02.shp")
-    raster02_int = arcpy.sa.Int(arcpy.Raster(raster02))
-    arcpy.conversion.RasterToPolygon(raster02_int, polyFva02, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART") #direct output shp to temp folder
+    #convert raster to polygon (FVA0 is normally a cache hit from compareExtent)
+    polyFva0 = rasterToPolygonCached(raster0, tempFolder, cacheBytes)
+    polyFva02 = rasterToPolygonCached(raster02, tempFolder, cacheBytes)
     #print("Raster 0.2% to Polygon done at " + polyFva02)
     
     clipFva0_02 = os.path.join(tempFolder, "clipFva0_02.shp")
@@ -267,7 +271,7 @@ def compareExtent02(raster0, raster02, tempFolder, shapefilesFolder):
         
     return diff02_0_sts
 
-def compareCellvalue(raster0, raster1, raster2, raster3, tempFolder, shapefilesFolder):
+def compareCellvalue(raster0, raster1, raster2, raster3, tempFolder, shapefilesFolder, tolerance=qcremap.TOLERANCE):
     """run cell size compare on each raster"""
     try:
         
@@ -281,17 +285,17 @@ def compareCellvalue(raster0, raster1, raster2, raster3, tempFolder, shapefilesF
         #minus3.save(os.path.join(tempFolder, "minus3.tif"))
         print("Minus raster calculation are complete.")
 
-        reclas1 = arcpy.sa.Reclassify(minus1, "Value", RemapRange([[-1,0.95,1],[0.95,1.05,0],[1.05,10,1]]))
+        reclas1 = arcpy.sa.Reclassify(minus1, "Value", RemapRange(qcremap.cellRemap(tolerance)))
         reclas1.save(os.path.join(tempFolder, "reclassify1"))
         #arcpy.management.CopyRaster(reclas1, os.path.join(tempFolder,"reclass1.tif"))
         print("1/3 reclassify tasks is finished.")
         
-        reclas2 = arcpy.sa.Reclassify(minus2, "Value", RemapRange([[-1,0.95,1],[0.95,1.05,0],[1.05,10,1]]))
+        reclas2 = arcpy.sa.Reclassify(minus2, "Value", RemapRange(qcremap.cellRemap(tolerance)))
         reclas2.save(os.path.join(tempFolder, "reclassify2"))
         #arcpy.management.CopyRaster(reclas2, os.path.join(tempFolder,"reclass2.tif"))
         print("2/3 reclassify tasks is finished.")
         
-        reclas3 = arcpy.sa.Reclassify(minus3, "Value", RemapRange([[-1,0.95,1],[0.95,1.05,0],[1.05,10,1]]))
+        reclas3 = arcpy.sa.Reclassify(minus3, "Value", RemapRange(qcremap.cellRemap(tolerance)))
         reclas3.save(os.path.join(tempFolder, "reclassify3"))
         #arcpy.management.CopyRaster(reclas3, os.path.join(tempFolder,"reclass3.tif"))
         print("3/3 reclassify tasks is finished.")
@@ -309,7 +313,7 @@ def compareCellvalue02(raster0, raster02, tempFolder, shapefilesFolder):
         difference = RasterCalculator([raster02, raster0], ["x", "y"], "x-y", "UnionOf", "FirstOf")
         # Reclassify such that positive values become 0, and negative values become 1
         # Note: The range for negative values does not need to be exact, as values are categorized based on being <0 or >0
-        reclas02 = arcpy.sa.Reclassify(difference, "Value", RemapRange([[-10, 0, 1], [0, 10, 0]]))
+        reclas02 = arcpy.sa.Reclassify(difference, "Value", RemapRange(qcremap.PCT02_REMAP))
         reclas02.save(os.path.join(tempFolder, "reclassify02"))
         print("Reclassify task for 0_2PCT minus 00FVA is finished.")
     except Exception as e:
@@ -458,8 +462,64 @@ def reportCellComp(cellDiffPts):
         print("Could not convert to points!")
     return celldiff1_0_sts
 
-def getRasterProperties(in_Raster):
+def processCellPair(job):
+    """Check the cell values of one raster pair end to end: compare, export polygons, extract points, report.
+
+    job is (lower raster, higher raster, pair name as in cellDiff1_0 / cellDiff0_02, reclassified raster or None,
+    tempFolder, shapefilesFolder, tolerance). Runs as a job of the process pool, so every intermediate is written to a Temp
+    subfolder of its own; the polygons are exported as by convertToshp / convertToshp02, so the outputs match a serial
+    run. A license checkout belongs to one process, so the job checks Spatial Analyst out in its worker and back in
+    when it ends. Returns the points shapefile and the Pass/Warning status.
+    """
+    lowerRaster, higherRaster, pairName, reclas, tempFolder, shapefilesFolder, tolerance = job
+    pairFolder = os.path.join(tempFolder, "pair" + pairName)
+    if not os.path.exists(pairFolder):
+        os.makedirs(pairFolder)
+    check_extention()
+    try:
+        return cellPairOutputs(lowerRaster, higherRaster, pairName, reclas, pairFolder, shapefilesFolder, tolerance)
+    finally:
+        arcpy.CheckInExtension("Spatial")
+
+def cellPairOutputs(lowerRaster, higherRaster, pairName, reclas, pairFolder, shapefilesFolder, tolerance):
+    """The steps of processCellPair in pairFolder, with Spatial Analyst checked out."""
+    arcpy.env.overwriteOutput = True
+    arcpy.env.compression = "LZW"
+    arcpy.env.workspace = pairFolder
+    arcpy.env.scratchWorkspace = pairFolder
+
+    is02 = pairName.endswith("_02")
+    if reclas is None:
+        if is02:
+            difference = RasterCalculator([higherRaster, lowerRaster], ["x", "y"], "x-y", "UnionOf", "FirstOf")
+            reclas = arcpy.sa.Reclassify(difference, "Value", RemapRange(qcremap.PCT02_REMAP))
+        else:
+            minus = RasterCalculator([lowerRaster, higherRaster], ["x","y"], "y-x", "UnionOf","FirstOf")
+            reclas = arcpy.sa.Reclassify(minus, "Value", RemapRange(qcremap.cellRemap(tolerance)))
+        reclas.save(os.path.join(pairFolder, "reclassify"))
+
+    cellDiff = os.path.join(pairFolder, "cellDiff" + pairName + ".shp")
+    if pairName in ("2_1", "3_2"):
+        # as convertToshp: the polygons of pairs 2 and 3 are dissolved by gridcode
+        reclasPoly = os.path.join(pairFolder, "reclas" + pairName[0] + "_poly.shp")
+        arcpy.conversion.RasterToPolygon(reclas, reclasPoly, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART")
+        arcpy.management.Dissolve(reclasPoly, cellDiff, "gridcode", None, "MULTI_PART","DISSOLVE_LINES","")
+    else:
+        arcpy.conversion.RasterToPolygon(reclas, cellDiff, "NO_SIMPLIFY","","MULTIPLE_OUTER_PART")
+    if is02:
+        cellDiffPts = extractCellValue02(cellDiff, higherRaster, lowerRaster, pairFolder, shapefilesFolder)
+    else:
+        cellDiffPts = extractCellValue(cellDiff, lowerRaster, higherRaster, pairFolder, shapefilesFolder)
+    celldiff_sts = reportCellComp(cellDiffPts)
+    return cellDiffPts, celldiff_sts
+
+def getRasterProperties(in_Raster, cacheFolder=None):
     
+    # GeoTIFF header and GeoKeys only (cached by path, mtime and size), no raster open
+    raster_properties = qcheader.headerProperties(in_Raster, cacheFolder)
+    if raster_properties:
+        return raster_properties
+
     r = sa.Raster(in_Raster)
     # check spatial references are defined
     if r.spatialReference:
@@ -485,8 +545,9 @@ def getRasterProperties(in_Raster):
     ]
     return raster_properties
 
-def generate_csv(in_raster0, in_raster1, in_raster2,in_raster3, in_raster02, output_csv):
+def generate_csv(in_raster0, in_raster1, in_raster2,in_raster3, in_raster02, output_csv, extra_rows=()):
     # Output CSV file
+    # extra_rows: complete rows written after the properties, e.g. the cell value statistics of the NumPy engine
 
     # Write the data to the CSV file
     try:
@@ -530,12 +591,15 @@ def generate_csv(in_raster0, in_raster1, in_raster2,in_raster3, in_raster02, out
             for item1, item2, item3, item4, item5, item6, item7 in zip(csvheader,qclist, in_raster0,in_raster1,in_raster2,in_raster3, in_raster02):
                 #row_str = f'{column1_data[i][0], {column1_data[1][i]}}\n'
                 csv_writer.writerow([item1, item2,item3, item4, item5,item6, item7])
+            for row in extra_rows:
+                csv_writer.writerow(row)
             print("Data written to CSV:", output_csv)
         except:
             print("Could not write to CSV")
 
-def generate_csv_wo02(in_raster0, in_raster1, in_raster2,in_raster3, output_csv):
+def generate_csv_wo02(in_raster0, in_raster1, in_raster2,in_raster3, output_csv, extra_rows=()):
     # Output CSV file
+    # extra_rows: complete rows written after the properties, e.g. the cell value statistics of the NumPy engine
 
     # Write the data to the CSV file
     try:
@@ -578,6 +642,8 @@ def generate_csv_wo02(in_raster0, in_raster1, in_raster2,in_raster3, output_csv)
             for item1, item2, item3, item4, item5, item6 in zip(csvheader,qclist, in_raster0,in_raster1,in_raster2,in_raster3):
                 #row_str = f'{column1_data[i][0], {column1_data[1][i]}}\n'
                 csv_writer.writerow([item1, item2,item3, item4, item5,item6])
+            for row in extra_rows:
+                csv_writer.writerow(row)
             print("Data written to CSV:", output_csv)
         except:
             print("Could not write to CSV")
@@ -599,349 +665,519 @@ def get_unique_filename(folder, filename):
 # Main functions start from here
 #-------------------------------------------------------------------------------
 
-#Record start time using current time
-start_time = time.time()
-current_time = time.strftime("%m-%d %X",time.localtime())
-print("Raster QC tool has started")
+if __name__ == "__main__":  # worker processes of the process pool import this script without running it
+    #Record start time using current time
+    start_time = time.time()
+    current_time = time.strftime("%m-%d %X",time.localtime())
+    print("Raster QC tool has started")
 
-# Check Spatial Analyst extention
-check_extention()
+    # Check Spatial Analyst extention
+    check_extention()
 
-#Define input and output parameters
-arcpy.env.overwriteOutput = True
-#arcpy.env.workspace = tempFolder
-arcpy.env.compression = "LZW"
-exception_occured = False
+    #Define input and output parameters
+    arcpy.env.overwriteOutput = True
+    #arcpy.env.workspace = tempFolder
+    arcpy.env.compression = "LZW"
+    exception_occured = False
+
+    scriptPath = os.path.dirname(__file__)
+    configFile = os.path.join(scriptPath, 'FFRMS_RasterQC_Configuration.xlsx')
+
+    #try:
+    config = retrieveConfig("RasterCompare")
+
+    # Assuming the folder path is provided in the config file
+    rasters_folder = config['Rasters folder path']['Value']
+    all_files = os.listdir(rasters_folder)
+
+    # Optional "Comparison engine" row: ArcPy (default) or NumPy (FFRMS_Raster_QC_Engine.py, no Spatial Analyst needed)
+    # The NumPy engine is used for both the extent and the cell value comparisons.
+    comparison_engine = 'ArcPy'
+    if 'Comparison engine' in config and pd.notna(config['Comparison engine']['Value']):
+        comparison_engine = str(config['Comparison engine']['Value']).strip()
+
+    # Optional "Polygon cache size (GB)" row: size limit of the raster-to-polygon cache in the Temp folder
+    polygon_cache_bytes = POLYGON_CACHE_BYTES
+    if 'Polygon cache size (GB)' in config and pd.notna(config['Polygon cache size (GB)']['Value']):
+        polygon_cache_bytes = int(float(config['Polygon cache size (GB)']['Value']) * 1024**3)
+
+    # Optional "Parallel workers" row: more than 1 runs the cell value check of every pair as a job on a process pool
+    parallel_workers = 1
+    if 'Parallel workers' in config and pd.notna(config['Parallel workers']['Value']):
+        parallel_workers = max(1, int(config['Parallel workers']['Value']))
+
+    # Optional "Memory budget (GB)" row: RAM ceiling of the NumPy engine. The block size and the number of workers are
+    # reduced to stay within it; without it half of the free RAM is used. Set it when several QC jobs run side by side.
+    memory_gb = None
+    if 'Memory budget (GB)' in config and pd.notna(config['Memory budget (GB)']['Value']):
+        memory_gb = float(config['Memory budget (GB)']['Value'])
+
+    # Optional "Local staging folder" row: a folder on a local disk (SSD) where the rasters are copied before the checks,
+    # so every step reads the local copies instead of the network share. The copies are kept for the next runs while the
+    # rasters are unchanged; "Staging cache size (GB)" limits the folder (least recently used rasters are removed) and
+    # "Verify staged rasters" Yes also checks the kept copies against their checksums.
+    staging_folder = None
+    if 'Local staging folder' in config and pd.notna(config['Local staging folder']['Value']):
+        staging_folder = str(config['Local staging folder']['Value']).strip()
+    staging_bytes = qccache.STAGING_BYTES
+    if 'Staging cache size (GB)' in config and pd.notna(config['Staging cache size (GB)']['Value']):
+        staging_bytes = int(float(config['Staging cache size (GB)']['Value']) * 1024**3)
+    verify_staged = False
+    if 'Verify staged rasters' in config and pd.notna(config['Verify staged rasters']['Value']):
+        verify_staged = str(config['Verify staged rasters']['Value']).strip().lower() in ('yes', 'true', '1')
+
+    # Optional "Uncompressed working copies" row: Yes makes uncompressed copies of the rasters in the Temp folder (kept for
+    # the next runs while the rasters are unchanged), which the NumPy engine reads in place instead of decoding LZW blocks
+    working_copies = False
+    if 'Uncompressed working copies' in config and pd.notna(config['Uncompressed working copies']['Value']):
+        working_copies = str(config['Uncompressed working copies']['Value']).strip().lower() in ('yes', 'true', '1')
+    if working_copies and comparison_engine.lower() != 'numpy':
+        print('"Uncompressed working copies" needs the NumPy comparison engine; the rasters are read as they are.')
+        working_copies = False
+
+    # Optional "Pre-flight check" row: Abort (default) stops before any geoprocessing when the rasters are not
+    # comparable (cell size, snap, CRS, vertical datum), Warn only reports it, Off skips the check
+    preflight_mode = 'Abort'
+    if 'Pre-flight check' in config and pd.notna(config['Pre-flight check']['Value']):
+        preflight_mode = str(config['Pre-flight check']['Value']).strip()
+
+    # Optional "Pass/fail only" row: Yes runs the NumPy engine in fail-fast mode for intake triage. Each pair stops at
+    # its first violation and no diffFva / cellDiff shapefiles are written; the csv holds the same statuses.
+    pass_fail_only = False
+    if 'Pass/fail only' in config and pd.notna(config['Pass/fail only']['Value']):
+        pass_fail_only = str(config['Pass/fail only']['Value']).strip().lower() in ('yes', 'true', '1')
+    if pass_fail_only and comparison_engine.lower() != 'numpy':
+        print('"Pass/fail only" needs the NumPy comparison engine; running the full QC.')
+        pass_fail_only = False
+
+    # Initialize variables for the rasters
+    raster0, raster1, raster2, raster3, raster02 = None, None, None, None, None
+
+    # Flag variable to control script execution
+    execution_allowed = True
+
+    # Optional "Tolerance bands (ft)" row: comma separated pass bands around 1 ft, e.g. "0.05, 0.1". The first one gives
+    # the statuses and shapefiles; the NumPy engine adds the cells out of each further band to the csv in the same pass
+    tolerances = [qcremap.TOLERANCE]
+    if 'Tolerance bands (ft)' in config and pd.notna(config['Tolerance bands (ft)']['Value']):
+        try:
+            tolerances = qcremap.parseTolerances(config['Tolerance bands (ft)']['Value'])
+        except ValueError as error:
+            print('Error in "Tolerance bands (ft)": ' + str(error))
+            execution_allowed = False
+    if len(tolerances) > 1 and comparison_engine.lower() != 'numpy':
+        print('Only the first tolerance band (' + str(tolerances[0]) + ' ft) is checked by the ArcPy engine.')
+
+    # Get a list of all TIFF files in the folder
+    tif_files = [f for f in all_files if f.endswith('.tif')]
+
+    # Initialize a dictionary to hold the detected rasters
+    detected_rasters = {"00FVA": None, "01FVA": None, "02FVA": None, "03FVA": None, "0_2PCT": None}
+
+    # Process each TIFF file to categorize them
+    for file in tif_files:
+        filename = os.path.basename(file)
+        for key in detected_rasters.keys():
+            if key in filename:
+                if detected_rasters[key] is None:
+                    detected_rasters[key] = os.path.join(rasters_folder, file)
+                else:
+                    print(f"Error: Duplicate '{key}' raster found.")
+                    execution_allowed = False
+                    break
+
+    # Assigning variables based on detection
+    if execution_allowed:
+        raster0 = detected_rasters["00FVA"]
+        raster1 = detected_rasters["01FVA"]
+        raster2 = detected_rasters["02FVA"]
+        raster3 = detected_rasters["03FVA"]
+        raster02 = detected_rasters["0_2PCT"]
+
+    # Validate presence of required rasters and report
+    if not execution_allowed or not all([raster0, raster1, raster2, raster3]):
+        print("Errors encountered or required rasters are missing. Stopping further execution.")
 
-scriptPath = os.path.dirname(__file__)
-configFile = os.path.join(scriptPath, 'FFRMS_RasterQC_Configuration.xlsx')
+    else:
+        if raster02 is not None:
+            print("All 5 rasters including 0_2PCT tif are successfully read.")
+        else:
+            print("4 rasters are successfully read.")
 
-#try:
-config = retrieveConfig("RasterCompare")
+        prefixCSV, studytypeCSV, _ = parse_filename(os.path.basename(raster0))
+        print('Prefix is read as '+prefixCSV)
+        print('Study Type is read as '+studytypeCSV)
 
-# Assuming the folder path is provided in the config file
-rasters_folder = config['Rasters folder path']['Value']
-all_files = os.listdir(rasters_folder)
+        # Name the tool created folders, csv and log using prefix and study type   
+        tempFolderName = 'Temp_'+ prefixCSV + '_' + studytypeCSV
+        tempFolder = os.path.join(scriptPath, tempFolderName)
+        if not os.path.exists(tempFolder):
+            os.makedirs(tempFolder)
 
-# Initialize variables for the rasters
-raster0, raster1, raster2, raster3, raster02 = None, None, None, None, None
+        outputFolderName = 'Output_'+ prefixCSV + '_' + studytypeCSV
+        outputFolder = os.path.join(scriptPath, outputFolderName)
+        if not os.path.exists(outputFolder):
+            os.makedirs(outputFolder)
 
-# Flag variable to control script execution
-execution_allowed = True
+        shpFolderName = 'Shapefiles_'+ prefixCSV + '_' + studytypeCSV
+        shapefilesFolder = os.path.join(outputFolder, shpFolderName)
+        if not os.path.exists(shapefilesFolder):
+            os.makedirs(shapefilesFolder)
 
-# Get a list of all TIFF files in the folder
-tif_files = [f for f in all_files if f.endswith('.tif')]
+        initCSVname = f"{prefixCSV}_{studytypeCSV}_Raster_QC_Results.csv"
+        OutputCSV = get_unique_filename(outputFolder, initCSVname)
 
-# Initialize a dictionary to hold the detected rasters
-detected_rasters = {"00FVA": None, "01FVA": None, "02FVA": None, "03FVA": None, "0_2PCT": None}
+        logName = f"{prefixCSV}_{studytypeCSV}_Tool_log.txt"
+        logFile = os.path.join(outputFolder,logName)
+        #print('logFile is ' + logFile)
 
-# Process each TIFF file to categorize them
-for file in tif_files:
-    filename = os.path.basename(file)
-    for key in detected_rasters.keys():
-        if key in filename:
-            if detected_rasters[key] is None:
-                detected_rasters[key] = os.path.join(rasters_folder, file)
-            else:
-                print(f"Error: Duplicate '{key}' raster found.")
-                execution_allowed = False
-                break
-
-# Assigning variables based on detection
-if execution_allowed:
-    raster0 = detected_rasters["00FVA"]
-    raster1 = detected_rasters["01FVA"]
-    raster2 = detected_rasters["02FVA"]
-    raster3 = detected_rasters["03FVA"]
-    raster02 = detected_rasters["0_2PCT"]
-
-# Validate presence of required rasters and report
-if not execution_allowed or not all([raster0, raster1, raster2, raster3]):
-    print("Errors encountered or required rasters are missing. Stopping further execution.")
-
-else:
-    if raster02 is not None:
-        print("All 5 rasters including 0_2PCT tif are successfully read.")
-    else:
-        print("4 rasters are successfully read.")
-
-    prefixCSV, studytypeCSV, _ = parse_filename(os.path.basename(raster0))
-    print('Prefix is read as '+prefixCSV)
-    print('Study Type is read as '+studytypeCSV)
-
-    # Name the tool created folders, csv and log using prefix and study type   
-    tempFolderName = 'Temp_'+ prefixCSV + '_' + studytypeCSV
-    tempFolder = os.path.join(scriptPath, tempFolderName)
-    if not os.path.exists(tempFolder):
-        os.makedirs(tempFolder)
-
-    outputFolderName = 'Output_'+ prefixCSV + '_' + studytypeCSV
-    outputFolder = os.path.join(scriptPath, outputFolderName)
-    if not os.path.exists(outputFolder):
-        os.makedirs(outputFolder)
-
-    shpFolderName = 'Shapefiles_'+ prefixCSV + '_' + studytypeCSV
-    shapefilesFolder = os.path.join(outputFolder, shpFolderName)
-    if not os.path.exists(shapefilesFolder):
-        os.makedirs(shapefilesFolder)
-
-    initCSVname = f"{prefixCSV}_{studytypeCSV}_Raster_QC_Results.csv"
-    OutputCSV = get_unique_filename(outputFolder, initCSVname)
-
-    logName = f"{prefixCSV}_{studytypeCSV}_Tool_log.txt"
-    logFile = os.path.join(outputFolder,logName)
-    #print('logFile is ' + logFile)
-
-    #print("Temp folder is at " + tempFolder)
-    #print("Output folder is at " + outputFolder)
-    #print("Shapefiles folder is at " + shapefilesFolder)
-    #print("Output CSV is at " + OutputCSV)
-    #print("Log file is at " + logFile)
-
-    print('')
-    print('********************************')
-    print('Import config file successfully.')
-    print('Folder structure has been set up.')
-    print('********************************')
+        #print("Temp folder is at " + tempFolder)
+        #print("Output folder is at " + outputFolder)
+        #print("Shapefiles folder is at " + shapefilesFolder)
+        #print("Output CSV is at " + OutputCSV)
+        #print("Log file is at " + logFile)
+
+        print('')
+        print('********************************')
+        print('Import config file successfully.')
+        print('Folder structure has been set up.')
+        print('********************************')
     
 
 
-    with open(logFile, "w") as log:
-        print("Start geoprocessing at ",current_time)
-        current_time = time.strftime("%m-%d %X",time.localtime())
-        log_message("Start processing at " + current_time + "\n")
+        with open(logFile, "w") as log:
+            print("Start geoprocessing at ",current_time)
+            current_time = time.strftime("%m-%d %X",time.localtime())
+            log_message("Start processing at " + current_time + "\n")
 
-        
-        if not exception_occured:
-            try:
-                
+            if preflight_mode.lower() != 'off':
+                # grids and reference systems from the GeoTIFF headers only, so a submission that is not comparable
+                # is reported in seconds instead of after the comparisons
                 print('')
                 print('********************************')
-                print('Initializing compare extent')
+                print('Initializing pre-flight check of raster alignment')
+                preflight_errors, preflight_warnings = qcheader.preflightCheck(detected_rasters, tempFolder)
+                for message in preflight_errors + preflight_warnings:
+                    print(message)
+                    log_message(message)
+                if preflight_errors and preflight_mode.lower() == 'abort':
+                    print('Rasters are not comparable. Fix the rasters above, or set "Pre-flight check" to Warn to run anyway.')
+                    print('********************************')
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Fail...Pre-flight check failed at " + current_time + "\n")
+                    exception_occured = True
+                else:
+                    print('Pre-flight check completed.')
+                    print('********************************')
+
+            if not exception_occured and staging_folder:
+                # after the pre-flight check, so rasters that cannot be compared are not copied
+                print('')
+                print('********************************')
+                print('Staging rasters to ' + staging_folder)
+                detected_rasters = qccache.stageRasters(detected_rasters, staging_folder, staging_bytes, verify=verify_staged)
+                raster0, raster1, raster2, raster3 = (detected_rasters[key] for key in ("00FVA", "01FVA", "02FVA", "03FVA"))
+                raster02 = detected_rasters["0_2PCT"]
                 current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Compare extent started at " + current_time)
+                log_message("Rasters staged to " + staging_folder + " at " + current_time + "\n")
+                print('Rasters staged.')
+                print('********************************')
+
+            if not exception_occured:
+                try:
                 
-                diff0_1_sts, diff1_2_sts, diff2_3_sts = compareExtent(raster0, raster1, raster2, raster3, tempFolder, shapefilesFolder)
-                if pd.notna(raster02):
-                    diff02_0_sts = compareExtent02(raster0, raster02, tempFolder, shapefilesFolder)
+                    print('')
+                    print('********************************')
+                    print('Initializing compare extent')
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Compare extent started at " + current_time)
                 
-                print('Compare raster extent successfully completed.')
-                print('********************************')
+                    if comparison_engine.lower() == 'numpy':
+                        # single pass over all rasters: extent (R11), cell value (R14) and property checks together.
+                        # valid-data masks instead of RasterToPolygon + Erase; only flagged regions are polygonized
+                        import FFRMS_Raster_QC_Engine as engine
+                        working_folder = os.path.join(tempFolder, 'WorkingCopies') if working_copies else None
+                        if pass_fail_only:
+                            qc_results = engine.runTriageQC(detected_rasters, tempFolder, shapefilesFolder, tolerances=tolerances,
+                                                            memoryGb=memory_gb, workingFolder=working_folder)
+                        else:
+                            qc_results = engine.runFusedQC(detected_rasters, tempFolder, shapefilesFolder, workers=parallel_workers,
+                                                           tolerances=tolerances, memoryGb=memory_gb, workingFolder=working_folder)
+                        qc_pairs = {pair["label"]: pair for pair in qc_results["pairs"]}
+                        # statuses and per-pair cell value statistics (count, area, min/max/mean difference, histogram)
+                        engine.writeSummary(qc_results["properties"], qc_results["pairs"], os.path.splitext(OutputCSV)[0] + "_summary.json")
+                        diff0_1_sts = qc_pairs["01FVA vs 00FVA"]["extent_status"]
+                        diff1_2_sts = qc_pairs["02FVA vs 01FVA"]["extent_status"]
+                        diff2_3_sts = qc_pairs["03FVA vs 02FVA"]["extent_status"]
+                        if pd.notna(raster02):
+                            diff02_0_sts = qc_pairs["02PCT vs 00FVA"]["extent_status"]
+                    else:
+                        diff0_1_sts, diff1_2_sts, diff2_3_sts = compareExtent(raster0, raster1, raster2, raster3, tempFolder, shapefilesFolder, polygon_cache_bytes)
+                        if pd.notna(raster02):
+                            diff02_0_sts = compareExtent02(raster0, raster02, tempFolder, shapefilesFolder, polygon_cache_bytes)
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Success! Compare extent finished at " + current_time + "\n")
+                    print('Compare raster extent successfully completed.')
+                    print('********************************')
+                
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Success! Compare extent finished at " + current_time + "\n")
 
-            except:
+                except:
 
-                print('')
-                print('********************************')
-                print('Error in compare extent...')
-                print('********************************')
+                    print('')
+                    print('********************************')
+                    print('Error in compare extent...')
+                    print('********************************')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Fail...Compare extent failed at" + current_time + "\n")
-                exception_occured = True
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Fail...Compare extent failed at" + current_time + "\n")
+                    exception_occured = True
                 
-        if not exception_occured:
-            try:
+            if not exception_occured:
+                try:
 
-                print('')
-                print('********************************')
-                print('Initializing comparing cell values')
-                rec_start_time = time.time()
+                    print('')
+                    print('********************************')
+                    print('Initializing comparing cell values')
+                    rec_start_time = time.time()
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Compare cell value started at " + current_time)
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Compare cell value started at " + current_time)
                 
-                reclas1, reclas2, reclas3 = compareCellvalue(raster0, raster1, raster2, raster3, tempFolder, shapefilesFolder)
-                if pd.notna(raster02):
-                    #print("Run compare cell value between 0_2PCT and FVA00")
-                    reclas02 = compareCellvalue02(raster0, raster02, tempFolder, shapefilesFolder)
+                    if comparison_engine.lower() == 'numpy':
+                        # reclassify masks were already written by the fused pass in compare extent
+                        # (not in pass/fail only mode, which writes no masks or points)
+                        reclas1 = qc_pairs["01FVA vs 00FVA"].get("reclassify")
+                        reclas2 = qc_pairs["02FVA vs 01FVA"].get("reclassify")
+                        reclas3 = qc_pairs["03FVA vs 02FVA"].get("reclassify")
+                        if pd.notna(raster02):
+                            reclas02 = qc_pairs["02PCT vs 00FVA"].get("reclassify")
+                        # so were the violation points (one point per flagged region) and the statuses
+                        cellDiff1_0_pts, celldiff1_0_sts = qc_pairs["01FVA vs 00FVA"].get("points_shp"), qc_pairs["01FVA vs 00FVA"]["cell_status"]
+                        cellDiff2_1_pts, celldiff2_1_sts = qc_pairs["02FVA vs 01FVA"].get("points_shp"), qc_pairs["02FVA vs 01FVA"]["cell_status"]
+                        cellDiff3_2_pts, celldiff3_2_sts = qc_pairs["03FVA vs 02FVA"].get("points_shp"), qc_pairs["03FVA vs 02FVA"]["cell_status"]
+                        if pd.notna(raster02):
+                            cellDiff0_02_pts, celldiff0_02_sts = qc_pairs["02PCT vs 00FVA"].get("points_shp"), qc_pairs["02PCT vs 00FVA"]["cell_status"]
+                    elif parallel_workers > 1:
+                        # compared inside the pair jobs below
+                        reclas1, reclas2, reclas3, reclas02 = None, None, None, None
+                    else:
+                        reclas1, reclas2, reclas3 = compareCellvalue(raster0, raster1, raster2, raster3, tempFolder, shapefilesFolder, tolerances[0])
+                        if pd.notna(raster02):
+                            #print("Run compare cell value between 0_2PCT and FVA00")
+                            reclas02 = compareCellvalue02(raster0, raster02, tempFolder, shapefilesFolder)
                 
-                print('Comparing cell values successfully completed.')
-                print('********************************')
+                    print('Comparing cell values successfully completed.')
+                    print('********************************')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Success! Compare cell value finished at " + current_time + "\n")
-
-                rec_finish_time = time.time()
-                time_period = str(timedelta(seconds=(rec_finish_time - rec_start_time)))
-
-            except:
-
-                print('')
-                print('********************************')
-                print('Error in comparing cell values...')
-                print('********************************')
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Success! Compare cell value finished at " + current_time + "\n")
+
+                    if parallel_workers > 1 and comparison_engine.lower() != 'numpy':
+                        # each pair's comparison, polygon export and point extraction run as one job on the process pool.
+                        # executor.map returns the results in job order, so the outputs do not depend on scheduling.
+                        jobs = [(raster0, raster1, "1_0", reclas1, tempFolder, shapefilesFolder, tolerances[0]),
+                                (raster1, raster2, "2_1", reclas2, tempFolder, shapefilesFolder, tolerances[0]),
+                                (raster2, raster3, "3_2", reclas3, tempFolder, shapefilesFolder, tolerances[0])]
+                        if pd.notna(raster02):
+                            jobs.append((raster0, raster02, "0_02", reclas02, tempFolder, shapefilesFolder, tolerances[0]))
+                        print("Running " + str(len(jobs)) + " raster pairs on " + str(min(parallel_workers, len(jobs))) + " worker processes")
+                        with ProcessPoolExecutor(max_workers=min(parallel_workers, len(jobs))) as executor:
+                            pair_results = list(executor.map(processCellPair, jobs))
+                        (cellDiff1_0_pts, celldiff1_0_sts), (cellDiff2_1_pts, celldiff2_1_sts), (cellDiff3_2_pts, celldiff3_2_sts) = pair_results[:3]
+                        if pd.notna(raster02):
+                            cellDiff0_02_pts, celldiff0_02_sts = pair_results[3]
+
+                    rec_finish_time = time.time()
+                    time_period = str(timedelta(seconds=(rec_finish_time - rec_start_time)))
+
+                except:
+
+                    print('')
+                    print('********************************')
+                    print('Error in comparing cell values...')
+                    print('********************************')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Fail...Compare cell value failed at " + current_time + "\n")
-                exception_occured = True
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Fail...Compare cell value failed at " + current_time + "\n")
+                    exception_occured = True
 
         
-        if not exception_occured:
-            try:
-
-                print('')
-                print('********************************')
-                print('Initializing exporting cell value difference shapefiles')
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Create cell value diff shapefiles started at " + current_time)
-
-                #run convertToShp to convert reclassified rasters to shapefiles
-                cellDiff1_0, cellDiff2_1, cellDiff3_2 = convertToshp(reclas1, reclas2, reclas3, tempFolder, shapefilesFolder)
-                if pd.notna(raster02):
-                    cellDiff0_02 = convertToshp02(reclas02, tempFolder, shapefilesFolder)
-                print('Convert highlighted cell values to Shapefile is complete')
-
-                #extract cell values from both lower and higher FVA rasters to result shapefiles
-                cellDiff1_0_pts = extractCellValue(cellDiff1_0, raster0, raster1, tempFolder, shapefilesFolder) 
-                cellDiff2_1_pts = extractCellValue(cellDiff2_1, raster1, raster2, tempFolder, shapefilesFolder)
-                cellDiff3_2_pts = extractCellValue(cellDiff3_2, raster2, raster3, tempFolder, shapefilesFolder)
-                if pd.notna(raster02):
-                    cellDiff0_02_pts = extractCellValue02(cellDiff0_02, raster02, raster0, tempFolder, shapefilesFolder)
-                print('Cell value difference points shapefiles are created')
-                print('********************************')
-
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Success! Create cell value diff shapefiles finished at " + current_time + "\n")
-
-            except:
-
-                print('')
-                print('********************************')
-                print('Error in exporting cell value difference shapefiles...')
-                print('********************************')
+            if not exception_occured and parallel_workers == 1 and comparison_engine.lower() != 'numpy':  # done by the pair jobs in parallel mode and by the NumPy engine
+                try:
+
+                    print('')
+                    print('********************************')
+                    print('Initializing exporting cell value difference shapefiles')
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Create cell value diff shapefiles started at " + current_time)
+
+                    #run convertToShp to convert reclassified rasters to shapefiles
+                    cellDiff1_0, cellDiff2_1, cellDiff3_2 = convertToshp(reclas1, reclas2, reclas3, tempFolder, shapefilesFolder)
+                    if pd.notna(raster02):
+                        cellDiff0_02 = convertToshp02(reclas02, tempFolder, shapefilesFolder)
+                    print('Convert highlighted cell values to Shapefile is complete')
+
+                    #extract cell values from both lower and higher FVA rasters to result shapefiles
+                    cellDiff1_0_pts = extractCellValue(cellDiff1_0, raster0, raster1, tempFolder, shapefilesFolder) 
+                    cellDiff2_1_pts = extractCellValue(cellDiff2_1, raster1, raster2, tempFolder, shapefilesFolder)
+                    cellDiff3_2_pts = extractCellValue(cellDiff3_2, raster2, raster3, tempFolder, shapefilesFolder)
+                    if pd.notna(raster02):
+                        cellDiff0_02_pts = extractCellValue02(cellDiff0_02, raster02, raster0, tempFolder, shapefilesFolder)
+                    print('Cell value difference points shapefiles are created')
+                    print('********************************')
+
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Success! Create cell value diff shapefiles finished at " + current_time + "\n")
+
+                except:
+
+                    print('')
+                    print('********************************')
+                    print('Error in exporting cell value difference shapefiles...')
+                    print('********************************')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Fail...Create cell value diff shapefiles failed at" + current_time + "\n")
-                exception_occured = True
-
-        if not exception_occured:
-            try:
-
-                print('')
-                print('********************************')
-                print('Initializing identifying cell value comparison status')
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Identify cell value comparison status started at" + current_time)
-
-                #get the PASS/FAIL status of cell value comparison result 
-                celldiff1_0_sts = reportCellComp(cellDiff1_0_pts) 
-                celldiff2_1_sts = reportCellComp(cellDiff2_1_pts)
-                celldiff3_2_sts = reportCellComp(cellDiff3_2_pts)
-                if pd.notna(raster02):
-                    celldiff0_02_sts = reportCellComp(cellDiff0_02_pts)
-                #print('Function reportCellComp is complete')
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Fail...Create cell value diff shapefiles failed at" + current_time + "\n")
+                    exception_occured = True
+
+            if not exception_occured and parallel_workers == 1 and comparison_engine.lower() != 'numpy':  # done by the pair jobs in parallel mode and by the NumPy engine
+                try:
+
+                    print('')
+                    print('********************************')
+                    print('Initializing identifying cell value comparison status')
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Identify cell value comparison status started at" + current_time)
+
+                    #get the PASS/FAIL status of cell value comparison result 
+                    celldiff1_0_sts = reportCellComp(cellDiff1_0_pts) 
+                    celldiff2_1_sts = reportCellComp(cellDiff2_1_pts)
+                    celldiff3_2_sts = reportCellComp(cellDiff3_2_pts)
+                    if pd.notna(raster02):
+                        celldiff0_02_sts = reportCellComp(cellDiff0_02_pts)
+                    #print('Function reportCellComp is complete')
                  
-                print('Cell value comparison status has been identified and saved.')
-                print('********************************')
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Success! Identify cell value comparison status finished at " + current_time + "\n")
+                    print('Cell value comparison status has been identified and saved.')
+                    print('********************************')
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Success! Identify cell value comparison status finished at " + current_time + "\n")
 
-            except:
+                except:
 
-                print('')
-                print('********************************')
-                print('Error in identifying cell value comparison status...')
-                print('********************************')
+                    print('')
+                    print('********************************')
+                    print('Error in identifying cell value comparison status...')
+                    print('********************************')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Fail...Create cell value diff shapefiles failed at" + current_time + "\n")
-                exception_occured = True
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Fail...Create cell value diff shapefiles failed at" + current_time + "\n")
+                    exception_occured = True
                 
 
-        if not exception_occured:
+            if not exception_occured:
 
-            try:
+                try:
 
-                print('')
-                print('********************************')
-                print('Initializing extracting properties of FVA rasters based on QC checklist')
+                    print('')
+                    print('********************************')
+                    print('Initializing extracting properties of FVA rasters based on QC checklist')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Read Raster properties started at " + current_time)
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Read Raster properties started at " + current_time)
                     
-                raster0_properties = getRasterProperties(raster0)
-                raster1_properties = getRasterProperties(raster1)
-                raster2_properties = getRasterProperties(raster2)
-                raster3_properties = getRasterProperties(raster3)
-
-                if pd.notna(raster02):
-                    raster02_properties = getRasterProperties(raster02)
+                    if comparison_engine.lower() == 'numpy':
+                        # read by the fused pass from the already opened rasters
+                        raster0_properties = qc_results["properties"]["00FVA"]
+                        raster1_properties = qc_results["properties"]["01FVA"]
+                        raster2_properties = qc_results["properties"]["02FVA"]
+                        raster3_properties = qc_results["properties"]["03FVA"]
+                        if pd.notna(raster02):
+                            raster02_properties = qc_results["properties"]["0_2PCT"]
+                    else:
+                        raster0_properties = getRasterProperties(raster0, tempFolder)
+                        raster1_properties = getRasterProperties(raster1, tempFolder)
+                        raster2_properties = getRasterProperties(raster2, tempFolder)
+                        raster3_properties = getRasterProperties(raster3, tempFolder)
+
+                        if pd.notna(raster02):
+                            raster02_properties = getRasterProperties(raster02, tempFolder)
                 
-                print('Raster properties of FVA rasters successfully extracted.')
-                print('********************************')
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Success! Read Raster properties finished at " + current_time + "\n")
+                    print('Raster properties of FVA rasters successfully extracted.')
+                    print('********************************')
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Success! Read Raster properties finished at " + current_time + "\n")
 
 
-            except:
+                except:
 
-                print('')
-                print('********************************')
-                print('Error in extracting of FVA rasters properties...')
-                print('********************************')
+                    print('')
+                    print('********************************')
+                    print('Error in extracting of FVA rasters properties...')
+                    print('********************************')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Fail...Read Raster properties failed at " + current_time + "\n")
-                exception_occured = True
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Fail...Read Raster properties failed at " + current_time + "\n")
+                    exception_occured = True
 
 
-        if not exception_occured:
-            try:
-                print('')
-                print('********************************')
-                print('Initializing creating QC result csv')
+            if not exception_occured:
+                try:
+                    print('')
+                    print('********************************')
+                    print('Initializing creating QC result csv')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Create QC spreadsheet started at " + current_time)
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Create QC spreadsheet started at " + current_time)
                 
-                raster0_properties.extend(("","01FVA vs 00FVA", diff0_1_sts, celldiff1_0_sts, "TBD"))
-                raster1_properties.extend(("","02FVA vs 01FVA", diff1_2_sts, celldiff2_1_sts,  "TBD"))
-                raster2_properties.extend(("","03FVA vs 02FVA",diff2_3_sts, celldiff3_2_sts,  "TBD"))
-                if pd.notna(raster02):
-                    raster3_properties.extend(("","","", "", ""))
-                    raster02_properties.extend(("","02PCT vs 00FVA", diff02_0_sts, celldiff0_02_sts, ""))
-                else:
-                    raster3_properties.extend(("","","", "", ""))
+                    raster0_properties.extend(("","01FVA vs 00FVA", diff0_1_sts, celldiff1_0_sts, "TBD"))
+                    raster1_properties.extend(("","02FVA vs 01FVA", diff1_2_sts, celldiff2_1_sts,  "TBD"))
+                    raster2_properties.extend(("","03FVA vs 02FVA",diff2_3_sts, celldiff3_2_sts,  "TBD"))
+                    if pd.notna(raster02):
+                        raster3_properties.extend(("","","", "", ""))
+                        raster02_properties.extend(("","02PCT vs 00FVA", diff02_0_sts, celldiff0_02_sts, ""))
+                    else:
+                        raster3_properties.extend(("","","", "", ""))
 
                 
-                if pd.notna(raster02):
-                    generate_csv(raster0_properties,raster1_properties,raster2_properties,raster3_properties, raster02_properties, OutputCSV)
-                else:
-                    generate_csv_wo02(raster0_properties,raster1_properties,raster2_properties,raster3_properties, OutputCSV)
+                    statistics_rows = []
+                    if comparison_engine.lower() == 'numpy':
+                        statistics_rows = engine.statisticsRows(qc_results["pairs"], [key for key, raster in detected_rasters.items() if raster])
+                    if pd.notna(raster02):
+                        generate_csv(raster0_properties,raster1_properties,raster2_properties,raster3_properties, raster02_properties, OutputCSV, statistics_rows)
+                    else:
+                        generate_csv_wo02(raster0_properties,raster1_properties,raster2_properties,raster3_properties, OutputCSV, statistics_rows)
                 
-                print('QC result csv successfully created.')
-                print('********************************')
+                    print('QC result csv successfully created.')
+                    print('********************************')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Success! Create QC spreadsheet finished at " + current_time + "\n")
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Success! Create QC spreadsheet finished at " + current_time + "\n")
          
                 
 
-            except:
+                except:
 
-                print('')
-                print('********************************')
-                print('Error in creating QC result csv...')
-                print('********************************')
+                    print('')
+                    print('********************************')
+                    print('Error in creating QC result csv...')
+                    print('********************************')
                 
-                current_time = time.strftime("%m-%d %X",time.localtime())
-                log_message("Fail...Create QC spreadsheet failed at " + current_time + "\n")
-                exception_occured = True
-
-
-        print('')
-        print('********************************')
-        arcpy.CheckInExtension("Spatial")
-        print("Spatial Extension checked in")   
-        finish_time = time.time()
-        time_period = str(timedelta(seconds=(finish_time - start_time)))
-        print("Finish processing at", current_time)
-        print("The tool has been running for", time_period)
+                    current_time = time.strftime("%m-%d %X",time.localtime())
+                    log_message("Fail...Create QC spreadsheet failed at " + current_time + "\n")
+                    exception_occured = True
+
+
+            print('')
+            print('********************************')
+            arcpy.CheckInExtension("Spatial")
+            print("Spatial Extension checked in")   
+            finish_time = time.time()
+            time_period = str(timedelta(seconds=(finish_time - start_time)))
+            print("Finish processing at", current_time)
+            print("The tool has been running for", time_period)
         
-        current_time = time.strftime("%m-%d %X",time.localtime())
-        log_message("Finish processing at " +  current_time)
-        log_message("The tool has been running for " + time_period)
+            current_time = time.strftime("%m-%d %X",time.localtime())
+            log_message("Finish processing at " +  current_time)
+            log_message("The tool has been running for " + time_period)
 